@@ -1,3 +1,4 @@
+import argparse
 import sys
 from pathlib import Path
 
@@ -5,7 +6,93 @@ sys.path.append(str(Path(__file__).resolve().parents[1]))
 
 
 if __name__ == "__main__":
-    from iraira.main import main
+    from iraira.clock import Clock
+    from iraira.hal import Hardware, HardwareKind
+    from iraira.main import StateBackend, main
+    from iraira.player import PlayerMode
+
+    parser = argparse.ArgumentParser(prog="iraira")
+    parser.add_argument(
+        "--state-backend",
+        type=lambda s: StateBackend[s],
+        choices=list(StateBackend),
+        default=StateBackend.manager,
+        help="プロセス間の状態共有方式",
+    )
+    parser.add_argument(
+        "--player-mode",
+        type=lambda s: PlayerMode[s],
+        choices=list(PlayerMode),
+        default=PlayerMode.blocking,
+        help="音声出力の方式",
+    )
+    parser.add_argument(
+        "--wavetable",
+        action="store_true",
+        help="牽引力信号を直接計算せず、波形テーブル (db/wavetable) の参照で生成する",
+    )
+    parser.add_argument(
+        "--hardware",
+        type=lambda s: HardwareKind[s],
+        choices=list(HardwareKind),
+        default=HardwareKind.raspi,
+        help="GPIO・シリアルポート・音声出力の実装",
+    )
+    parser.add_argument(
+        "--clock-speed",
+        type=float,
+        default=1.0,
+        help="--hardware simulated の場合の時刻の進む速さの倍率",
+    )
+    parser.add_argument(
+        "--serial-port",
+        default="/dev/M5_ATOM",
+        help="M5Atomのシリアルポート",
+    )
+    parser.add_argument(
+        "--headless",
+        action="store_true",
+        help="GUIを表示せず画面遷移を自動で行う",
+    )
+    parser.add_argument(
+        "--record-session",
+        type=Path,
+        default=None,
+        metavar="DIR",
+        help="GPIO・シリアル・キー入力と画面遷移をDIRに記録する。python -m iraira.session_replay で再生できる",
+    )
+    parser.add_argument(
+        "--trace",
+        type=Path,
+        default=None,
+        metavar="DIR",
+        help="入力から音声出力までの計測点をDIRに記録する。python -m iraira.tracing で遅延を集計できる",
+    )
+    parser.add_argument(
+        "--touch-sample-hz",
+        type=float,
+        default=None,
+        metavar="HZ",
+        help="壁接触のピンをGPIOのレジスタ (/dev/gpiomem) からHZ回/秒で同時に読む。指定しない場合はRPi.GPIOのエッジ検出を使う",
+    )
+    parser.add_argument(
+        "--process-metrics",
+        type=float,
+        default=None,
+        metavar="SEC",
+        help="プロセスごとのCPU使用率・メモリ・再起動回数をSEC秒ごとに表示する",
+    )
+    args = parser.parse_args()
+
+    clock = Clock(args.clock_speed if args.hardware == HardwareKind.simulated else 1.0)
+    hardware = Hardware(
+        args.hardware,
+        clock,
+        args.serial_port,
+        session_dir=args.record_session,
+        trace_dir=args.trace,
+        touch_sample_hz=args.touch_sample_hz,
+    )
 
     # アプリケーションエントリーポイント
-    main()
+    main(args.state_backend, args.player_mode, hardware, args.headless, args.process_metrics, args.wavetable)
@@ -1,12 +1,15 @@
-import sys
-import time
+from __future__ import annotations
 
-import serial
+import sys
+from collections.abc import Iterable
 
-from iraira.player import SignalParam
-from iraira.state import AppState, GameState, GuiState, Page, PlayerState
+from iraira.hal import Hardware
+from iraira.serial_protocol import ButtonEvent, Frame, FrameKind, FrameParser
+from iraira.state import AppState, GameState, GuiState, Page, PlayerState, SignalParam
+from iraira.tracing import Flow, Hop
 
 ZERO_VALUE_RANGE = 0.02  # アナログ値の中央から±この範囲の値まで，ゼロとして扱う
+READ_TIMEOUT_SEC = 0.1  # 受信がない場合に終了状態を確認する間隔
 
 
 def analog_listener(
@@ -15,64 +18,104 @@ def analog_listener(
     player_state: PlayerState,
     game_state: GameState,
     gui_state: GuiState,
+    hardware: Hardware = Hardware(),
 ) -> None:
+    """M5Atomからアナログ値とボタン操作を受信する
+
+    :param hardware: シリアルポートの実装, 受信を記録するセッションログ, 計測点の記録
+    """
     try:
-        with serial.Serial("/dev/M5_ATOM", 115200, timeout=0.01) as serial_port:
-            reading_bytes: bytes = bytes()
+        clock = hardware.clock
+        session_log = hardware.open_session_log("analog")
+        tracer = hardware.open_tracer("analog")
+        trace_key = 0
+        traced_volume = player_state.volume
+
+        # 受信するかタイムアウトするまで read がブロックするため、待機中にCPUを使わない
+        with hardware.open_serial(115200, timeout=READ_TIMEOUT_SEC) as serial_port:
+            parser = FrameParser()
 
             while app_state.is_running:
-                read_bytes: bytes = serial_port.read_all()
-                if read_bytes is None or len(read_bytes) == 0:
+                read_bytes: bytes = serial_port.read(max(1, serial_port.in_waiting))
+                if len(read_bytes) == 0:
                     continue
 
-                # 文字列の受信とデコードを行う．文字列は0.0~1.0までの浮動小数点数の文字列(小数点以下3桁)および，"p"(ボタン押下時),"r"(ボタン解放時),"l"(ボタン長押し時)
-                all_read_bytes = reading_bytes + read_bytes
-                all_completed_string: str = None  # その時点で，完全な行として読み込んだ要素からなる文字列
-
-                last_ln_index = all_read_bytes.decode("utf8").rfind("\n")
-                if last_ln_index == len(all_read_bytes) - 1:  # 読み込んだタイミングで，行を全受信していた場合
-                    reading_bytes = bytes()  # 読みかけの要素なし
-                    all_completed_string = all_read_bytes.decode("utf8")
-                else:
-                    reading_bytes = all_read_bytes[last_ln_index:]
-                    all_completed_string = all_read_bytes[:last_ln_index].decode("utf8")
-
-                all_lines = all_completed_string.split("\n")
-                analog_value: float = None
-                for line in all_lines:
-                    if line == "":
-                        continue
-
-                    if line[0] == "p":  # 押下
-                        button_pressed(game_state, gui_state)
-                    elif line[0] == "r":  # 開放
-                        # button_released(game_state,gui_state)
-                        None
-                    elif line[0] == "l":  # 長押し
-                        button_longpressed(game_state, gui_state)
-                    else:
-                        analog_value = float(line) - 0.5
-
-                if analog_value is not None:
-                    volume: float = 0
-                    if abs(analog_value) < ZERO_VALUE_RANGE:
-                        volume = 0
-                    elif analog_value < 0:
-                        sig_param.traction_down()
-                        volume = (-analog_value - ZERO_VALUE_RANGE) / (0.5 - ZERO_VALUE_RANGE)
-                    else:
-                        sig_param.traction_up()
-                        volume = (analog_value - ZERO_VALUE_RANGE) / (0.5 - ZERO_VALUE_RANGE)
-
-                    player_state.volume = volume
-
-                time.sleep(0.2)
+                read_ns = clock.monotonic_ns()
+                if session_log is not None:
+                    session_log.write_serial(read_bytes)
+
+                frames = parser.feed(read_bytes)
+                written_ns = clock.monotonic_ns()
+                analog_value = apply_frames(frames, sig_param, player_state, game_state, gui_state)
+
+                # 再生プロセスは音量をゲーム画面でのみ読むため、ゲーム画面で音量が変化した受信のみ記録する
+                if (
+                    tracer is not None
+                    and analog_value is not None
+                    and player_state.volume != traced_volume
+                    and gui_state.current_page == Page.GAME
+                ):
+                    traced_volume = player_state.volume
+                    trace_key += 1
+                    tracer.stamp(Flow.volume, Hop.input, trace_key, read_ns)
+                    tracer.stamp(Flow.volume, Hop.written, trace_key, written_ns)
+
+        if session_log is not None:
+            session_log.close()
+        if tracer is not None:
+            tracer.close()
 
     except Exception as e:
         print(f"{__file__}: {e}")
         sys.exit(e)
 
 
+def apply_frames(
+    frames: Iterable[Frame],
+    sig_param: SignalParam,
+    player_state: PlayerState,
+    game_state: GameState,
+    gui_state: GuiState,
+) -> float | None:
+    """受信したフレームを状態に反映する
+
+    :return: 反映したアナログ値, アナログ値のフレームがない場合はNone
+    """
+    # フレームはM5Atomが20 msごとに送るアナログ値および，ボタンの押下・開放・長押し
+    analog_value: float | None = None
+    for frame in frames:
+        if frame.kind == FrameKind.analog:
+            analog_value = frame.analog_value() - 0.5  # 最新の値のみ使う
+        elif frame.button_event() == ButtonEvent.pressed:
+            button_pressed(game_state, gui_state)
+        elif frame.button_event() == ButtonEvent.released:
+            button_released(game_state, gui_state)
+        elif frame.button_event() == ButtonEvent.long_pressed:
+            button_longpressed(game_state, gui_state)
+
+    if analog_value is not None:
+        apply_analog_value(analog_value, sig_param, player_state)
+    return analog_value
+
+
+def apply_analog_value(analog_value: float, sig_param: SignalParam, player_state: PlayerState) -> None:
+    """アナログ値を牽引力方向と音量に反映する
+
+    :param analog_value: 中央を0としたアナログ値 -0.5~0.5
+    """
+    volume: float = 0
+    if abs(analog_value) < ZERO_VALUE_RANGE:
+        volume = 0
+    elif analog_value < 0:
+        sig_param.traction_down()
+        volume = (-analog_value - ZERO_VALUE_RANGE) / (0.5 - ZERO_VALUE_RANGE)
+    else:
+        sig_param.traction_up()
+        volume = (analog_value - ZERO_VALUE_RANGE) / (0.5 - ZERO_VALUE_RANGE)
+
+    player_state.volume = volume
+
+
 def button_pressed(game_state: GameState, gui_state: GuiState) -> None:
     current_page = gui_state.current_page
 
@@ -0,0 +1,285 @@
+from __future__ import annotations
+
+import threading
+import time
+import wave
+from collections import deque
+from collections.abc import Callable
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Protocol
+
+import numpy as np
+import numpy.typing as npt
+
+from iraira.clock import REAL_CLOCK, Clock
+
+
+class RingBuffer:
+    """単一プロデューサ・単一コンシューマのint16リングバッファ
+
+    書き込み位置と読み出し位置は単調増加するフレーム数であり、それぞれ書き込み側と読み出し側のスレッドだけが更新する。
+    そのためロックなしで書き込み(再生ループ)と読み出し(PortAudioコールバック)を並行できる。
+    """
+
+    def __init__(self, capacity: int, latency_history: int = 4096) -> None:
+        """
+        :param capacity: バッファ長[frame]
+        :param latency_history: 保持する遅延計測値の数
+        """
+        self._buf = np.zeros(capacity, dtype=np.int16)
+        self._capacity = capacity
+        self._write_pos = 0  # 書き込み側のみ更新
+        self._read_pos = 0  # 読み出し側のみ更新
+        self._flush_pos = 0  # 書き込み側が破棄を要求した位置。読み出し側が反映する
+        self._writable = threading.Event()
+
+        # 書き込み開始フレームと書き込み時刻の組。読み出し側がそのフレームを読んだ時点で遅延を計測する
+        self._marks: deque[tuple[int, int]] = deque()
+        self._latencies_ns = np.zeros(latency_history, dtype=np.int64)
+        self._latency_count = 0
+        self.underrun_frames = 0
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    @property
+    def queued(self) -> int:
+        """読み出し待ちのフレーム数"""
+        return self._write_pos - max(self._read_pos, self._flush_pos)
+
+    @property
+    def free(self) -> int:
+        """書き込み可能なフレーム数"""
+        return self._capacity - (self._write_pos - self._read_pos)
+
+    def write(self, sig: npt.NDArray[np.int16]) -> int:
+        """書き込めるだけ書き込む
+
+        :param sig: 書き込む信号
+        :return: 書き込んだフレーム数
+        """
+        n = min(len(sig), self.free)
+        if n == 0:
+            return 0
+
+        self._marks.append((self._write_pos, time.monotonic_ns()))
+
+        start = self._write_pos % self._capacity
+        first = min(n, self._capacity - start)
+        self._buf[start : start + first] = sig[:first]
+        self._buf[: n - first] = sig[first:n]
+
+        self._write_pos += n
+        return n
+
+    def wait_writable(self, frames: int, timeout: float) -> bool:
+        """指定フレーム数の空きができるまで待つ
+
+        :param frames: 必要な空きフレーム数
+        :param timeout: 最大待ち時間[sec]
+        :return: 空きができていればTrue
+        """
+        self._writable.clear()
+        if self.free >= frames:
+            return True
+        self._writable.wait(timeout)
+        return self.free >= frames
+
+    def flush(self) -> None:
+        """読み出し待ちの信号を破棄する"""
+        self._flush_pos = self._write_pos
+
+    def read_into(self, out: npt.NDArray[np.int16]) -> int:
+        """読み出し待ちの信号をoutに書き出す。不足分は無音で埋める
+
+        :param out: 書き出し先
+        :return: 読み出したフレーム数
+        """
+        if self._flush_pos > self._read_pos:
+            # 破棄された信号は再生していないため遅延計測の対象から外す
+            self._read_pos = self._flush_pos
+            while self._marks and self._marks[0][0] < self._read_pos:
+                self._marks.popleft()
+
+        n = min(len(out), self._write_pos - self._read_pos)
+        start = self._read_pos % self._capacity
+        first = min(n, self._capacity - start)
+        out[:first] = self._buf[start : start + first]
+        out[first:n] = self._buf[: n - first]
+        out[n:] = 0
+        self.underrun_frames += len(out) - n
+
+        self._read_pos += n
+        self._record_latency(self._read_pos)
+        self._writable.set()
+        return n
+
+    def _record_latency(self, read_pos: int) -> None:
+        now = time.monotonic_ns()
+        while self._marks and self._marks[0][0] < read_pos:
+            _, enqueued_at = self._marks.popleft()
+            self._latencies_ns[self._latency_count % len(self._latencies_ns)] = now - enqueued_at
+            self._latency_count += 1
+
+    def latency_stats(self) -> LatencyStats:
+        """書き込みからコールバックで読み出されるまでの遅延の統計"""
+        n = min(self._latency_count, len(self._latencies_ns))
+        return LatencyStats.from_ns(self._latencies_ns[:n])
+
+
+@dataclass(frozen=True)
+class LatencyStats:
+    """遅延の統計値[ms]"""
+
+    count: int
+    mean_ms: float
+    p50_ms: float
+    p99_ms: float
+    max_ms: float
+
+    @staticmethod
+    def from_ns(samples_ns: npt.NDArray[np.int64]) -> LatencyStats:
+        if len(samples_ns) == 0:
+            return LatencyStats(0, 0.0, 0.0, 0.0, 0.0)
+        ms = samples_ns / 1e6
+        p50, p99 = np.percentile(ms, [50, 99])
+        return LatencyStats(len(ms), float(ms.mean()), float(p50), float(p99), float(ms.max()))
+
+    def __str__(self) -> str:
+        return (
+            f"latency n={self.count} mean={self.mean_ms:.2f}ms "
+            f"p50={self.p50_ms:.2f}ms p99={self.p99_ms:.2f}ms max={self.max_ms:.2f}ms"
+        )
+
+
+class OutputDevice(Protocol):
+    """コールバック方式の音声出力先"""
+
+    def open(self, fs: int, frames_per_buffer: int, callback: Callable[[int], bytes]) -> None:
+        """出力を開く
+
+        :param fs: サンプリング周波数[Hz]
+        :param frames_per_buffer: 1回のコールバックで要求するフレーム数
+        :param callback: 要求フレーム数を受け取りint16モノラルのbytesを返す関数
+        """
+        ...
+
+    def start(self) -> None:
+        ...
+
+    def stop(self) -> None:
+        ...
+
+    def is_active(self) -> bool:
+        ...
+
+    def close(self) -> None:
+        ...
+
+
+class PyAudioOutputDevice:
+    """PortAudioのコールバックAPIによる音声出力"""
+
+    def open(self, fs: int, frames_per_buffer: int, callback: Callable[[int], bytes]) -> None:
+        import pyaudio
+
+        def stream_callback(in_data, frame_count, time_info, status):  # type: ignore
+            return callback(frame_count), pyaudio.paContinue
+
+        self._py_audio = pyaudio.PyAudio()
+        self._stream = self._py_audio.open(
+            format=pyaudio.paInt16,
+            channels=1,
+            rate=fs,
+            output=True,
+            frames_per_buffer=frames_per_buffer,
+            stream_callback=stream_callback,
+            start=False,
+        )
+
+    def start(self) -> None:
+        if not self._stream.is_active():
+            self._stream.start_stream()
+
+    def stop(self) -> None:
+        if self._stream.is_active():
+            self._stream.stop_stream()
+
+    def is_active(self) -> bool:
+        return self._stream.is_active()
+
+    def close(self) -> None:
+        self._stream.close()
+        self._py_audio.terminate()
+
+
+class NullOutputDevice:
+    """音声デバイスを使わない出力先
+
+    スレッドからコールバックを呼び出し、出力をwavファイルに書き込むか破棄する。
+    オーディオデバイスのない環境での動作確認や計測に使う。
+    """
+
+    def __init__(self, path: Path | None = None, realtime: bool = True, clock: Clock = REAL_CLOCK) -> None:
+        """
+        :param path: 出力を書き込むwavファイル, Noneの場合は破棄する
+        :param realtime: Trueの場合は時刻源の速さでコールバックを呼ぶ, Falseの場合は可能な限り速く呼ぶ
+        :param clock: realtime=True の場合に使う時刻源
+        """
+        self._path = path
+        self._realtime = realtime
+        self._clock = clock
+        self._active = threading.Event()
+        self._closed = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def open(self, fs: int, frames_per_buffer: int, callback: Callable[[int], bytes]) -> None:
+        self._fs = fs
+        self._frames_per_buffer = frames_per_buffer
+        self._callback = callback
+        self._wave: wave.Wave_write | None = None
+        if self._path is not None:
+            self._wave = wave.open(str(self._path), "wb")
+            self._wave.setnchannels(1)
+            self._wave.setsampwidth(2)
+            self._wave.setframerate(fs)
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        from iraira.scheduler import PeriodicScheduler
+
+        # 音声デバイスと同じく全てのバッファを要求するため、1周期までの遅れは間隔を詰めて取り戻す
+        scheduler = PeriodicScheduler(self._frames_per_buffer / self._fs, self._clock, max_catch_up=1)
+        while not self._closed.is_set():
+            if not self._active.is_set():
+                if not self._active.wait(0.1):
+                    continue
+                scheduler.reset()
+
+            data = self._callback(self._frames_per_buffer)
+            if self._wave is not None:
+                self._wave.writeframes(data)
+
+            if self._realtime:
+                scheduler.sleep()
+
+    def start(self) -> None:
+        self._active.set()
+
+    def stop(self) -> None:
+        self._active.clear()
+
+    def is_active(self) -> bool:
+        return self._active.is_set()
+
+    def close(self) -> None:
+        self._active.clear()
+        self._closed.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._wave is not None:
+            self._wave.close()
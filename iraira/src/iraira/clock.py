@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import time
+
+
+class Clock:
+    """時刻源
+
+    speed 倍の速さで進む時刻を返す。シミュレーション時に待ち時間を短縮して長時間の動作を計測するために使う。
+    基準時刻は生成時に固定されるため、pickleしてプロセス間で渡しても全プロセスで同じ時刻となる。
+    """
+
+    def __init__(self, speed: float = 1.0) -> None:
+        """
+        :param speed: 実時間に対する時刻の進む速さの倍率
+        """
+        if not speed > 0:
+            raise ValueError("speed expected greater than 0")
+        self._speed = speed
+        self._origin_ns = time.monotonic_ns()
+        self._wall_origin = time.time()
+
+    @property
+    def speed(self) -> float:
+        return self._speed
+
+    def monotonic_ns(self) -> int:
+        return self._origin_ns + int((time.monotonic_ns() - self._origin_ns) * self._speed)
+
+    def monotonic(self) -> float:
+        return self.monotonic_ns() / 1e9
+
+    def time(self) -> float:
+        """UNIX時刻[sec]"""
+        return self._wall_origin + (self.monotonic_ns() - self._origin_ns) / 1e9
+
+    def to_real(self, sec: float) -> float:
+        """この時刻源での時間[sec]を実時間[sec]に換算する。待ち時間のタイムアウトに使う"""
+        return sec / self._speed
+
+    def sleep(self, sec: float) -> None:
+        time.sleep(max(0.0, self.to_real(sec)))
+
+
+class ManualClock(Clock):
+    """明示的に進める時刻源
+
+    記録した入力の再生で、記録時の時刻を再現するために使う。sleep() は待たずに時刻を進める。
+    """
+
+    def __init__(self, t_ns: int = 0) -> None:
+        super().__init__()
+        self._t_ns = t_ns
+
+    def monotonic_ns(self) -> int:
+        return self._t_ns
+
+    def set_ns(self, t_ns: int) -> None:
+        """時刻を t_ns に進める。時刻は戻らない"""
+        self._t_ns = max(self._t_ns, t_ns)
+
+    def to_real(self, sec: float) -> float:
+        return 0.0
+
+    def sleep(self, sec: float) -> None:
+        self.set_ns(self._t_ns + int(max(0.0, sec) * 1e9))
+
+
+REAL_CLOCK = Clock()  # 実時間の時刻源
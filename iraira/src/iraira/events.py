@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+import os
+import struct
+from collections.abc import Iterable
+from dataclasses import dataclass
+from enum import Enum, auto
+from multiprocessing import Pipe
+from multiprocessing.connection import Connection, wait
+
+_EVENT_STRUCT = struct.Struct("<Bi")  # (EventKind.value, value)
+
+
+class EventKind(Enum):
+    """状態変化イベントの種類"""
+
+    app_stopped = auto()  # アプリ終了
+    play_state_changed = auto()  # 再生/停止の切り替え value: 再生状態(0 or 1)
+    signal_param_changed = auto()  # 牽引力信号パラメータの変更
+    page_changed = auto()  # 画面遷移 value: Page.value
+    touched = auto()  # 壁接触 value: 接触回数
+    goaled = auto()  # ゴール状態の変更 value: ゴール状態(0 or 1)
+    game_cleared = auto()  # ゲーム状態のリセット
+
+    def __str__(self) -> str:
+        return self.name
+
+
+@dataclass(frozen=True)
+class StateEvent:
+    """状態変化イベント"""
+
+    kind: EventKind
+    value: int = 0
+
+
+class EventPublisher:
+    """状態変化イベントを全購読者に配信する
+
+    書き込み側のパイプはノンブロッキングであり、購読者が読み出さずにパイプが溢れた場合はイベントを破棄する。
+    イベントは状態変化の通知であり値そのものは共有状態が保持しているため、破棄しても状態の整合性は崩れない。
+    """
+
+    def __init__(self, writers: Iterable[Connection]) -> None:
+        self._writers = tuple(writers)
+
+    def publish(self, kind: EventKind, value: int = 0) -> None:
+        data = _EVENT_STRUCT.pack(kind.value, value)
+        for w in self._writers:
+            try:
+                w.send_bytes(data)
+            except BlockingIOError:
+                pass
+
+
+NULL_PUBLISHER = EventPublisher(())  # 配信先を持たないPublisher
+
+
+class EventSubscriber:
+    """状態変化イベントを受信する
+
+    fileno() を持つため select や tkinter の createfilehandler で待ち受けできる
+    """
+
+    def __init__(self, reader: Connection) -> None:
+        self._reader = reader
+
+    def fileno(self) -> int:
+        return self._reader.fileno()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """イベントを受信するまでブロックする
+
+        :param timeout: 最大待ち時間[sec], Noneの場合は無期限
+        :return: 受信済みイベントがあればTrue
+        """
+        return len(wait([self._reader], timeout)) > 0
+
+    def get(self, timeout: float | None = None) -> StateEvent | None:
+        """イベントを1つ受信する
+
+        :param timeout: 最大待ち時間[sec], Noneの場合は無期限
+        :return: 受信したイベント, タイムアウトした場合はNone
+        """
+        if not self._reader.poll(timeout):
+            return None
+        kind, value = _EVENT_STRUCT.unpack(self._reader.recv_bytes())
+        return StateEvent(EventKind(kind), value)
+
+    def drain(self) -> list[StateEvent]:
+        """ブロックせずに受信済みのイベントをすべて取り出す"""
+        events: list[StateEvent] = []
+        while True:
+            e = self.get(0)
+            if e is None:
+                return events
+            events.append(e)
+
+
+class EventBus:
+    """プロセス間の状態変化イベント配信路
+
+    購読者ごとに単方向パイプを持ち、発行されたイベントは全購読者にコピーされる。
+    EventPublisher/EventSubscriber はpickle可能でありプロセスプールのタスク引数として渡せる。
+    """
+
+    def __init__(self, subscribers: Iterable[str]) -> None:
+        self._readers: dict[str, Connection] = {}
+        writers = []
+        for name in subscribers:
+            r, w = Pipe(duplex=False)
+            os.set_blocking(w.fileno(), False)
+            self._readers[name] = r
+            writers.append(w)
+        self._publisher = EventPublisher(writers)
+
+    @property
+    def publisher(self) -> EventPublisher:
+        return self._publisher
+
+    def subscriber(self, name: str) -> EventSubscriber:
+        return EventSubscriber(self._readers[name])
@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+from collections.abc import Callable, Collection, Iterable
+from typing import NamedTuple, Protocol
+
+from iraira.clock import REAL_CLOCK, Clock
+
+
+class Edge(NamedTuple):
+    """入力ピンのレベル変化"""
+
+    pin: int  # BCMのピン番号
+    level: int  # 変化後のレベル。プルアップのため0が接触
+    t_ns: int  # 変化した時刻 Clock.monotonic_ns()
+
+
+class GpioBackend(Protocol):
+    """GPIOのレベル入出力とエッジ通知"""
+
+    def setup_input(self, pin: int) -> None:
+        """プルアップ入力として設定する"""
+        ...
+
+    def setup_output(self, pin: int, initial: int) -> None:
+        ...
+
+    def input(self, pin: int) -> int:
+        ...
+
+    def inputs(self, pins: Collection[int]) -> tuple[int, ...]:
+        """複数のピンのレベル。実装が対応していれば全てのピンを同時に読む"""
+        ...
+
+    def output(self, pin: int, level: int) -> None:
+        ...
+
+    def add_edge_callback(self, pin: int, callback: Callable[[Edge], None]) -> None:
+        """立ち上がり・立ち下がりの両エッジでcallbackを呼ぶ。callbackは別スレッドから呼ばれる"""
+        ...
+
+    def remove_edge_callback(self, pin: int) -> None:
+        ...
+
+
+class RPiGpioBackend:
+    """RPi.GPIO によるGPIO入出力"""
+
+    def __init__(self) -> None:
+        import RPi.GPIO as GPIO
+
+        self._gpio = GPIO
+        GPIO.setmode(GPIO.BCM)
+
+    def setup_input(self, pin: int) -> None:
+        self._gpio.setup(pin, self._gpio.IN, pull_up_down=self._gpio.PUD_UP)
+
+    def setup_output(self, pin: int, initial: int) -> None:
+        self._gpio.setup(pin, self._gpio.OUT, initial=initial)
+
+    def input(self, pin: int) -> int:
+        return self._gpio.input(pin)
+
+    def inputs(self, pins: Collection[int]) -> tuple[int, ...]:
+        # RPi.GPIO は1ピンずつ読むため、ピンごとに読んだ時刻は異なる
+        return tuple(self._gpio.input(pin) for pin in pins)
+
+    def output(self, pin: int, level: int) -> None:
+        self._gpio.output(pin, level)
+
+    def add_edge_callback(self, pin: int, callback: Callable[[Edge], None]) -> None:
+        def on_edge(channel: int) -> None:
+            # 時刻はエッジ検出スレッドで割り込み直後に取得し、レベルはその直後に読む
+            t_ns = time.monotonic_ns()
+            callback(Edge(channel, self._gpio.input(channel), t_ns))
+
+        self._gpio.add_event_detect(pin, self._gpio.BOTH, callback=on_edge)
+
+    def remove_edge_callback(self, pin: int) -> None:
+        self._gpio.remove_event_detect(pin)
+
+
+class SimulatedGpioBackend:
+    """GPIOを使わない入出力
+
+    set_level() でピンのレベルを変更するか、replay() で記録したエッジ列を時刻源の速さで再生する。
+    出力したレベルは outputs に記録する。Raspberry Pi 以外での動作確認や計測に使う。
+    """
+
+    def __init__(self, clock: Clock = REAL_CLOCK) -> None:
+        """
+        :param clock: エッジの時刻と再生に使う時刻源
+        """
+        self._clock = clock
+        self._levels: dict[int, int] = {}
+        self._callbacks: dict[int, Callable[[Edge], None]] = {}
+        self._lock = threading.Lock()
+        self.outputs: deque[Edge] = deque(maxlen=4096)
+
+    def setup_input(self, pin: int) -> None:
+        self._levels.setdefault(pin, 1)
+
+    def setup_output(self, pin: int, initial: int) -> None:
+        self.output(pin, initial)
+
+    def input(self, pin: int) -> int:
+        return self._levels[pin]
+
+    def inputs(self, pins: Collection[int]) -> tuple[int, ...]:
+        with self._lock:
+            return tuple(self._levels[pin] for pin in pins)
+
+    def output(self, pin: int, level: int) -> None:
+        self._levels[pin] = level
+        self.outputs.append(Edge(pin, level, self._clock.monotonic_ns()))
+
+    def add_edge_callback(self, pin: int, callback: Callable[[Edge], None]) -> None:
+        self._callbacks[pin] = callback
+
+    def remove_edge_callback(self, pin: int) -> None:
+        self._callbacks.pop(pin, None)
+
+    def set_level(self, pin: int, level: int, t_ns: int | None = None) -> None:
+        """ピンのレベルを変更し、変化した場合はエッジを通知する
+
+        :param t_ns: エッジの時刻, Noneの場合は時刻源の現在時刻
+        """
+        with self._lock:
+            if self._levels.get(pin, 1) == level:
+                return
+            self._levels[pin] = level
+            callback = self._callbacks.get(pin)
+        if callback is not None:
+            callback(Edge(pin, level, self._clock.monotonic_ns() if t_ns is None else t_ns))
+
+    def replay(self, edges: Iterable[Edge]) -> threading.Thread:
+        """エッジ列を別スレッドで時刻源の速さで再生する
+
+        :param edges: 再生するエッジ列。時刻は先頭からの相対値として扱う。終わりのない列も再生できる
+        :return: 再生スレッド
+        """
+
+        def run() -> None:
+            origin: int | None = None
+            start = self._clock.monotonic_ns()
+            for e in edges:
+                if origin is None:
+                    origin = e.t_ns
+                due = start + e.t_ns - origin
+                self._clock.sleep((due - self._clock.monotonic_ns()) / 1e9)
+                self.set_level(e.pin, e.level, due)
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,241 @@
+from __future__ import annotations
+
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from collections.abc import Callable, Collection
+from pathlib import Path
+from typing import Protocol
+
+from iraira.clock import REAL_CLOCK, Clock
+from iraira.gpio_backend import Edge, GpioBackend, SimulatedGpioBackend
+from iraira.scheduler import PeriodicScheduler, PeriodStats
+
+GPIOMEM_PATH = Path("/dev/gpiomem")
+GPLEV0_OFFSET = 0x34  # GPIO 0-31 のレベルを保持するレジスタ (BCM2835/BCM2711)
+REGISTER_BLOCK_SIZE = 4096  # /dev/gpiomem でマップできるGPIOレジスタの範囲
+BANK_PINS = 32  # GPLEV0 で読めるピン数
+
+
+class PinBank(Protocol):
+    """複数のピンのレベルをまとめて読む"""
+
+    def read(self) -> int:
+        """GPIO 0-31 のレベル。ビットnがGPIO nのレベル"""
+        ...
+
+    def close(self) -> None:
+        ...
+
+
+class RegisterPinBank:
+    """GPIOのレベルレジスタをメモリマップして読む
+
+    1回の32bit読み出しで全てのピンを読むため、同じ値に含まれるピンのレベルは同時刻のものになる。
+    /dev/gpiomem の代わりに同じレイアウトの通常のファイルを与えると、実機なしで動作を確認できる (write_register_file)。
+    """
+
+    def __init__(self, path: Path = GPIOMEM_PATH) -> None:
+        """
+        :param path: /dev/gpiomem または REGISTER_BLOCK_SIZE バイト以上のファイル
+        """
+        fd = os.open(path, os.O_RDWR | os.O_SYNC)
+        try:
+            self._mmap = mmap.mmap(fd, REGISTER_BLOCK_SIZE, mmap.MAP_SHARED, mmap.PROT_READ)
+        finally:
+            os.close(fd)
+        # レジスタは4byte単位で読む必要があるため、バイト列ではなく32bit整数の配列として参照する
+        self._words = memoryview(self._mmap).cast("I")  # type: ignore
+
+    def read(self) -> int:
+        return self._words[GPLEV0_OFFSET // 4]
+
+    def close(self) -> None:
+        self._words.release()
+        self._mmap.close()
+
+
+class GpioInputPinBank:
+    """レジスタを読めない環境で、GpioBackend から1ピンずつ読んでビットマスクにする"""
+
+    def __init__(self, gpio: GpioBackend, pins: Collection[int]) -> None:
+        """
+        :param gpio: 読み出しに使うGPIO
+        :param pins: 読むピン。読み出しのたびに参照するため、後から追加したピンも読む
+        """
+        self._gpio = gpio
+        self._pins = pins
+
+    def read(self) -> int:
+        mask = 0
+        for pin in tuple(self._pins):
+            if self._gpio.input(pin):
+                mask |= 1 << pin
+        return mask
+
+    def close(self) -> None:
+        pass
+
+
+def open_register_pin_bank(path: Path = GPIOMEM_PATH) -> RegisterPinBank | None:
+    """レジスタを読む PinBank, /dev/gpiomem がない場合や権限がない場合はNone"""
+    try:
+        return RegisterPinBank(path)
+    except (OSError, ValueError) as e:
+        print(f"{__file__}: {path}: {e}")
+        return None
+
+
+def write_register_file(path: Path, levels: int) -> None:
+    """RegisterPinBank で読むファイルにピンのレベルを書き込む。ファイルがない場合は作成する
+
+    :param levels: GPIO 0-31 のレベル。ビットnがGPIO nのレベル
+    """
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if os.fstat(fd).st_size < REGISTER_BLOCK_SIZE:
+            os.ftruncate(fd, REGISTER_BLOCK_SIZE)
+        os.pwrite(fd, struct.pack("=I", levels & 0xFFFFFFFF), GPLEV0_OFFSET)
+    finally:
+        os.close(fd)
+
+
+class SampledGpioBackend:
+    """PinBank を一定間隔で読み、レベルの変化をエッジとして通知する GpioBackend
+
+    RPi.GPIO のエッジ検出はピンごとに別々に割り込みを受けてからレベルを読むが、このクラスは全てのピンを同時に読み、
+    同じ読み出しで変化したピンのエッジには同じ時刻を付ける。
+    ピンの設定と出力は base に任せる。読み出しはエッジ通知を登録したピンがある間だけ別スレッドで行う。
+    """
+
+    def __init__(
+        self,
+        base: GpioBackend,
+        bank: PinBank | None,
+        clock: Clock = REAL_CLOCK,
+        sample_hz: float = 10_000.0,
+    ) -> None:
+        """
+        :param base: ピンの設定と出力に使うGPIO
+        :param bank: レベルの読み出し, Noneの場合は base から1ピンずつ読む
+        :param clock: エッジの時刻と読み出し間隔に使う時刻源
+        :param sample_hz: 1秒あたりの読み出し回数
+        """
+        self._base = base
+        self._inputs: set[int] = set()
+        self._bank = bank if bank is not None else GpioInputPinBank(base, self._inputs)
+        self._clock = clock
+        # 待ち時間は1周期近く延びることがあるため、1ms分までの遅れは間隔を詰めて読んで取り戻す
+        self._scheduler = PeriodicScheduler(1 / sample_hz, clock, max_catch_up=max(0, int(sample_hz / 1000)))
+        self._callbacks: dict[int, Callable[[Edge], None]] = {}
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self._stop = threading.Event()
+
+    def setup_input(self, pin: int) -> None:
+        if pin >= BANK_PINS:
+            raise ValueError(f"GPIO {pin} is not in the first register bank")
+        self._base.setup_input(pin)
+        self._inputs.add(pin)
+
+    def setup_output(self, pin: int, initial: int) -> None:
+        self._base.setup_output(pin, initial)
+
+    def input(self, pin: int) -> int:
+        return self._bank.read() >> pin & 1
+
+    def inputs(self, pins: Collection[int]) -> tuple[int, ...]:
+        levels = self._bank.read()
+        return tuple(levels >> pin & 1 for pin in pins)
+
+    def output(self, pin: int, level: int) -> None:
+        self._base.output(pin, level)
+
+    def add_edge_callback(self, pin: int, callback: Callable[[Edge], None]) -> None:
+        with self._lock:
+            self._callbacks[pin] = callback
+            if self._thread is None:
+                self._stop = threading.Event()
+                self._thread = threading.Thread(target=self._run, args=(self._stop,), daemon=True)
+                self._thread.start()
+
+    def remove_edge_callback(self, pin: int) -> None:
+        with self._lock:
+            self._callbacks.pop(pin, None)
+            if self._callbacks or self._thread is None:
+                return
+            thread, self._thread = self._thread, None
+            self._stop.set()
+        thread.join()
+
+    def sampling_stats(self) -> PeriodStats:
+        """読み出しを始めてからの読み出し頻度と遅れ"""
+        return self._scheduler.stats()
+
+    def close(self) -> None:
+        for pin in list(self._callbacks):
+            self.remove_edge_callback(pin)
+        self._bank.close()
+
+    def _run(self, stop: threading.Event) -> None:
+        clock = self._clock
+        previous = self._bank.read()
+        self._scheduler.reset()
+        while not stop.is_set():
+            self._scheduler.sleep()
+            with self._lock:
+                callbacks = list(self._callbacks.items())
+
+            levels = self._bank.read()
+            t_ns = clock.monotonic_ns()
+            changed, previous = levels ^ previous, levels
+            if changed:
+                for pin, callback in callbacks:
+                    if changed >> pin & 1:
+                        callback(Edge(pin, levels >> pin & 1, t_ns))
+
+
+def benchmark_sampling(sample_hz: float = 10_000.0, duration_sec: float = 2.0, toggles: int = 200) -> None:
+    """ファイルで代用したレジスタを読み、読み出しの所要時間、達成した読み出し頻度、エッジの時刻の一致を計測する"""
+    pins = (6, 13, 19, 21, 26)
+    with tempfile.TemporaryDirectory() as d:
+        path = Path(d) / "gpiomem"
+        all_high = sum(1 << pin for pin in pins)
+        write_register_file(path, all_high)
+
+        bank = RegisterPinBank(path)
+        count = 100_000
+        start = time.perf_counter_ns()
+        for _ in range(count):
+            bank.read()
+        read_ns = (time.perf_counter_ns() - start) / count
+
+        gpio = SampledGpioBackend(SimulatedGpioBackend(), bank, sample_hz=sample_hz)
+        edges: list[Edge] = []
+        for pin in pins:
+            gpio.setup_input(pin)
+            gpio.add_edge_callback(pin, edges.append)
+
+        # 壁の1段目と2段目に同時に触れて離す
+        both = (1 << 21) | (1 << 6)
+        interval = duration_sec / toggles
+        for i in range(toggles):
+            write_register_file(path, all_high & ~both if i % 2 == 0 else all_high)
+            time.sleep(interval)
+        stats = gpio.sampling_stats()
+        gpio.close()
+
+    by_time: dict[int, set[int]] = {}
+    for e in edges:
+        by_time.setdefault(e.t_ns, set()).add(e.pin)
+    paired = sum(1 for pins_at in by_time.values() if pins_at == {6, 21})
+    print(f"register read: {read_ns:.0f} ns")
+    print(f"sampling: {stats}")
+    print(f"edges: {len(edges)} from {toggles} simultaneous 2-pin changes, {paired} pairs share one timestamp")
+
+
+if __name__ == "__main__":
+    benchmark_sampling()
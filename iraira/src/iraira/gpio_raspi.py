@@ -1,19 +1,38 @@
-# pyright: reportGeneralTypeIssues=false
-import RPi.GPIO as GPIO
+import threading
 
-from iraira.player import SignalParam
-from iraira.state import AppState
+from iraira.gpio_backend import Edge
+from iraira.hal import Hardware
+from iraira.state import AppState, SignalParam
 
 PIN_TRRACTION_CHANGE = 17
-
-GPIO.setmode(GPIO.BCM)
-GPIO.setup(PIN_TRRACTION_CHANGE, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+BOUNCE_TIME = 0.5  # sec
+CHECK_INTERVAL = 1.0  # sec 終了状態を確認する間隔
 
 
 def switch_listener(
     app_state: AppState,
     sig_param: SignalParam,
+    hardware: Hardware = Hardware(),
 ) -> None:
+    clock = hardware.clock
+    gpio = hardware.open_gpio()
+    gpio.setup_input(PIN_TRRACTION_CHANGE)
+
+    # 立ち下がりエッジを通知する。チャタリングを除くため前回の切り替えから BOUNCE_TIME 以内は無視する
+    pressed = threading.Event()
+    last_changed_ns = 0
+
+    def on_edge(edge: Edge) -> None:
+        nonlocal last_changed_ns
+        if edge.level == 0 and edge.t_ns - last_changed_ns >= BOUNCE_TIME * 1e9:
+            last_changed_ns = edge.t_ns
+            pressed.set()
+
+    gpio.add_edge_callback(PIN_TRRACTION_CHANGE, on_edge)
+
     while app_state.is_running:
-        _ = GPIO.wait_for_edge(PIN_TRRACTION_CHANGE, GPIO.FALLING, bouncetime=500)
-        sig_param.traction_change()
+        if pressed.wait(clock.to_real(CHECK_INTERVAL)):
+            pressed.clear()
+            sig_param.traction_change()
+
+    gpio.remove_edge_callback(PIN_TRRACTION_CHANGE)
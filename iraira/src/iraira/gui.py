@@ -1,63 +1,25 @@
 from __future__ import annotations
 
-import csv
 import sys
 import time
 import tkinter as tk
 from collections.abc import Sequence
-from dataclasses import dataclass
 from datetime import datetime
 
+from iraira.events import EventKind, EventSubscriber
+from iraira.gui_input import apply_key, change_page_state, enter_page
+from iraira.hal import Hardware
 from iraira.player import SignalParam
+from iraira.result_writer import ResultWriter
+from iraira.results_store import FinishedGame, LeaderboardCache, Result, ResultsStore, SignalSettings
+from iraira.scoring import score
+from iraira.session_log import SessionWriter
+from iraira.splits import SplitStatsCache
 from iraira.state import AppState, GameState, GuiState, Page, PlayerState, TractionDirection
 from iraira.util import RepoPath
 
-_result_path = RepoPath().db_dir / "result.csv"
-
-
-@dataclass(frozen=True)
-class Result:
-    id: int
-    name: str
-    start_datetime: datetime
-    time_sec: float
-    touch_count: int
-    touch_time_sec: float
-
-    @property
-    def start_datetime_iso(self) -> str:
-        return self.start_datetime.isoformat()
-
-    @property
-    def score(self) -> float:
-        """スコアの算出"""
-        s = (200 - self.time_sec) - (self.touch_count * 5)
-        return 0 if s < 0 else s
-
-
-def score(time: float, touch_count: int) -> float:
-    """スコアの算出"""
-    s = (200 - time) - (touch_count * 5)
-    return 0 if s < 0 else s
-
-
-def read_results(count: int) -> list[Result]:
-    with _result_path.open(encoding="utf-8", newline="") as f:
-        reader = csv.reader(f)
-        _ = next(reader)
-
-        results_iter = (
-            Result(
-                id=int(row[0]),
-                name=row[1],
-                start_datetime=datetime.fromisoformat(row[2]),
-                time_sec=float(row[3]),
-                touch_count=int(row[4]),
-                touch_time_sec=float(row[5]),
-            )
-            for row in reader
-        )
-        return sorted(results_iter, key=lambda r: r.score, reverse=True)[:count]
+RANKING_COUNT = 5  # タイトル画面に表示する順位の数
+DEFAULT_PLAYER_NAME = "GUEST"  # 保存するゲーム結果の名前
 
 
 class App(tk.Tk):
@@ -85,6 +47,9 @@ class App(tk.Tk):
         player_param: PlayerState,
         game_state: GameState,
         gui_state: GuiState,
+        events: EventSubscriber | None = None,
+        session_log: SessionWriter | None = None,
+        result_writer: ResultWriter | None = None,
     ) -> None:
         tk.Tk.__init__(self)
 
@@ -93,6 +58,9 @@ class App(tk.Tk):
         self._player_param = player_param
         self._game_state = game_state
         self._gui_state = gui_state
+        self._events = events
+        self._session_log = session_log
+        self._result_writer = result_writer
 
         # 画面設定
         self.title("")
@@ -103,7 +71,6 @@ class App(tk.Tk):
 
         # 終了処理
         self.protocol("WM_DELETE_WINDOW", self._on_close_botton_click)
-        self._check_close()
 
         # キーボード操作
         self.bind("<KeyPress>", self._input_key)
@@ -112,12 +79,20 @@ class App(tk.Tk):
 
         # 画面ページ
         self._create_page()
-        self._check_game_goal()
-
         self._previus_page = None
-        self._check_current_page()
-        self._gui_state.current_page = Page.TITLE
+        self._is_goal_reached = False  # ゴールしてリザルト画面に遷移した
 
+        if self._events is not None and hasattr(self.tk, "createfilehandler"):
+            # 状態変化イベントの受信時のみ状態を確認する
+            self.tk.createfilehandler(self._events, tk.READABLE, self._on_state_event)
+            self._update_current_page()
+        else:
+            # イベントを待ち受けできない環境では定期的に状態を確認する
+            self._check_close()
+            self._check_game_goal()
+            self._check_current_page()
+
+        self._gui_state.current_page = Page.TITLE
 
         self.bind("<Button-1>", self._click_anyware)
 
@@ -129,9 +104,31 @@ class App(tk.Tk):
             self, self._app_state, self._sig_param, self._player_param, self._game_state, self._gui_state
         )
         self._page_result = ResultPage(
-            self, self._app_state, self._sig_param, self._player_param, self._game_state, self._gui_state
+            self,
+            self._app_state,
+            self._sig_param,
+            self._player_param,
+            self._game_state,
+            self._gui_state,
+            self._result_writer,
         )
 
+    def _on_state_event(self, file: EventSubscriber, mask: int) -> None:
+        """状態変化イベントの処理"""
+        kinds = {event.kind for event in file.drain()}
+
+        # パイプ溢れでイベントが欠落しても終了できるよう、終了判定は状態を直接確認する
+        if not self._app_state.is_running:
+            self.tk.deletefilehandler(file)
+            self.destroy()
+            return
+
+        if EventKind.goaled in kinds:
+            self._update_game_goal()
+
+        if EventKind.page_changed in kinds:
+            self._update_current_page()
+
     def _check_close(self) -> None:
         """アプリの起動状態監視と終了処理"""
         if self._app_state.is_running:
@@ -145,15 +142,19 @@ class App(tk.Tk):
         self.destroy()
         self._app_state.is_running = False
 
-    def _check_game_goal(self) -> None:
+    def _update_game_goal(self) -> None:
         """ゲーム画面でゴール時の画面遷移処理"""
         if self._gui_state.current_page == Page.GAME and self._game_state.is_goaled:
+            self._is_goal_reached = True
             self._gui_state.current_page = Page.RESULT
             self._game_state.is_goaled = False
 
+    def _check_game_goal(self) -> None:
+        """ゴール状態の定期監視"""
+        self._update_game_goal()
         self.after(1000, self._check_game_goal)
 
-    def _check_current_page(self) -> None:
+    def _update_current_page(self) -> None:
         """現在の表示すべきページの表示"""
         current_page = self._gui_state.current_page
 
@@ -161,6 +162,9 @@ class App(tk.Tk):
             self.change_page_view(current_page)
             self._previus_page = current_page
 
+    def _check_current_page(self) -> None:
+        """表示すべきページの定期監視"""
+        self._update_current_page()
         self.after(200, self._check_current_page)
 
     def _input_key(self, event: tk.Event) -> None:
@@ -168,44 +172,20 @@ class App(tk.Tk):
         self._key_event = event
         print(event, event.keysym_num)
 
-        # アプリイベント
-        if event.keysym_num == 113:  # key: q
-            self._app_state.is_running = False
-
-        if event.keysym_num == 65293:  # key: Return, 画面遷移
-            self.change_page_state()
-
-        # 画面ごとのイベント
-        if self._gui_state.current_page == Page.GAME:
-            # 操作
-            if event.keysym_num == 32:  # key: space
-                self._player_param.change_play_state()
-
-            elif event.keysym_num == 65361:  # key: Left
-                self._sig_param.traction_down()
-
-            elif event.keysym_num == 65363:  # key: Right
-                self._sig_param.traction_up()
-
-            elif event.keysym_num == 65362:  # key: Up
-                self._player_param.volume_up()
-
-            elif event.keysym_num == 65364:  # key: Down
-                self._player_param.volume_down()
-
-            # デバッグ用: ゲームゴール
-            elif event.keysym_num == 103:  # key: g
-                self._game_state.is_goaled = True
-
-            # デバッグ用: ゲーム途中終了
-            elif event.keysym_num == 119:  # key: w
-                self._gui_state.current_page = Page.TITLE
-
-            # デバッグ用: ゲーム途中終了
-            elif event.keysym_num == 114:  # key: r
-                self._game_state.increment_touch_count()
+        if self._session_log is not None:
+            self._session_log.write_key(event.keysym_num)
+        apply_key(
+            event.keysym_num,
+            self._app_state,
+            self._player_param,
+            self._sig_param,
+            self._game_state,
+            self._gui_state,
+        )
 
     def _click_anyware(self,event: tk.Event)->None:
+        if self._session_log is not None:
+            self._session_log.write_click()
         self.change_page_state()
 
 
@@ -213,27 +193,25 @@ class App(tk.Tk):
         if page == Page.TITLE:
             self._page_title.update_ranking()
             self._page_title.tkraise()
-            self._player_param.play_state = False
 
         elif page == Page.GAME:
             self._page_game.tkraise()
-            self._player_param.play_state = True
             self._game_state.start_time = time.time()
+            self._page_game.update_best_splits()
+            self._page_game.update_app_status()
 
         elif page == Page.RESULT:
-            self._page_result.update_app_status()
+            # クリックやキー操作でゲームを途中で終えた場合は結果を保存しない
+            is_goaled = self._is_goal_reached or self._game_state.goal_sec is not None
+            self._is_goal_reached = False
+            self._page_result.update_app_status(is_goaled)
             self._page_result.tkraise()
-            self._player_param.play_state = True
+
+        enter_page(page, self._player_param)
 
     def change_page_state(self) -> None:
         """ページの状態を変更する。この変数の変化は監視されており、適したページ表示に切り替えられる"""
-        if self._gui_state.current_page == Page.TITLE:
-            self._gui_state.current_page = Page.GAME
-            self._game_state.clear_game_state()
-        elif self._gui_state.current_page == Page.GAME:
-            self._gui_state.current_page = Page.RESULT
-        elif self._gui_state.current_page == Page.RESULT:
-            self._gui_state.current_page = Page.TITLE
+        change_page_state(self._game_state, self._gui_state)
 
 
 class TitlePage(tk.Frame):
@@ -246,6 +224,7 @@ class TitlePage(tk.Frame):
     ) -> None:
         super().__init__(master)
         self._gui_state = gui_state
+        self._leaderboard = LeaderboardCache(ResultsStore(), RANKING_COUNT)
         self._create_title_page()
 
     def _create_title_page(self) -> None:
@@ -254,7 +233,8 @@ class TitlePage(tk.Frame):
         self._create_background_image().place(relx=0, rely=0)
         self._create_title_label().pack(anchor=tk.CENTER, pady=20)
         self._create_start_button().pack(anchor=tk.CENTER, pady=10)
-        self._ranking = tk.Frame(self)
+        self._ranking = RankingTable(self, RANKING_COUNT)
+        self._ranking.pack(anchor=tk.CENTER, pady=20)
 
     def _create_background_image(self) -> tk.Canvas:
         img_path = RepoPath().assert_dir / "DALL·E 2022-08-29 02.10.00 - maze_trim4x3.png"
@@ -277,32 +257,49 @@ class TitlePage(tk.Frame):
             command=lambda: go_to_game_page(),
         )
 
-    def _create_ranking(self, results: Sequence[Result]) -> tk.Frame:
-        f = tk.Frame(self)
-        tk.Label(f, text="").grid(column=0, row=0, sticky=tk.W, padx=5, pady=5)
-        tk.Label(f, text="NAME", font=(None, "20")).grid(column=1, row=0, sticky=tk.W, padx=5, pady=5)
-        tk.Label(f, text="TIME [s]", font=(None, "20")).grid(column=2, row=0, sticky=tk.W, padx=5, pady=5)
-        tk.Label(f, text="TOUCH", font=(None, "20")).grid(column=3, row=0, sticky=tk.W, padx=5, pady=5)
-        tk.Label(f, text="SCORE", font=(None, "20")).grid(column=4, row=0, sticky=tk.W, padx=5, pady=5)
-
-        for i, r in enumerate(results):
-            tk.Label(f, text=f"{i+1}", font=(None, "20")).grid(column=0, row=i + 1, sticky=tk.W, padx=5, pady=5)
-            tk.Label(f, text=f"{r.name}", font=(None, "20")).grid(column=1, row=i + 1, sticky=tk.W, padx=5, pady=5)
-            tk.Label(f, text=f"{r.time_sec}", font=(None, "20")).grid(column=2, row=i + 1, sticky=tk.W, padx=5, pady=5)
-            tk.Label(f, text=f"{r.touch_count}", font=(None, "20")).grid(
-                column=3, row=i + 1, sticky=tk.W, padx=5, pady=5
-            )
-            tk.Label(f, text=f"{r.score}", font=(None, "20")).grid(column=4, row=i + 1, sticky=tk.W, padx=5, pady=5)
+    def update_ranking(self) -> None:
+        """他のプロセスが追記した結果のみ読み込み、変わった順位の表示のみ更新する"""
+        self._leaderboard.refresh()
+        self._ranking.update_results(self._leaderboard.top())
 
-        return f
 
-    def update_ranking(self) -> None:
-        if isinstance(self._ranking, tk.Frame):
-            self._ranking.destroy()
+class RankingTable(tk.Frame):
+    """スコア上位の表
 
-        results = read_results(5)
-        self._ranking = self._create_ranking(results)
-        self._ranking.pack(anchor=tk.CENTER, pady=20)
+    行のラベルは生成時に作り、表示する文字列が変わったラベルのみ更新する。
+    """
+
+    def __init__(self, master: tk.Misc, count: int) -> None:
+        """
+        :param count: 表示する順位の数
+        """
+        super().__init__(master)
+        tk.Label(self, text="").grid(column=0, row=0, sticky=tk.W, padx=5, pady=5)
+        tk.Label(self, text="NAME", font=(None, "20")).grid(column=1, row=0, sticky=tk.W, padx=5, pady=5)
+        tk.Label(self, text="TIME [s]", font=(None, "20")).grid(column=2, row=0, sticky=tk.W, padx=5, pady=5)
+        tk.Label(self, text="TOUCH", font=(None, "20")).grid(column=3, row=0, sticky=tk.W, padx=5, pady=5)
+        tk.Label(self, text="SCORE", font=(None, "20")).grid(column=4, row=0, sticky=tk.W, padx=5, pady=5)
+
+        self._labels: list[list[tk.Label]] = []
+        self._texts: list[tuple[str, ...]] = []
+        for i in range(count):
+            labels = [tk.Label(self, text="", font=(None, "20")) for _ in range(5)]
+            for column, label in enumerate(labels):
+                label.grid(column=column, row=i + 1, sticky=tk.W, padx=5, pady=5)
+            self._labels.append(labels)
+            self._texts.append(("",) * 5)
+
+    def update_results(self, results: Sequence[Result]) -> None:
+        for i, (labels, texts) in enumerate(zip(self._labels, self._texts)):
+            new_texts = ("",) * 5
+            if i < len(results):
+                r = results[i]
+                new_texts = (f"{i+1}", f"{r.name}", f"{r.time_sec:.1f}", f"{r.touch_count}", f"{int(r.score)}")
+
+            for label, text, new_text in zip(labels, texts, new_texts):
+                if text != new_text:
+                    label.configure(text=new_text)
+            self._texts[i] = new_texts
 
 
 class GamePage(tk.Frame):
@@ -324,10 +321,11 @@ class GamePage(tk.Frame):
         self._player_param = player_param
         self._game_state = game_state
         self._gui_state = gui_state
+        self._update_job: str | None = None
+        self._split_stats = SplitStatsCache(ResultsStore())
 
         self._create_game_page()
 
-
     def _create_game_page(self) -> None:
         self.grid(row=0, column=0, sticky="nsew")
 
@@ -359,6 +357,9 @@ class GamePage(tk.Frame):
         self._time = tk.Label(f, text="TIME", font=(None, 60))
         self._time.grid(column=0, row=0, sticky=tk.W + tk.E, padx=5, pady=5)
 
+        self._delta = tk.Label(f, text="", font=(None, 40))
+        self._delta.grid(column=1, row=0, sticky=tk.W + tk.E, padx=5, pady=5)
+
         t = tk.Label(f, text="壁接触: ", font=(None, 50))
         t.grid(column=0, row=1, sticky=tk.W + tk.E, padx=5, pady=5)
 
@@ -367,8 +368,15 @@ class GamePage(tk.Frame):
 
         return f
 
+    def update_best_splits(self) -> None:
+        """他のプロセスが追記した結果を区間の最速の時間に反映する。ゲームの開始時に呼び、表示の更新では読み込まない"""
+        self._split_stats.refresh()
+
     def update_app_status(self) -> None:
-        """アプリ情報を定期更新する"""
+        """アプリ情報を定期更新する。ゲーム画面の表示中のみ更新を続ける"""
+        if self._update_job is not None:
+            self.after_cancel(self._update_job)
+            self._update_job = None
 
         # 牽引力方向
         t = list("-" * 21)
@@ -380,13 +388,21 @@ class GamePage(tk.Frame):
         self._ing.configure(text=f"←{''.join(t)}→")
 
         # 経過時間
-        t = time.time() - self._game_state.start_time
-        self._time.configure(text=f"{t:.1f}")
+        elapsed = time.time() - self._game_state.start_time
+        self._time.configure(text=f"{elapsed:.1f}")
+
+        # 最速の区間の時間との差
+        delta = self._split_stats.delta(elapsed, self._game_state.checkpoint_sec)
+        if delta is None:
+            self._delta.configure(text="")
+        else:
+            self._delta.configure(text=f"{delta:+.1f}", fg="red" if delta > 0 else "blue")
 
         # 接触回数
         self._touch_count.configure(text=self._game_state.touch_count)
 
-        self.after(100, lambda: self.update_app_status())
+        if self._gui_state.current_page == Page.GAME:
+            self._update_job = self.after(100, self.update_app_status)
 
 
 class ResultPage(tk.Frame):
@@ -400,7 +416,11 @@ class ResultPage(tk.Frame):
         player_param: PlayerState,
         game_state: GameState,
         gui_state: GuiState,
+        result_writer: ResultWriter | None = None,
     ) -> None:
+        """
+        :param result_writer: ゲーム結果の保存先, Noneの場合は保存しない
+        """
         super().__init__(master)
 
         self._app_state = app_state
@@ -408,6 +428,7 @@ class ResultPage(tk.Frame):
         self._player_param = player_param
         self._game_state = game_state
         self._gui_state = gui_state
+        self._result_writer = result_writer
 
         self._create_result_page()
 
@@ -449,20 +470,39 @@ class ResultPage(tk.Frame):
         f.grid_columnconfigure(1, weight=2)
         return f
 
-    def update_app_status(self) -> None:
-        """アプリ情報を定期更新する"""
+    def update_app_status(self, is_goaled: bool) -> None:
+        """アプリ情報を更新する
 
-        # 経過時間
-        t = time.time() - self._game_state.start_time
+        :param is_goaled: ゴールしてリザルト画面に遷移した。Falseの場合は結果を保存しない
+        """
+
+        # 経過時間。ゴールした場合は接触判定のプロセスがエッジの時刻から求めた時間とする
+        # 表示と同じ0.1秒単位に丸めて保存する
+        goal_sec = self._game_state.goal_sec
+        t = round(time.time() - self._game_state.start_time if goal_sec is None else goal_sec, 1)
         self._time.configure(text=f"{t:.1f} 秒")
 
         # 接触回数
         self._touch_count.configure(text=self._game_state.touch_count)
 
         # スコア
-        s = int(score(t, self._game_state.touch_count))
+        s = int(score(t, self._game_state.touch_count, self._game_state.touch_time))
         self._score.configure(text=s)
 
+        # 保存は書き込みスレッドが行うため、画面の更新を待たせない
+        if self._result_writer is not None and is_goaled:
+            self._result_writer.submit(
+                FinishedGame(
+                    name=DEFAULT_PLAYER_NAME,
+                    start_datetime=datetime.fromtimestamp(self._game_state.start_time),
+                    time_sec=t,
+                    touch_count=self._game_state.touch_count,
+                    touch_time_sec=self._game_state.touch_time,
+                    signal=SignalSettings.of(self._sig_param),
+                    checkpoint_sec=self._game_state.checkpoint_sec,
+                )
+            )
+
 
 def show_gui(
     app_state: AppState,
@@ -470,11 +510,21 @@ def show_gui(
     sig_param: SignalParam,
     game_state: GameState,
     gui_state: GuiState,
+    events: EventSubscriber | None = None,
+    hardware: Hardware = Hardware(),
 ) -> None:
-    """アプリGUI画面を表示する"""
+    """アプリGUI画面を表示する
+
+    :param hardware: キー入力を記録するセッションログ
+    """
     try:
-        app = App(app_state, sig_param, player_param, game_state, gui_state)
+        session_log = hardware.open_session_log("gui")
+        result_writer = ResultWriter()
+        app = App(app_state, sig_param, player_param, game_state, gui_state, events, session_log, result_writer)
         app.mainloop()
+        result_writer.close()
+        if session_log is not None:
+            session_log.close()
 
     except KeyboardInterrupt:
         app.destroy()
@@ -482,3 +532,50 @@ def show_gui(
     except Exception as e:
         print(f"{__file__}: {e}")
         sys.exit(e)
+
+
+def benchmark_title_transition(rows: int = 10_000, repeat: int = 200) -> None:
+    """タイトル画面に戻るときのランキング更新の時間を、表の作り直しと変わったラベルのみの更新で比較する
+
+    表示できる環境で実行する。
+    """
+    import tempfile
+    from pathlib import Path
+
+    root = tk.Tk()
+    root.withdraw()
+    with tempfile.TemporaryDirectory() as d:
+        store = ResultsStore(Path(d) / "results.sqlite3", legacy_csv_path=None)
+        for i in range(rows):
+            store.write_result(f"player{i}", datetime.now(), 30 + i % 170, i % 40, 0.0)
+
+        # 従来: 毎回結果を読み込み、表のFrameとラベルを作り直す
+        start = time.perf_counter()
+        for _ in range(repeat):
+            table = RankingTable(root, RANKING_COUNT)
+            table.update_results(store.top(RANKING_COUNT))
+            table.pack()
+            root.update_idletasks()
+            table.destroy()
+        rebuild_sec = (time.perf_counter() - start) / repeat
+
+        # 上位をメモリに保持し、変わったラベルのみ更新する。毎回1件の結果が追加される
+        leaderboard = LeaderboardCache(store, RANKING_COUNT)
+        table = RankingTable(root, RANKING_COUNT)
+        table.pack()
+        start = time.perf_counter()
+        for i in range(repeat):
+            store.write_result(f"new{i}", datetime.now(), 20 + i % 200, 0, 0.0)
+            leaderboard.refresh()
+            table.update_results(leaderboard.top())
+            root.update_idletasks()
+        update_sec = (time.perf_counter() - start) / repeat
+        store.close()
+
+    root.destroy()
+    print(f"rebuild ranking: {rebuild_sec * 1e3:.2f} ms")
+    print(f"update ranking:  {update_sec * 1e3:.2f} ms (including write_result)")
+
+
+if __name__ == "__main__":
+    benchmark_title_transition()
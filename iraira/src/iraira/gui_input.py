@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+from iraira.state import AppState, GameState, GuiState, Page, PlayerState, SignalParam
+
+# GUIのキーボード・クリック操作による状態変更
+# tkinterに依存しないため、記録した入力の再生でもGUIと同じ処理を使う
+
+
+def change_page_state(game_state: GameState, gui_state: GuiState) -> None:
+    """ページの状態を変更する。この変数の変化は監視されており、適したページ表示に切り替えられる"""
+    if gui_state.current_page == Page.TITLE:
+        gui_state.current_page = Page.GAME
+        game_state.clear_game_state()
+    elif gui_state.current_page == Page.GAME:
+        gui_state.current_page = Page.RESULT
+    elif gui_state.current_page == Page.RESULT:
+        gui_state.current_page = Page.TITLE
+
+
+def enter_page(page: Page, player_param: PlayerState) -> None:
+    """表示する画面が切り替わったときの処理。タイトル画面では停止し、ゲーム画面とリザルト画面では再生する"""
+    player_param.play_state = page != Page.TITLE
+
+
+def apply_key(
+    keysym_num: int,
+    app_state: AppState,
+    player_param: PlayerState,
+    sig_param: SignalParam,
+    game_state: GameState,
+    gui_state: GuiState,
+) -> None:
+    """キーボードイベント処理
+
+    :param keysym_num: tkinterのキーイベントの keysym_num
+    """
+    # アプリイベント
+    if keysym_num == 113:  # key: q
+        app_state.is_running = False
+
+    if keysym_num == 65293:  # key: Return, 画面遷移
+        change_page_state(game_state, gui_state)
+
+    # 画面ごとのイベント
+    if gui_state.current_page == Page.GAME:
+        # 操作
+        if keysym_num == 32:  # key: space
+            player_param.change_play_state()
+
+        elif keysym_num == 65361:  # key: Left
+            sig_param.traction_down()
+
+        elif keysym_num == 65363:  # key: Right
+            sig_param.traction_up()
+
+        elif keysym_num == 65362:  # key: Up
+            player_param.volume_up()
+
+        elif keysym_num == 65364:  # key: Down
+            player_param.volume_down()
+
+        # デバッグ用: ゲームゴール
+        elif keysym_num == 103:  # key: g
+            game_state.is_goaled = True
+
+        # デバッグ用: ゲーム途中終了
+        elif keysym_num == 119:  # key: w
+            gui_state.current_page = Page.TITLE
+
+        # デバッグ用: ゲーム途中終了
+        elif keysym_num == 114:  # key: r
+            game_state.increment_touch_count()
@@ -0,0 +1,280 @@
+from __future__ import annotations
+
+import math
+import random
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass
+from enum import Enum, auto
+from pathlib import Path
+from typing import Protocol
+
+from iraira.audio_output import NullOutputDevice, OutputDevice, PyAudioOutputDevice
+from iraira.clock import REAL_CLOCK, Clock
+from iraira.gpio_backend import Edge, GpioBackend, RPiGpioBackend, SimulatedGpioBackend
+from iraira.led_pattern import LedDriver, TimerLedDriver, open_wave_led_driver
+from iraira.serial_protocol import ANALOG_MAX, encode_analog
+from iraira.session_log import SESSION_LOG_SUFFIX, SessionWriter
+from iraira.tracing import TRACE_SUFFIX, Tracer
+
+
+class SerialPort(Protocol):
+    """シリアルポート。pyserial の Serial のうち使用する部分"""
+
+    @property
+    def in_waiting(self) -> int:
+        ...
+
+    def read(self, size: int = 1) -> bytes:
+        ...
+
+    def close(self) -> None:
+        ...
+
+    def __enter__(self) -> SerialPort:
+        ...
+
+    def __exit__(self, exc_type, exc_val, exc_tb):  # type: ignore
+        ...
+
+
+class SimulatedSerial:
+    """M5Atomを模擬するシリアルポート
+
+    送信間隔ごとにアナログ値のフレームを生成する。アナログ値はスティックを周期的に前後に倒した値とする。
+    """
+
+    def __init__(
+        self,
+        timeout: float,
+        clock: Clock = REAL_CLOCK,
+        interval_sec: float = 0.02,
+        stick_period_sec: float = 8.0,
+    ) -> None:
+        """
+        :param timeout: read() の最大待ち時間[sec], 時刻源での時間
+        :param clock: 時刻源
+        :param interval_sec: アナログ値の送信間隔[sec]
+        :param stick_period_sec: スティックを前後に倒す周期[sec]
+        """
+        self._timeout = timeout
+        self._clock = clock
+        self._interval_ns = int(interval_sec * 1e9)
+        self._stick_period_sec = stick_period_sec
+        self._origin_ns = self._next_frame_ns = clock.monotonic_ns()
+        self._pending = bytearray()
+
+    def _generate(self, now_ns: int) -> None:
+        while self._next_frame_ns <= now_ns:
+            t = (self._next_frame_ns - self._origin_ns) / 1e9
+            value = 0.5 + 0.45 * math.sin(2 * math.pi * t / self._stick_period_sec)
+            self._pending += encode_analog(round(value * ANALOG_MAX))
+            self._next_frame_ns += self._interval_ns
+
+    @property
+    def in_waiting(self) -> int:
+        self._generate(self._clock.monotonic_ns())
+        return len(self._pending)
+
+    def read(self, size: int = 1) -> bytes:
+        """受信済みのバイト列を最大size返す。受信がない場合は次のフレームかタイムアウトまで待つ"""
+        now_ns = self._clock.monotonic_ns()
+        self._generate(now_ns)
+        if not self._pending:
+            wait_ns = min(self._next_frame_ns - now_ns, int(self._timeout * 1e9))
+            self._clock.sleep(wait_ns / 1e9)
+            self._generate(self._clock.monotonic_ns())
+
+        data = bytes(self._pending[:size])
+        del self._pending[:size]
+        return data
+
+    def close(self) -> None:
+        self._pending.clear()
+
+    def __enter__(self) -> SimulatedSerial:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):  # type: ignore
+        self.close()
+
+
+def simulated_touch_trace(
+    course_pins: Iterable[int],
+    goal_pin: int,
+    seed: int = 0,
+    touches_per_sec: float = 1.0,
+    goal_interval_sec: float = 30.0,
+    checkpoint_pin: int | None = None,
+) -> Iterator[Edge]:
+    """プレイヤーの操作を模擬した終わりのないエッジ列
+
+    コースにランダムに接触し、goal_interval_sec ごとにゴールに触れる。
+    checkpoint_pin を指定した場合は、ゴールとゴールの間の 40% ~ 60% の時刻にチェックポイントに触れる。
+    接触時間は 0.5 ms ~ 200 ms の対数一様分布とする。
+    """
+    rng = random.Random(seed)
+    course_pins = tuple(course_pins)
+    t = 0.0
+    next_goal = goal_interval_sec
+    next_checkpoint = None if checkpoint_pin is None else goal_interval_sec * rng.uniform(0.4, 0.6)
+    while True:
+        t += rng.expovariate(touches_per_sec)
+        if checkpoint_pin is not None and next_checkpoint is not None and t >= next_checkpoint:
+            yield Edge(checkpoint_pin, 0, int(next_checkpoint * 1e9))
+            yield Edge(checkpoint_pin, 1, int((next_checkpoint + 0.2) * 1e9))
+            t = next_checkpoint + 0.2
+            next_checkpoint = None
+            continue
+
+        if t >= next_goal:
+            yield Edge(goal_pin, 0, int(next_goal * 1e9))
+            yield Edge(goal_pin, 1, int((next_goal + 0.2) * 1e9))
+            t = next_goal + 0.2
+            if checkpoint_pin is not None:
+                next_checkpoint = next_goal + goal_interval_sec * rng.uniform(0.4, 0.6)
+            next_goal += goal_interval_sec
+            continue
+
+        pin = rng.choice(course_pins)
+        length = 10 ** rng.uniform(-3.3, -0.7)
+        yield Edge(pin, 0, int(t * 1e9))
+        yield Edge(pin, 1, int((t + length) * 1e9))
+        t += length
+
+
+class HardwareKind(Enum):
+    """ハードウェアの実装"""
+
+    raspi = auto()  # Raspberry Pi のGPIO・M5Atom・オーディオデバイス
+    simulated = auto()  # プロセス内で模擬した入出力
+
+    def __str__(self) -> str:
+        return self.name
+
+
+@dataclass(frozen=True)
+class Hardware:
+    """各プロセスが使うGPIO・シリアルポート・音声出力の実装を選ぶ
+
+    pickle可能でありプロセスプールのタスク引数として渡せる。各プロセスは必要な入出力だけを開く。
+    simulated の場合は全ての入出力を時刻源の速さで模擬するため、clock を速めると実機なしで長時間の動作を短時間で再現できる。
+    """
+
+    kind: HardwareKind = HardwareKind.raspi
+    clock: Clock = REAL_CLOCK
+    serial_port: str = "/dev/M5_ATOM"  # raspi の場合のM5Atomのシリアルポート
+    seed: int = 0  # simulated の場合の入力の乱数シード
+    session_dir: Path | None = None  # 入力を記録するセッションのディレクトリ, Noneの場合は記録しない
+    trace_dir: Path | None = None  # 入力から出力までの計測点を記録するディレクトリ, Noneの場合は記録しない
+    # raspi の場合に壁接触のピンをGPIOのレジスタから読む頻度[Hz], Noneの場合は RPi.GPIO のエッジ検出を使う
+    touch_sample_hz: float | None = None
+
+    @property
+    def is_simulated(self) -> bool:
+        return self.kind == HardwareKind.simulated
+
+    def gpio_available(self) -> bool:
+        """GPIOを開けるか。raspi の場合は RPi.GPIO を読み込めるかで判定する"""
+        if self.is_simulated:
+            return True
+        try:
+            import RPi.GPIO  # noqa: F401
+        except (ImportError, RuntimeError):
+            # RPi.GPIO はRaspberryPi以外で読み込むと RuntimeError となる
+            return False
+        return True
+
+    def serial_available(self) -> bool:
+        """M5Atomのシリアルポートを開けるか。raspi の場合は pyserial があり、ポートが存在するかで判定する"""
+        if self.is_simulated:
+            return True
+        try:
+            import serial  # noqa: F401
+        except ImportError:
+            return False
+        return Path(self.serial_port).exists()
+
+    def open_gpio(self, simulated_input: Iterable[Edge] = (), sample_hz: float | None = None) -> GpioBackend:
+        """
+        :param simulated_input: simulated の場合に再生する入力のエッジ列
+        :param sample_hz: raspi の場合に全ての入力ピンを同時に読んでエッジを検出する頻度[Hz],
+            Noneの場合は RPi.GPIO のエッジ検出を使う
+        """
+        if not self.is_simulated:
+            if sample_hz is None:
+                return RPiGpioBackend()
+            from iraira.gpio_bank import SampledGpioBackend, open_register_pin_bank
+
+            # /dev/gpiomem を読めない場合は RPi.GPIO で1ピンずつ読む
+            return SampledGpioBackend(RPiGpioBackend(), open_register_pin_bank(), self.clock, sample_hz)
+
+        gpio = SimulatedGpioBackend(self.clock)
+        gpio.replay(simulated_input)
+        return gpio
+
+    def open_led(self, pin: int, initial: int) -> LedDriver:
+        """LEDの点灯パターンの出力を開く
+
+        raspi の場合は pigpio デーモンに接続できればDMAで時刻を決めた波形として出力し、
+        接続できなければ1つのスレッドのタイマーで出力する。
+        """
+        if not self.is_simulated:
+            driver = open_wave_led_driver(pin, initial, self.clock)
+            if driver is not None:
+                return driver
+
+        return TimerLedDriver(self.open_gpio(), pin, initial, self.clock)
+
+    def open_serial(self, baudrate: int, timeout: float) -> SerialPort:
+        """M5Atomのシリアルポートを開く
+
+        :param timeout: read() の最大待ち時間[sec]
+        """
+        if not self.is_simulated:
+            import serial
+
+            return serial.Serial(self.serial_port, baudrate, timeout=timeout)
+
+        return SimulatedSerial(timeout, self.clock)
+
+    def open_session_log(self, name: str) -> SessionWriter | None:
+        """入力を記録するセッションログを開く
+
+        :param name: ログのファイル名。プロセスごとに別の名前とする
+        :return: session_dir が指定されていない場合はNone
+        """
+        if self.session_dir is None:
+            return None
+
+        return SessionWriter(_unused_path(self.session_dir, name, SESSION_LOG_SUFFIX), self.clock)
+
+    def open_tracer(self, name: str) -> Tracer | None:
+        """入力から出力までの計測点を記録する
+
+        :param name: 記録のファイル名。プロセスごとに別の名前とする
+        :return: trace_dir が指定されていない場合はNone
+        """
+        if self.trace_dir is None:
+            return None
+
+        return Tracer(_unused_path(self.trace_dir, name, TRACE_SUFFIX), self.clock)
+
+    def open_audio_output(self) -> OutputDevice:
+        if not self.is_simulated:
+            return PyAudioOutputDevice()
+
+        return NullOutputDevice(clock=self.clock)
+
+
+def _unused_path(dir: Path, name: str, suffix: str) -> Path:
+    """既存のファイルと重ならないパス
+
+    再起動したプロセスが同じ名前で開き直しても、再起動前の記録を上書きしないよう連番を付ける
+    """
+    dir.mkdir(parents=True, exist_ok=True)
+    path = dir / f"{name}{suffix}"
+    i = 1
+    while path.exists():
+        path = dir / f"{name}.{i}{suffix}"
+        i += 1
+    return path
@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import sys
+
+from iraira.events import EventSubscriber
+from iraira.gui_input import enter_page
+from iraira.hal import Hardware
+from iraira.state import AppState, GameState, GuiState, Page, PlayerState, SignalParam
+
+TITLE_DURATION = 3.0  # sec タイトル画面からゲームを開始するまでの時間
+RESULT_DURATION = 10.0  # sec リザルト画面からタイトル画面に戻るまでの時間
+CHECK_INTERVAL = 1.0  # sec 終了状態を確認する間隔
+
+
+def headless_listener(
+    app_state: AppState,
+    player_param: PlayerState,
+    sig_param: SignalParam,
+    game_state: GameState,
+    gui_state: GuiState,
+    events: EventSubscriber,
+    hardware: Hardware = Hardware(),
+) -> None:
+    """GUIを使わずに画面遷移する
+
+    タイトル → ゲーム → (ゴール) → リザルト → タイトル の順に、GUIとボタン操作の代わりに画面を切り替える。
+    シミュレーションした入出力と組み合わせて、画面なしでゲームを繰り返し動作させるために使う。
+    引数は show_gui と同じとし、GUIの代わりに起動できるようにする。
+
+    :param hardware: 画面の表示時間に使う時刻源, 画面遷移を記録するセッションログ
+    """
+    try:
+        clock = hardware.clock
+        session_log = hardware.open_session_log("headless")
+        page_durations = {Page.TITLE: TITLE_DURATION, Page.RESULT: RESULT_DURATION}
+        gui_state.current_page = Page.TITLE
+        previous_page = None
+        page_until = 0.0
+
+        while app_state.is_running:
+            current_page = gui_state.current_page
+            now = clock.monotonic()
+            if current_page != previous_page:
+                previous_page = current_page
+                enter_page(current_page, player_param)
+                page_until = now + page_durations.get(current_page, 0.0)
+
+            next_page = None
+            if current_page == Page.TITLE and now >= page_until:
+                next_page = Page.GAME
+            # ゴール状態はイベントを取りこぼしても遷移できるよう共有状態から読む
+            elif current_page == Page.GAME and game_state.is_goaled:
+                next_page = Page.RESULT
+            elif current_page == Page.RESULT and now >= page_until:
+                next_page = Page.TITLE
+
+            if next_page is not None:
+                if session_log is not None:
+                    session_log.write_page(next_page)
+                change_page(next_page, game_state, gui_state)
+            else:
+                # 画面の表示時間が終わるか、ゴールなどの状態変化イベントを受信するまで待つ
+                timeout = CHECK_INTERVAL if current_page == Page.GAME else min(CHECK_INTERVAL, page_until - now)
+                events.wait(clock.to_real(timeout))
+                events.drain()
+
+        if session_log is not None:
+            session_log.close()
+
+    except Exception as e:
+        print(f"{__file__}: {e}")
+        sys.exit(e)
+
+
+def change_page(page: Page, game_state: GameState, gui_state: GuiState) -> None:
+    """GUIのボタン操作の代わりに画面を遷移する"""
+    if page == Page.GAME:
+        game_state.clear_game_state()
+    gui_state.current_page = page
+    if page == Page.RESULT:
+        game_state.is_goaled = False
@@ -0,0 +1,262 @@
+from __future__ import annotations
+
+import os
+import threading
+from collections.abc import Sequence
+from dataclasses import dataclass
+from typing import Any, Protocol
+
+import numpy as np
+
+from iraira.audio_output import LatencyStats
+from iraira.clock import REAL_CLOCK, Clock
+from iraira.gpio_backend import GpioBackend, SimulatedGpioBackend
+from iraira.scheduler import cpu_load
+
+HIGH = 1
+LOW = 0
+
+Timeline = Sequence[tuple[int, int]]  # (時刻 Clock.monotonic_ns(), レベル) の時刻順の列
+
+
+@dataclass(frozen=True)
+class LedPattern:
+    """LEDの点灯パターン
+
+    1周期分の点灯レベルの変化を duration_ns の間繰り返し、その後は end_level とする。
+    """
+
+    name: str
+    steps: tuple[tuple[int, int], ...]  # 1周期内の (周期の開始からの時刻[ns], レベル)。先頭の時刻は0
+    cycle_ns: int  # 周期[ns]
+    duration_ns: int  # 繰り返す時間[ns], 0の場合は end_level のみ
+    end_level: int
+
+    def compile(self, start_ns: int, until_ns: int, from_ns: int) -> list[tuple[int, int]]:
+        """from_ns 以降のレベルの変化の時刻の列に展開する
+
+        :param start_ns: 最初の周期の開始時刻。繰り返しの位相はこの時刻で決まる
+        :param until_ns: 繰り返しを終えて end_level とする時刻
+        :param from_ns: 展開を始める時刻。先頭はこの時刻のレベルとする
+        """
+        if until_ns <= from_ns or not self.steps:
+            return [(from_ns, self.end_level)]
+
+        cycle = max(0, (from_ns - start_ns) // self.cycle_ns)
+        timeline = [(from_ns, self._level_at((from_ns - start_ns) - cycle * self.cycle_ns))]
+        while True:
+            origin = start_ns + cycle * self.cycle_ns
+            for offset, level in self.steps:
+                t = origin + offset
+                if t >= until_ns:
+                    timeline.append((until_ns, self.end_level))
+                    return timeline
+                if t > from_ns:
+                    timeline.append((t, level))
+            cycle += 1
+
+    def _level_at(self, offset_ns: int) -> int:
+        level = self.steps[0][1]
+        for t, step_level in self.steps:
+            if t > offset_ns:
+                break
+            level = step_level
+        return level
+
+
+def blink_pattern(name: str, interval_sec: float, duration_sec: float, end_level: int = HIGH) -> LedPattern:
+    """interval_sec ごとに消灯・点灯を切り替える点滅"""
+    interval_ns = int(interval_sec * 1e9)
+    return LedPattern(name, ((0, LOW), (interval_ns, HIGH)), 2 * interval_ns, int(duration_sec * 1e9), end_level)
+
+
+def steady_pattern(name: str, level: int) -> LedPattern:
+    return LedPattern(name, (), 1, 0, level)
+
+
+CRASH_PATTERN = blink_pattern("crash", 0.1, 0.5)  # 壁接触
+GOAL_PATTERN = blink_pattern("goal", 0.3, 9.3)  # ゴール
+IDLE_PATTERN = steady_pattern("idle", HIGH)  # 点灯し続ける
+
+
+class LedDriver(Protocol):
+    """レベルの変化の時刻の列を出力する"""
+
+    def run(self, timeline: Timeline) -> None:
+        """出力中の列を止めて timeline を出力する。現在時刻より前の変化はすぐに出力する"""
+        ...
+
+    def close(self) -> None:
+        ...
+
+
+class TimerLedDriver:
+    """1つのスレッドで次の変化の時刻まで待って出力する
+
+    待ち時間は変化の時刻から求めるため遅れは次の変化に持ち越さないが、個々の変化の時刻はCPU負荷の影響を受ける。
+    """
+
+    def __init__(self, gpio: GpioBackend, pin: int, initial: int, clock: Clock = REAL_CLOCK) -> None:
+        self._gpio = gpio
+        self._pin = pin
+        self._clock = clock
+        self._timeline: list[tuple[int, int]] = []
+        self._is_closed = False
+        self._changed = threading.Condition()
+        gpio.setup_output(pin, initial)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def run(self, timeline: Timeline) -> None:
+        with self._changed:
+            self._timeline = list(reversed(timeline))
+            self._changed.notify()
+
+    def close(self) -> None:
+        with self._changed:
+            self._is_closed = True
+            self._changed.notify()
+        self._thread.join()
+
+    def _run(self) -> None:
+        with self._changed:
+            while not self._is_closed:
+                if not self._timeline:
+                    self._changed.wait()
+                    continue
+                t_ns, level = self._timeline[-1]
+                wait_ns = t_ns - self._clock.monotonic_ns()
+                if wait_ns > 0:
+                    # 待っている間に run() で列が置き換えられた場合は、新しい列の先頭から待ち直す
+                    self._changed.wait(self._clock.to_real(wait_ns / 1e9))
+                    continue
+                self._timeline.pop()
+                self._gpio.output(self._pin, level)
+
+
+class WaveLedDriver:
+    """pigpio デーモンがDMAで時刻を決めて出力する波形として出力する
+
+    変化の時刻はDMAが決めるため、CPU負荷や各プロセスのスケジューリングの影響を受けない。
+    """
+
+    def __init__(self, pi: Any, pin: int, initial: int, clock: Clock = REAL_CLOCK) -> None:
+        """
+        :param pi: 接続済みの pigpio.pi
+        """
+        import pigpio
+
+        self._pigpio = pigpio
+        self._pi = pi
+        self._pin = pin
+        self._clock = clock
+        self._wave_id: int | None = None
+        pi.set_mode(pin, pigpio.OUTPUT)
+        pi.write(pin, initial)
+
+    def run(self, timeline: Timeline) -> None:
+        self._stop()
+        if not timeline:
+            return
+        mask = 1 << self._pin
+        now_ns = self._clock.monotonic_ns()
+        pulses = []
+        for (t_ns, level), (next_ns, _) in zip(timeline, [*timeline[1:], timeline[-1]]):
+            # pulse はレベルを設定してから delay [us] 待つ。現在時刻より前の変化はすぐに出力する
+            delay_us = max(0, next_ns - max(t_ns, now_ns)) // 1000
+            pulses.append(self._pigpio.pulse(mask if level else 0, 0 if level else mask, delay_us))
+        self._pi.wave_add_generic(pulses)
+        self._wave_id = self._pi.wave_create()
+        self._pi.wave_send_once(self._wave_id)
+
+    def close(self) -> None:
+        self._stop()
+        self._pi.stop()
+
+    def _stop(self) -> None:
+        self._pi.wave_tx_stop()
+        if self._wave_id is not None:
+            self._pi.wave_delete(self._wave_id)
+            self._wave_id = None
+
+
+def open_wave_led_driver(pin: int, initial: int, clock: Clock = REAL_CLOCK) -> WaveLedDriver | None:
+    """pigpio の波形で出力する LedDriver, pigpio がない場合やデーモンに接続できない場合はNone"""
+    try:
+        import pigpio
+    except ImportError:
+        return None
+
+    pi = pigpio.pi()
+    if not pi.connected:
+        print(f"{__file__}: pigpio daemon is not running")
+        return None
+    return WaveLedDriver(pi, pin, initial, clock)
+
+
+class LedPatternPlayer:
+    """LEDの点灯パターンを LedDriver で出力する
+
+    パターンは開始時に変化の時刻の列に展開して LedDriver に渡すため、呼び出し側は次の変化の時刻に起きる必要がない。
+    再生中のパターンを再び開始した場合は、点滅の位相を保ったまま終了時刻を延ばす。
+    """
+
+    def __init__(self, driver: LedDriver, clock: Clock = REAL_CLOCK) -> None:
+        self._driver = driver
+        self._clock = clock
+        self._pattern: LedPattern | None = None
+        self._start_ns = 0
+        self._until_ns = 0
+
+    def play(self, pattern: LedPattern, now_ns: int | None = None) -> Timeline:
+        """
+        :param now_ns: 開始時刻, Noneの場合は現在時刻
+        :return: 出力する変化の時刻の列
+        """
+        if now_ns is None:
+            now_ns = self._clock.monotonic_ns()
+        if pattern != self._pattern or now_ns >= self._until_ns:
+            self._start_ns = now_ns
+        self._pattern = pattern
+        self._until_ns = now_ns + pattern.duration_ns
+        timeline = pattern.compile(self._start_ns, self._until_ns, now_ns)
+        self._driver.run(timeline)
+        return timeline
+
+    def close(self) -> None:
+        self._driver.close()
+
+
+def measure_led_timing(pattern: LedPattern, clock: Clock = REAL_CLOCK) -> LatencyStats:
+    """疑似GPIOに出力したレベルの変化の時刻と、展開した時刻の列との差"""
+    gpio = SimulatedGpioBackend(clock)
+    pin = 14
+    driver = TimerLedDriver(gpio, pin, HIGH, clock)
+    player = LedPatternPlayer(driver, clock)
+    timeline = player.play(pattern)
+    clock.sleep((timeline[-1][0] - clock.monotonic_ns()) / 1e9 + 0.05)
+    driver.close()
+
+    # setup_output の初期値を除き、同じ順で出力されたレベルの変化と比べる
+    outputs = [e for e in gpio.outputs if e.pin == pin][1:]
+    errors = [max(0, out.t_ns - t_ns) for out, (t_ns, _) in zip(outputs, timeline)]
+    if len(outputs) != len(timeline):
+        print(f"{pattern.name}: expected {len(timeline)} changes, got {len(outputs)}")
+    return LatencyStats.from_ns(np.array(errors, dtype=np.int64))
+
+
+def benchmark_led_timing(load_processes: int | None = None) -> None:
+    """ソフトウェアのタイマーで出力した点滅の時刻の誤差を、CPU負荷の有無で計測する
+
+    :param load_processes: CPU負荷をかけるプロセス数, Noneの場合はCPU数
+    """
+    load_processes = load_processes or os.cpu_count() or 1
+    for label, load in (("idle", 0), (f"{load_processes} busy processes", load_processes)):
+        with cpu_load(load):
+            print(f"-- {label}")
+            for pattern in (CRASH_PATTERN, blink_pattern("fast", 0.005, 1.0)):
+                print(f"{pattern.name:>6}: {measure_led_timing(pattern)}")
+
+
+if __name__ == "__main__":
+    benchmark_led_timing()
@@ -1,11 +1,36 @@
 from __future__ import annotations
 
-import asyncio
-import multiprocessing
-from concurrent.futures import ProcessPoolExecutor
+from collections.abc import Callable
+from contextlib import ExitStack
+from enum import Enum, auto
+from functools import partial
 
-from iraira.player import PlayerState, SignalParam, play
-from iraira.state import SharedAppState, SharedGameState, SharedGuiState, SharedPlayerState, SharedSignalParam
+from iraira.events import EventBus, EventPublisher
+from iraira.hal import Hardware
+from iraira.player import PlayerMode, PlayerState, SignalParam, play
+from iraira.shm_state import SharedStateBlock, ShmAppState, ShmGameState, ShmGuiState, ShmPlayerState, ShmSignalParam
+from iraira.state import (
+    AppState,
+    GameState,
+    GuiState,
+    SharedAppState,
+    SharedGameState,
+    SharedGuiState,
+    SharedPlayerState,
+    SharedSignalParam,
+    StateManager,
+)
+from iraira.supervisor import ProcessMetrics, ProcessSpec, Supervisor, cpu_plan
+
+
+class StateBackend(Enum):
+    """プロセス間で状態共有する方式"""
+
+    manager = auto()  # multiprocessing.Manager (StateManager) の DictProxy
+    shared_memory = auto()  # multiprocessing.shared_memory の固定レイアウトブロック
+
+    def __str__(self) -> str:
+        return self.name
 
 
 def print_info(player_param: PlayerState, sig_param: SignalParam) -> None:
@@ -20,79 +45,220 @@ def print_info(player_param: PlayerState, sig_param: SignalParam) -> None:
     )
 
 
-def main() -> None:
-    loop = asyncio.new_event_loop()
+# 状態変化イベントを購読するプロセス
+EVENT_SUBSCRIBERS = ("player", "gui", "touch", "led", "supervisor")
 
-    # キーボードからのコマンド読み取りと音の再生を別プロセスで実行する。
-    # マルチプロセス: ProcessPoolExecutor
-    # プロセス間通信: multiprocessing#Manager
-    with multiprocessing.Manager() as manager, ProcessPoolExecutor(max_workers=10) as pool:
-        app_state = SharedAppState.get_with_init(manager.dict())
-        player_state = SharedPlayerState.get_with_init(manager.dict())
-        signal_param = SharedSignalParam.get_with_init(manager.dict())
-        game_state = SharedGameState.get_with_init(manager.dict())
-        gui_state = SharedGuiState.get_with_init(manager.dict())
+# リアルタイム優先度 (SCHED_FIFO)。音声の途切れを防ぐため再生を接触検知より優先する
+PLAYER_PRIORITY = 80
+TOUCH_PRIORITY = 70
 
-        print_info(player_state, signal_param)
 
-        futures = []
+def create_states(
+    backend: StateBackend, stack: ExitStack, events: EventPublisher
+) -> tuple[AppState, PlayerState, SignalParam, GameState, GuiState]:
+    """共有状態を生成する。共有に使う資源の解放はstackに登録する
+
+    :param backend: 状態共有の方式
+    :param stack: 共有資源の解放処理を登録するExitStack
+    :param events: 状態変化イベントの配信先
+    :return: アプリ状態, プレイヤー状態, 信号状態, ゲーム状態, GUI状態
+    """
+    if backend == StateBackend.shared_memory:
+        block = stack.enter_context(SharedStateBlock.create())
+        return (
+            ShmAppState.get_with_init(block, events),
+            ShmPlayerState.get_with_init(block, events=events),
+            ShmSignalParam.get_with_init(block, events=events),
+            ShmGameState.get_with_init(block, events=events),
+            ShmGuiState.get_with_init(block, events),
+        )
+
+    manager = stack.enter_context(StateManager())
+    return (
+        SharedAppState.get_with_init(manager.dict(), events),
+        SharedPlayerState.get_with_init(manager.dict(), events=events),
+        SharedSignalParam.get_with_init(manager.dict(), events=events),
+        SharedGameState.get_with_init(manager.game_dict(), events=events),  # type: ignore
+        SharedGuiState.get_with_init(manager.dict(), events),
+    )
+
+
+def select_ui(headless: bool, hardware: Hardware) -> Callable[..., None]:
+    """画面表示のプロセスで実行する関数を選ぶ
+
+    :param headless: Trueの場合はGUIの代わりに画面遷移のみ行う
+    :param hardware: 時刻源, 入力を記録するセッションログ
+    """
+    if headless:
+        from iraira.headless import headless_listener
+
+        return partial(headless_listener, hardware=hardware)
+
+    from iraira.gui import show_gui
+
+    return partial(show_gui, hardware=hardware)
+
 
-        try:
-            future_play = loop.run_in_executor(pool, play, app_state, player_state, signal_param, game_state, gui_state)
-            futures.append(future_play)
-        except RuntimeError as e:
-            print(f"play module: {e}")
+def create_specs(
+    app_state: AppState,
+    player_state: PlayerState,
+    signal_param: SignalParam,
+    game_state: GameState,
+    gui_state: GuiState,
+    event_bus: EventBus,
+    player_mode: PlayerMode,
+    hardware: Hardware,
+    headless: bool,
+    use_wavetable: bool = False,
+    metrics_interval_sec: float | None = None,
+) -> list[ProcessSpec]:
+    """サブシステムごとに実行するプロセス
 
-        # GUIがある環境でのみ動作する
-        try:
-            from iraira.gui import show_gui
+    CPUが十分にある場合、音声再生と接触検知はそれぞれ専用のCPUに割り当ててリアルタイム優先度で実行する。
+    CPUを共有する場合にリアルタイム優先度にすると、待ち合わせの少ないループが他のプロセスを止めてしまうため、
+    通常のスケジューリングで実行する。
+    動作環境にないサブシステムは含めない。
+    """
+    cpus = cpu_plan()
+    specs = [
+        ProcessSpec(
+            "player",
+            play,
+            (
+                app_state,
+                player_state,
+                signal_param,
+                game_state,
+                gui_state,
+                event_bus.subscriber("player"),
+                player_mode,
+                hardware,
+                use_wavetable,
+                metrics_interval_sec,
+            ),
+            cpus["player"],
+            realtime_priority=None if cpus["player"] is None else PLAYER_PRIORITY,
+        )
+    ]
 
-            future_gui = loop.run_in_executor(
-                pool, show_gui, app_state, player_state, signal_param, game_state, gui_state
+    # GUIがある環境でのみ動作する
+    try:
+        ui = select_ui(headless, hardware)
+        specs.append(
+            ProcessSpec(
+                "gui",
+                ui,
+                (app_state, player_state, signal_param, game_state, gui_state, event_bus.subscriber("gui")),
+                cpus["other"],
             )
-            futures.append(future_gui)
-        except RuntimeError as e:
-            print(f"gui module: {e}")
+        )
+    except RuntimeError as e:
+        print(f"gui module: {e}")
 
-        # RaspberryPi環境でのみ動作する
-        try:
-            from iraira.gpio_raspi import switch_listener
+    # RaspberryPi環境でのみ動作する
+    has_gpio = hardware.gpio_available()
+    if has_gpio:
+        from iraira.gpio_raspi import switch_listener
 
-            future_gpio = loop.run_in_executor(pool, switch_listener, app_state, signal_param)
-            futures.append(future_gpio)
-        except RuntimeError as e:
-            print(f"gpio module: {e}")
+        specs.append(ProcessSpec("gpio", switch_listener, (app_state, signal_param, hardware), cpus["other"]))
+    else:
+        print("gpio module: RPi.GPIO is not available")
 
-        try:
-            from iraira.analog_input import analog_listener
+    # M5Atomを接続した環境でのみ動作する
+    if hardware.serial_available():
+        from iraira.analog_input import analog_listener
 
-            f_analog_input = loop.run_in_executor(
-                pool, analog_listener, app_state, signal_param, player_state, game_state, gui_state
+        specs.append(
+            ProcessSpec(
+                "analog_input",
+                analog_listener,
+                (app_state, signal_param, player_state, game_state, gui_state, hardware),
+                cpus["other"],
             )
-            futures.append(f_analog_input)
-        except RuntimeError as e:
-            print(f"analog_input module: {e}")
-
-        try:
-            from iraira.touch_sensing import touch_listener
-
-            f_touch_sensing = loop.run_in_executor(pool, touch_listener, app_state, game_state, gui_state)
-            futures.append(f_touch_sensing)
-        except RuntimeError as e:
-            print(f"touch_sensing module: {e}")
-
-        try:
-            from iraira.led_driver import led_listener
-
-            f_led_driver = loop.run_in_executor(pool, led_listener, app_state, game_state, gui_state)
-            futures.append(f_led_driver)
-        except RuntimeError as e:
-            print(f"led_driver module: {e}")
-
-        f = asyncio.gather(*futures, return_exceptions=True)
-        try:
-            loop.run_until_complete(f)
-        except KeyboardInterrupt:
-            f.cancel()
-        finally:
-            loop.close()
+        )
+    else:
+        print(f"analog_input module: {hardware.serial_port} is not available")
+
+    if has_gpio:
+        from iraira.touch_sensing import touch_listener
+
+        specs.append(
+            ProcessSpec(
+                "touch",
+                touch_listener,
+                (app_state, game_state, gui_state, event_bus.subscriber("touch"), hardware),
+                cpus["touch"],
+                realtime_priority=None if cpus["touch"] is None else TOUCH_PRIORITY,
+            )
+        )
+
+        from iraira.led_driver import led_listener
+
+        specs.append(
+            ProcessSpec(
+                "led_driver",
+                led_listener,
+                (app_state, game_state, gui_state, event_bus.subscriber("led"), hardware),
+                cpus["other"],
+            )
+        )
+
+    return specs
+
+
+def print_metrics(metrics: list[ProcessMetrics]) -> None:
+    """プロセスごとのCPU使用率・メモリ・再起動回数"""
+    print()
+    for m in metrics:
+        print(m)
+
+
+def main(
+    state_backend: StateBackend = StateBackend.manager,
+    player_mode: PlayerMode = PlayerMode.blocking,
+    hardware: Hardware = Hardware(),
+    headless: bool = False,
+    metrics_interval_sec: float | None = None,
+    use_wavetable: bool = False,
+) -> None:
+    """
+    :param state_backend: プロセス間の状態共有方式
+    :param player_mode: 音声出力の方式
+    :param hardware: GPIO・シリアルポート・音声出力の実装
+    :param headless: Trueの場合はGUIを表示せず、画面遷移を自動で行う
+    :param metrics_interval_sec: プロセスごとの状態を表示する間隔[sec], Noneの場合は表示しない
+    :param use_wavetable: Trueの場合は牽引力信号を波形テーブルの参照で生成する
+    """
+    # キーボードからのコマンド読み取りと音の再生などのサブシステムをそれぞれ専用のプロセスで実行する。
+    # マルチプロセス: Supervisor が起動・異常終了時の再起動・終了通知を行う
+    # プロセス間通信: multiprocessing#Manager または multiprocessing.shared_memory
+    with ExitStack() as stack:
+        # プロセス間通信: 状態変化の通知はEventBusで購読プロセスに配信する
+        event_bus = EventBus(EVENT_SUBSCRIBERS)
+        app_state, player_state, signal_param, game_state, gui_state = create_states(
+            state_backend, stack, event_bus.publisher
+        )
+
+        print_info(player_state, signal_param)
+
+        specs = create_specs(
+            app_state,
+            player_state,
+            signal_param,
+            game_state,
+            gui_state,
+            event_bus,
+            player_mode,
+            hardware,
+            headless,
+            use_wavetable,
+            metrics_interval_sec,
+        )
+        supervisor = Supervisor(
+            specs,
+            app_state,
+            event_bus.subscriber("supervisor"),
+            report_interval_sec=metrics_interval_sec,
+            report=print_metrics,
+        )
+        supervisor.run()
@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+import time
+from collections import Counter
+from collections.abc import Callable
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class LoopRate:
+    """ループ回転数の集計結果"""
+
+    elapsed_sec: float  # 集計期間[sec]
+    cpu_percent: float  # 集計期間中のプロセスのCPU使用率[%]
+    per_sec: dict[str, float]  # 状態ごとの1秒あたりのループ回数
+
+    def __str__(self) -> str:
+        rates = " ".join(f"{k}={v:.1f}/s" for k, v in sorted(self.per_sec.items()))
+        return f"loop {rates} cpu={self.cpu_percent:.1f}% ({self.elapsed_sec:.1f}s)"
+
+
+class LoopRateCounter:
+    """ループの回転数を状態ごとに数える
+
+    待機中のループが空回りしていないことを確認するために使う。
+    report_interval_sec 経過ごとに集計結果を report に渡し、集計をリセットする。
+    """
+
+    def __init__(
+        self,
+        report_interval_sec: float = 60.0,
+        report: Callable[[LoopRate], None] | None = None,
+    ) -> None:
+        """
+        :param report_interval_sec: 集計結果を報告する間隔[sec]
+        :param report: 集計結果を受け取る関数, Noneの場合は報告しない
+        """
+        self._report_interval_sec = report_interval_sec
+        self._report = report
+        self._counts: Counter[str] = Counter()
+        self._start = time.monotonic()
+        self._start_cpu = time.process_time()
+
+    def count(self, state: object) -> None:
+        """ループ1回を記録する
+
+        :param state: ループの状態, str() で集計のキーとする
+        """
+        self._counts[str(state)] += 1
+        if self._report is not None and time.monotonic() - self._start >= self._report_interval_sec:
+            self._report(self.reset())
+
+    def rate(self) -> LoopRate:
+        """前回のリセットからの集計結果"""
+        elapsed = max(time.monotonic() - self._start, 1e-9)
+        cpu = time.process_time() - self._start_cpu
+        return LoopRate(elapsed, cpu / elapsed * 100, {k: v / elapsed for k, v in self._counts.items()})
+
+    def reset(self) -> LoopRate:
+        """集計結果を返して集計をリセットする"""
+        rate = self.rate()
+        self._counts.clear()
+        self._start = time.monotonic()
+        self._start_cpu = time.process_time()
+        return rate
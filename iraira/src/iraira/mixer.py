@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import os
+import time
+
+import numpy as np
+import numpy.typing as npt
+
+_GAIN_SHIFT = 10  # ゲインの固定小数点の小数部ビット数
+_MAX_GAIN = 32.0  # int16 * ゲインがint32に収まる上限
+
+
+class Voice:
+    """ミキサーの入力1系統
+
+    play() で渡した信号を先頭から順に読み出す。信号はコピーせず参照するため、
+    ブロック毎に生成する信号(牽引力信号など)は生成したブロックをそのまま毎回 play() に渡せる。
+    """
+
+    def __init__(self, gain: float = 1.0) -> None:
+        """
+        :param gain: 音量調整
+        """
+        self._sig: npt.NDArray[np.int16] = np.zeros(0, dtype=np.int16)
+        self._pos = 0
+        self.gain = gain
+
+    @property
+    def gain(self) -> float:
+        return self._gain_q / (1 << _GAIN_SHIFT)
+
+    @gain.setter
+    def gain(self, gain: float) -> None:
+        if not 0 <= gain < _MAX_GAIN:
+            raise ValueError(f"gain expected 0 <= gain < {_MAX_GAIN}")
+        self._gain_q = round(gain * (1 << _GAIN_SHIFT))
+
+    @property
+    def is_playing(self) -> bool:
+        return self._pos < len(self._sig)
+
+    @property
+    def remaining(self) -> int:
+        """未再生のフレーム数"""
+        return len(self._sig) - self._pos
+
+    def play(self, sig: npt.NDArray[np.int16]) -> None:
+        """信号の再生を先頭から開始する。再生中の信号は破棄する"""
+        self._sig = sig
+        self._pos = 0
+
+    def stop(self) -> None:
+        self._sig = self._sig[:0]
+        self._pos = 0
+
+    def mix_into(self, acc: npt.NDArray[np.int32], scratch: npt.NDArray[np.int32]) -> int:
+        """次のブロックを読み出してaccに加算する
+
+        :param acc: 加算先
+        :param scratch: 作業領域, accと同じ長さ
+        :return: 加算したフレーム数
+        """
+        n = min(len(acc), self.remaining)
+        if n == 0:
+            return 0
+
+        src = self._sig[self._pos : self._pos + n]
+        if self._gain_q == 1 << _GAIN_SHIFT:
+            np.add(acc[:n], src, out=acc[:n])
+        else:
+            np.multiply(src, self._gain_q, out=scratch[:n], dtype=np.int32)
+            np.right_shift(scratch[:n], _GAIN_SHIFT, out=scratch[:n])
+            np.add(acc[:n], scratch[:n], out=acc[:n])
+
+        self._pos += n
+        return n
+
+
+class Mixer:
+    """複数の入力を1つのint16信号に合成する
+
+    各入力にゲインを掛けてint32で加算し、int16の値域で飽和させて出力する。
+    作業領域は生成時に確保し、ブロック合成ごとの配列確保は行わない。
+    """
+
+    def __init__(self, max_block: int) -> None:
+        """
+        :param max_block: 1回に合成する最大フレーム数
+        """
+        self._voices: list[Voice] = []
+        self._acc = np.zeros(max_block, dtype=np.int32)
+        self._scratch = np.zeros(max_block, dtype=np.int32)
+
+    @property
+    def max_block(self) -> int:
+        return len(self._acc)
+
+    @property
+    def is_playing(self) -> bool:
+        """再生中の入力があればTrue"""
+        return any(v.is_playing for v in self._voices)
+
+    def add_voice(self, gain: float = 1.0) -> Voice:
+        """入力を追加する
+
+        :param gain: 音量調整
+        """
+        voice = Voice(gain)
+        self._voices.append(voice)
+        return voice
+
+    def mix_into(self, out: npt.NDArray[np.int16]) -> int:
+        """全入力を1ブロック合成する
+
+        :param out: 出力先, max_block以下の長さ
+        :return: 合成したフレーム数。再生中の入力のうち最も長く残っているものに合わせ、out の長さを上限とする
+        """
+        n = len(out)
+        if n > self.max_block:
+            raise ValueError(f"block size expected {self.max_block} or less")
+
+        acc = self._acc[:n]
+        scratch = self._scratch[:n]
+        acc.fill(0)
+
+        frames = 0
+        for v in self._voices:
+            frames = max(frames, v.mix_into(acc, scratch))
+
+        # 値域調整 16bit: 桁あふれで折り返さないよう飽和させる
+        np.clip(acc[:frames], -32768, 32767, out=acc[:frames])
+        np.copyto(out[:frames], acc[:frames], casting="unsafe")
+        return frames
+
+
+def benchmark_mixer(duration_sec: float = 0.5, fs: int = 44_100) -> None:
+    """入力数・ブロック長ごとに1ブロックの合成に要するCPU時間を計測する"""
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, {min(os.sched_getaffinity(0))})  # 1コアで計測する
+
+    rng = np.random.default_rng(0)
+    sig = rng.integers(-32768, 32767, fs, dtype=np.int16)
+
+    for block in (256, 1024, 4410):
+        mixer = Mixer(block)
+        out = np.zeros(block, dtype=np.int16)
+        voices: list[Voice] = []
+        results = []
+        for count in range(1, 9):
+            voices.append(mixer.add_voice(gain=1.0 if count == 1 else 0.5))
+
+            blocks = 0
+            start = time.process_time()
+            while time.process_time() - start < duration_sec / 8:
+                for v in voices:
+                    if not v.is_playing:
+                        v.play(sig)
+                mixer.mix_into(out)
+                blocks += 1
+            us = (time.process_time() - start) / blocks * 1e6
+            results.append(f"{count}:{us:7.1f}us({us / (block / fs * 1e6) * 100:4.1f}%)")
+
+        print(f"block={block:>4}  " + "  ".join(results))
+
+
+if __name__ == "__main__":
+    benchmark_mixer()
@@ -0,0 +1,222 @@
+from __future__ import annotations
+
+import time
+from collections.abc import Callable
+
+import numpy as np
+import numpy.typing as npt
+
+from iraira.state import TractionDirection
+from iraira.traction_wave import traction_wave, traction_wave_into
+from iraira.wavetable import WavetableBank
+
+
+class TractionOscillator:
+    """位相が連続する牽引力信号の発振器
+
+    位相を累積しながら任意のブロック長で信号を生成する。
+    周波数の変更は次のブロックの位相増分に反映されるため波形が途切れない。
+    音量・牽引力方向の変更はブロック内で線形に変化させ、腹の数の変更は新旧の波形をブロック内でクロスフェードする。
+    作業領域は生成時に確保し、ブロック生成ごとの配列確保は行わない。
+    wavetableを指定すると波形を直接計算せずにテーブル参照で生成する。
+    """
+
+    def __init__(
+        self,
+        fs: int,
+        max_block: int = 4410,
+        frequency: int = 63,
+        direction: TractionDirection = TractionDirection.up,
+        count_anti_node: int = 4,
+        volume: float = 0.0,
+        wavetable: WavetableBank | None = None,
+    ) -> None:
+        """
+        :param fs: サンプリング周波数[Hz]
+        :param max_block: 1回に生成する最大フレーム数
+        :param frequency: 信号周波数[Hz]
+        :param direction: 牽引力方向
+        :param count_anti_node: 1周期の腹の数, 3以上を指定する
+        :param volume: 音量 0~1
+        :param wavetable: 波形テーブル, Noneの場合は波形を直接計算する
+        """
+        if not count_anti_node >= 3:
+            raise ValueError("count_anti_node expected 3 or more")
+
+        self._fs = fs
+        self._phase = 0.0  # [rad] [0 2π)
+
+        self._frequency = frequency
+        self._count_anti_node = count_anti_node
+        self._gain = self._target_gain = self._to_gain(direction, volume)
+        self._target_count_anti_node = count_anti_node
+
+        self._index = np.arange(max_block, dtype=np.float64)
+        self._x = np.zeros(max_block)
+        self._wave = np.zeros(max_block)
+        self._wave_next = np.zeros(max_block)
+        self._scratch = np.zeros(max_block)
+
+        self._wavetable = wavetable
+        self._table_index = np.zeros(max_block if wavetable is not None else 0, dtype=np.intp)
+
+    @property
+    def max_block(self) -> int:
+        return len(self._index)
+
+    @property
+    def phase(self) -> float:
+        """次に生成するサンプルの位相[rad]"""
+        return self._phase
+
+    def _wave_into(
+        self,
+        x: npt.NDArray[np.float64],
+        count_anti_node: int,
+        out: npt.NDArray[np.float64],
+        scratch: npt.NDArray[np.float64],
+    ) -> None:
+        if self._wavetable is None:
+            traction_wave_into(x, count_anti_node, out, scratch)
+        else:
+            self._wavetable.lookup_into(x, count_anti_node, out, scratch, self._table_index[: len(x)])
+
+    @staticmethod
+    def _to_gain(direction: TractionDirection, volume: float) -> float:
+        return volume if direction == TractionDirection.up else -volume
+
+    def set_params(
+        self,
+        frequency: int,
+        direction: TractionDirection,
+        count_anti_node: int,
+        volume: float,
+    ) -> None:
+        """次に生成するブロックのパラメータを設定する
+
+        :param frequency: 信号周波数[Hz]
+        :param direction: 牽引力方向
+        :param count_anti_node: 1周期の腹の数, 3以上を指定する
+        :param volume: 音量 0~1
+        """
+        if not count_anti_node >= 3:
+            raise ValueError("count_anti_node expected 3 or more")
+
+        self._frequency = frequency
+        self._target_count_anti_node = count_anti_node
+        self._target_gain = self._to_gain(direction, volume)
+
+    def render(self, out: npt.NDArray[np.int16]) -> None:
+        """信号を1ブロック生成する
+
+        :param out: 出力先, 長さがブロック長となる。max_block以下とする
+        """
+        n = len(out)
+        if n > self.max_block:
+            raise ValueError(f"block size expected {self.max_block} or less")
+        if n == 0:
+            return
+
+        index = self._index[:n]
+        x = self._x[:n]
+        wave = self._wave[:n]
+        scratch = self._scratch[:n]
+
+        # 位相の累積
+        d_phase = 2 * np.pi * self._frequency / self._fs
+        np.multiply(index, d_phase, out=x)
+        np.add(x, self._phase, out=x)
+        self._phase = (self._phase + n * d_phase) % (2 * np.pi)
+
+        self._wave_into(x, self._count_anti_node, wave, scratch)
+
+        # 腹の数の変更: 新しい波形へブロック内でクロスフェード
+        if self._target_count_anti_node != self._count_anti_node:
+            wave_next = self._wave_next[:n]
+            self._wave_into(x, self._target_count_anti_node, wave_next, scratch)
+            np.subtract(wave_next, wave, out=wave_next)
+            np.multiply(index, 1 / n, out=scratch)
+            np.multiply(wave_next, scratch, out=wave_next)
+            np.add(wave, wave_next, out=wave)
+            self._count_anti_node = self._target_count_anti_node
+
+        # 音量と方向の変更: ゲインをブロック内で線形に変化させる
+        if self._target_gain != self._gain:
+            np.multiply(index, (self._target_gain - self._gain) / n, out=scratch)
+            np.add(scratch, self._gain, out=scratch)
+            np.multiply(wave, scratch, out=wave)
+            np.multiply(wave, 32767, out=wave)
+            self._gain = self._target_gain
+        else:
+            np.multiply(wave, 32767 * self._gain, out=wave)
+
+        # 値域調整 16bit
+        np.copyto(out, wave, casting="unsafe")
+
+
+def create_traction_wave(
+    fs: int,
+    frequency: int,
+    traction_direction: TractionDirection,
+    count_anti_node: int = 4,
+) -> npt.NDArray[np.float_]:
+    """牽引力信号を生成する。TractionOscillator の前にブロック毎に波形を再生成していた方式で、速度の比較に使う
+
+    :param fs: サンプリング周波数[Hz]
+    :param frequency: 信号周波数[Hz]
+    :param traction_direction: 牽引力方向
+    :param count_anti_node: 1周期の腹の数, 3以上を指定する, defaults to 4
+    :return: 牽引力信号
+    """
+
+    # 生成波形の長さが波形周波数の整数倍になるように調整
+    duration_sec = 0.1
+    duration_sec = round(duration_sec * frequency) / frequency
+
+    # 波形生成
+    t = np.linspace(0, duration_sec, int(fs * duration_sec), endpoint=False)
+    sig = traction_wave(2 * np.pi * frequency * t, count_anti_node)
+
+    # 牽引力方向の調整
+    if traction_direction == TractionDirection.down:
+        sig = -sig
+
+    return sig
+
+
+def benchmark_oscillator(duration_sec: float = 1.0) -> None:
+    """ブロック毎に波形を再生成する方式と発振器の生成速度を比較する"""
+    fs = 44_100
+
+    def measure(label: str, render: Callable[[], int]) -> None:
+        samples = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < duration_sec:
+            samples += render()
+        print(f"{label:>28}: {samples / (time.perf_counter() - start):>14,.0f} samples/s")
+
+    # 従来方式: パラメータが毎回変わりキャッシュが効かない場合
+    frequencies = iter(range(10**9))
+
+    def regenerate() -> int:
+        w = create_traction_wave(fs, 20 + next(frequencies) % 980, TractionDirection.up, 4)
+        return len((w * 32767 * 0.5).astype(np.int16))
+
+    measure("regenerate (cache miss)", regenerate)
+
+    for wavetable in (None, WavetableBank(cache_dir=None)):
+        for block in (256, 1024, 4410):
+            osc = TractionOscillator(fs, max_block=block, volume=0.5, wavetable=wavetable)
+            out = np.zeros(block, dtype=np.int16)
+
+            def render() -> int:
+                osc.set_params(20 + next(frequencies) % 980, TractionDirection.up, 4, 0.5)
+                osc.render(out)
+                return block
+
+            label = "oscillator" if wavetable is None else "wavetable"
+            measure(f"{label} block={block}", render)
+
+
+if __name__ == "__main__":
+    benchmark_oscillator()
@@ -2,17 +2,23 @@ from __future__ import annotations
 
 import random
 import sys
-import wave
-from functools import lru_cache
-from pathlib import Path
+from enum import Enum, auto
+from typing import Union
 
 import numpy as np
 import numpy.typing as npt
-import pyaudio
 
-from iraira.state import AppState, GameState, GuiState, Page, PlayerState, SignalParam, TractionDirection
-from iraira.traction_wave import traction_wave
+from iraira.audio_output import LatencyStats, OutputDevice, PyAudioOutputDevice, RingBuffer
+from iraira.events import EventKind, EventSubscriber
+from iraira.hal import Hardware
+from iraira.metrics import LoopRateCounter
+from iraira.mixer import Mixer
+from iraira.oscillator import TractionOscillator
+from iraira.sound_assets import SoundAsset, SoundAssetCache
+from iraira.state import AppState, GameState, GuiState, Page, PlayerState, SignalParam
+from iraira.tracing import Flow, Hop, Tracer
 from iraira.util import RepoPath
+from iraira.wavetable import WavetableBank
 
 _assert_path = RepoPath().assert_dir
 _sound_touch_wall_1_path = _assert_path / "効果音ラボ/大砲2.wav"  # 44.1 kHz
@@ -20,35 +26,23 @@ _sound_touch_wall_2_path = _assert_path / "効果音ラボ/爆発2.wav"  # 44.1
 # _sound_touch_wall_2_path = _assert_path / "maouaudio/魔王魂  戦闘09.wav"  # 48.0 kHz
 _sound_goal_path = _assert_path / "nakano sound/ファンファーレ6（戦闘勝利＋BGM）.wav"  # 44.1 kHz
 
-
-def read_wav(file: Path) -> npt.NDArray[np.uint8 | np.int16]:
-    with wave.open(str(file), "rb") as fr:
-        channel = fr.getnchannels()
-        sample_width = fr.getsampwidth()
-        frame = fr.readframes(fr.getnframes())
-
-    if sample_width == 1:
-        d_type = np.uint8
-    elif sample_width == 2:
-        d_type = np.int16
-    else:
-        raise NotImplementedError()
-
-    w = np.frombuffer(frame, dtype=d_type)
-    if channel == 2:
-        return w[::2]
-    return w
+# 待機中のイベント待ちの最大時間[sec]。イベントを取りこぼしても終了状態を確認できるよう上限を設ける
+_idle_wait_sec = 1.0
 
 
 class GameSoundEffect:
-    def __init__(self) -> None:
+    def __init__(self, fs: int) -> None:
+        """
+        :param fs: 再生時のサンプリング周波数[Hz]
+        """
+        cache = SoundAssetCache(fs)
         self._sound_touch_walls = (
-            # (read_wav(_sound_touch_wall_1_path)[:22050] * 2.1).astype(np.int16),  # 0.5 sec & 音量調整
-            # (read_wav(_sound_touch_wall_2_path)[:22050] * 2.5).astype(np.int16),  # 0.5 sec & 音量調整
-            (read_wav(_sound_touch_wall_1_path)[:22050] * 5).astype(np.int16),  # 0.5 sec & 音量調整
-            (read_wav(_sound_touch_wall_2_path)[:22050] * 5).astype(np.int16),  # 0.5 sec & 音量調整
+            # cache.load(SoundAsset(_sound_touch_wall_1_path, gain=2.1, duration_sec=0.5)),  # 0.5 sec & 音量調整
+            # cache.load(SoundAsset(_sound_touch_wall_2_path, gain=2.5, duration_sec=0.5)),  # 0.5 sec & 音量調整
+            cache.load(SoundAsset(_sound_touch_wall_1_path, gain=5, duration_sec=0.5)),  # 0.5 sec & 音量調整
+            cache.load(SoundAsset(_sound_touch_wall_2_path, gain=5, duration_sec=0.5)),  # 0.5 sec & 音量調整
         )
-        self._sound_goal = (read_wav(_sound_goal_path)[: int(44100 * 9.3)] * 1.8).astype(np.int16)  # 音源の使用する長さ & 音量調整
+        self._sound_goal = cache.load(SoundAsset(_sound_goal_path, gain=1.8, duration_sec=9.3))  # 音源の使用する長さ & 音量調整
 
     def sound_touch_wall_random(self) -> npt.NDArray[np.int16]:
         return random.choice(self._sound_touch_walls)
@@ -61,6 +55,8 @@ class Player:
     """音声プレーヤーの制御"""
 
     def __init__(self, param: PlayerState):
+        import pyaudio
+
         self._py_audio = pyaudio.PyAudio()
         self._stream = self._py_audio.open(format=pyaudio.paInt16, channels=1, rate=param.fs, output=True)
         self.param = param
@@ -81,8 +77,16 @@ class Player:
         self._stream.close()
         self._py_audio.terminate()
 
-    def write(self, sig: npt.NDArray[np.int16]) -> None:
+    def write(self, sig: npt.NDArray[np.int16]) -> int:
+        """信号を全て再生し終えるまでブロックする
+
+        :return: 書き込んだフレーム数
+        """
         self._stream.write(sig.tobytes())
+        return len(sig)
+
+    def flush(self) -> None:
+        """書き込み済みの信号は再生済みのため何もしない"""
 
     def __enter__(self) -> Player:
         return self
@@ -91,35 +95,177 @@ class Player:
         self.close()
 
 
-@lru_cache(maxsize=1)
-def create_traction_wave(
-    fs: int,
-    frequency: int,
-    traction_direction: TractionDirection,
-    count_anti_node: int = 4,
-) -> npt.NDArray[np.float_]:
-    """牽引力信号を生成する
-
-    :param fs: サンプリング周波数[Hz]
-    :param frequency: 信号周波数[Hz]
-    :param traction_direction: 牽引力方向
-    :param count_anti_node: 1周期の腹の数, 3以上を指定する, defaults to 4
-    :return: 牽引力信号
+class CallbackPlayer:
+    """コールバック方式の音声プレーヤー
+
+    書き込まれた信号はリングバッファに積まれ、出力デバイスのコールバックが小さなブロック単位で取り出す。
+    書き込みは再生完了を待たないため、再生中の信号を破棄して別の信号にすぐ切り替えられる。
+    """
+
+    def __init__(
+        self,
+        param: PlayerState,
+        device: OutputDevice | None = None,
+        frames_per_buffer: int = 256,
+        buffer_blocks: int = 4,
+    ) -> None:
+        """
+        :param param: プレイヤー状態
+        :param device: 出力デバイス, Noneの場合はPyAudioを使う
+        :param frames_per_buffer: 1回のコールバックで出力するフレーム数
+        :param buffer_blocks: リングバッファに保持するブロック数。書き込みから出力までの最大遅延となる
+        """
+        self.param = param
+        self._frames_per_buffer = frames_per_buffer
+        self._ring = RingBuffer(frames_per_buffer * buffer_blocks)
+        self._block = np.zeros(frames_per_buffer, dtype=np.int16)
+        self._block_sec = frames_per_buffer / param.fs
+
+        self._device = device if device is not None else PyAudioOutputDevice()
+        self._device.open(param.fs, frames_per_buffer, self._callback)
+
+    def _callback(self, frame_count: int) -> bytes:
+        if frame_count > len(self._block):
+            self._block = np.zeros(frame_count, dtype=np.int16)
+        block = self._block[:frame_count]
+        self._ring.read_into(block)
+        return block.tobytes()
+
+    def start(self) -> None:
+        self._device.start()
+
+    def stop(self) -> None:
+        self._device.stop()
+
+    def change_play_state(self) -> None:
+        if self._device.is_active():
+            self.stop()
+        else:
+            self.start()
+
+    def close(self) -> None:
+        self._device.close()
+
+    def write(self, sig: npt.NDArray[np.int16]) -> int:
+        """1ブロック分の空きができるまで待ち、書き込めるだけ書き込む
+
+        :return: 書き込んだフレーム数。残りは呼び出し側が再度書き込む
+        """
+        if len(sig) == 0:
+            return 0
+        self._ring.wait_writable(min(len(sig), self._frames_per_buffer), timeout=self._block_sec * 2)
+        return self._ring.write(sig)
+
+    def flush(self) -> None:
+        """再生待ちの信号を破棄する"""
+        self._ring.flush()
+
+    def latency_stats(self) -> LatencyStats:
+        """書き込みから出力デバイスへ渡されるまでの遅延"""
+        return self._ring.latency_stats()
+
+    def __enter__(self) -> CallbackPlayer:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):  # type: ignore
+        self.close()
+
+
+class PlayerMode(Enum):
+    """音声出力の方式"""
+
+    blocking = auto()  # stream.write による同期出力
+    callback = auto()  # PortAudioコールバックとリングバッファによる非同期出力
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class LoopState(Enum):
+    """再生ループの状態"""
+
+    paused = auto()  # 再生停止中
+    idle = auto()  # 再生する信号がない
+    playing = auto()  # 信号を書き込み中
+
+    def __str__(self) -> str:
+        return self.name
+
+
+def create_player(
+    param: PlayerState, mode: PlayerMode, hardware: Hardware = Hardware()
+) -> Union[Player, CallbackPlayer]:
+    """
+    :param param: プレイヤー状態
+    :param mode: 音声出力の方式
+    :param hardware: 音声出力の実装。simulated の場合は方式によらずコールバック方式で模擬出力に書き込む
     """
+    if mode == PlayerMode.callback or hardware.is_simulated:
+        return CallbackPlayer(param, hardware.open_audio_output())
+    return Player(param)
 
-    # 生成波形の長さが波形周波数の整数倍になるように調整
-    duration_sec = 0.1
-    duration_sec = round(duration_sec * frequency) / frequency
 
-    # 波形生成
-    t = np.linspace(0, duration_sec, int(fs * duration_sec), endpoint=False)
-    sig = traction_wave(2 * np.pi * frequency * t, count_anti_node)
+def _receive_events(
+    events: EventSubscriber, current_page: Page, play_state: bool, touched: int
+) -> tuple[Page, bool, int]:
+    """受信済みの状態変化イベントを反映した画面・再生状態・壁接触を返す
 
-    # 牽引力方向の調整
-    if traction_direction == TractionDirection.down:
-        sig = -sig
+    :param touched: 未処理の壁接触の接触回数, 壁接触がない場合は0
+    """
+    for event in events.drain():
+        if event.kind == EventKind.page_changed:
+            current_page = Page(event.value)
+            touched = 0
+        elif event.kind == EventKind.play_state_changed:
+            play_state = bool(event.value)
+        elif event.kind == EventKind.touched:
+            touched = event.value
+    return current_page, play_state, touched
+
+
+class _PlayTrace:
+    """再生プロセスでの計測点の記録
+
+    状態変化を受け取った時刻を記録し、その状態を反映した信号を次に書き込み終えた時刻を記録する。
+    tracer がNoneの場合は何もしない。
+    """
 
-    return sig
+    def __init__(self, tracer: Tracer | None) -> None:
+        self._tracer = tracer
+        self._pending: list[tuple[Flow, int]] = []
+        self._volume: float | None = None
+        self._block = 0
+
+    def touched(self, touch_count: int) -> None:
+        if self._tracer is None:
+            return
+        self._tracer.stamp(Flow.touch, Hop.observed, touch_count)
+        self._pending.append((Flow.touch, touch_count))
+
+    def volume(self, volume: float) -> None:
+        """ブロックの生成に使う音量を読んだ"""
+        if self._tracer is None:
+            return
+        self._block += 1
+        if volume != self._volume:
+            self._volume = volume
+            self._tracer.stamp(Flow.volume, Hop.observed, self._block)
+            self._pending.append((Flow.volume, self._block))
+
+    def written(self, frames: int) -> None:
+        """信号を Player.write に渡した
+
+        :param frames: 書き込めたフレーム数
+        """
+        if self._tracer is None or frames == 0:
+            return
+        for flow, key in self._pending:
+            self._tracer.stamp(flow, Hop.enqueued, key)
+        self._pending.clear()
+
+    def close(self) -> None:
+        if self._tracer is not None:
+            self._tracer.close()
 
 
 def play(
@@ -128,6 +274,11 @@ def play(
     sig_param: SignalParam,
     game_state: GameState,
     gui_state: GuiState,
+    events: EventSubscriber,
+    player_mode: PlayerMode = PlayerMode.blocking,
+    hardware: Hardware = Hardware(),
+    use_wavetable: bool = False,
+    metrics_interval_sec: float | None = None,
 ) -> None:
     """音声出力
 
@@ -135,45 +286,114 @@ def play(
     :param player_param: プレイヤー状態
     :param sig_param: 信号状態
     :param game_param: ゲーム状態
+    :param events: 状態変化イベントの購読
+    :param player_mode: 音声出力の方式
+    :param hardware: 音声出力の実装, 計測点の記録
+    :param use_wavetable: Trueの場合は牽引力信号を波形テーブルの参照で生成する。Falseの場合は直接計算する
+    :param metrics_interval_sec: ループ回数の集計を表示する間隔[sec], Noneの場合は表示しない
     """
     try:
-        touch_count = 0
-        game_sound = GameSoundEffect()
+        touched = 0
+        trace = _PlayTrace(hardware.open_tracer("player"))
+        game_sound = GameSoundEffect(player_param.fs)
         previus_page = None
 
-        with Player(player_param) as player:
+        # 画面・再生状態・壁接触はイベントで受け取り、チャンク毎に共有状態を読みに行かない
+        current_page = gui_state.current_page
+        play_state = player_param.play_state
+
+        # 牽引力信号はブロック毎に位相を引き継いで生成する
+        # コールバック方式ではブロックを短くしてパラメータ変更を早く反映する
+        is_blocking = player_mode == PlayerMode.blocking and not hardware.is_simulated
+        block_size = player_param.fs // 10 if is_blocking else 1024
+        wavetable = WavetableBank() if use_wavetable else None
+        oscillator = TractionOscillator(player_param.fs, max_block=block_size, wavetable=wavetable)
+        traction_block = np.zeros(block_size, dtype=np.int16)
+
+        # 牽引力信号・壁接触音・ゴール音を重ねて再生する
+        mixer = Mixer(block_size)
+        traction_voice = mixer.add_voice()
+        touch_wall_voice = mixer.add_voice()
+        goal_voice = mixer.add_voice()
+
+        # 合成済みの信号と書き込み済みの位置
+        mix_block = np.zeros(block_size, dtype=np.int16)
+        mix_len = mix_pos = 0
+
+        # 待機中に空回りしていないか確認するため、ループ回数を状態ごとに集計する
+        # 表示はプロセスごとの状態の表示を指定した場合のみとし、通常の実行では出力しない
+        if metrics_interval_sec is None:
+            loop_rate = LoopRateCounter()
+        else:
+            loop_rate = LoopRateCounter(metrics_interval_sec, report=lambda r: print(f"{__file__}: {r}"))
+
+        with create_player(player_param, player_mode, hardware) as player:
             player.start()
+            is_started = True
 
             while app_state.is_running:
-                if not player_param.play_state:
-                    player.stop()
-                    previus_page = gui_state.current_page
+                current_page, play_state, touched = _receive_events(events, current_page, play_state, touched)
+
+                # 停止中は再生状態か画面が変わるまでイベントを待つ
+                if not play_state:
+                    if is_started:
+                        player.stop()
+                        is_started = False
+                    previus_page = current_page
+                    loop_rate.count(LoopState.paused)
+                    events.wait(_idle_wait_sec)
                     continue
-                else:
+                elif not is_started:
                     player.start()
-
-                if gui_state.current_page == Page.RESULT and previus_page != Page.RESULT:
-                    sig = game_sound.sound_goal()
-
-                elif gui_state.current_page == Page.GAME:
-                    if touch_count != game_state.touch_count:
-                        touch_count = game_state.touch_count
-                        sig = game_sound.sound_touch_wall_random()
-                    else:
-                        traction_wave = create_traction_wave(
-                            player_param.fs,
+                    is_started = True
+
+                # 画面遷移時と壁接触時は再生待ちの信号を破棄してすぐに切り替える
+                if current_page != previus_page:
+                    player.flush()
+                    mix_pos = mix_len
+                    touch_wall_voice.stop()
+                    goal_voice.stop()
+                    if current_page == Page.RESULT:
+                        goal_voice.play(game_sound.sound_goal())
+
+                if current_page == Page.GAME and touched:
+                    trace.touched(touched)
+                    touched = 0
+                    player.flush()
+                    mix_pos = mix_len
+                    touch_wall_voice.play(game_sound.sound_touch_wall_random())
+
+                previus_page = current_page
+
+                if mix_pos >= mix_len:
+                    if current_page == Page.GAME:
+                        volume = player_param.volume
+                        trace.volume(volume)
+                        oscillator.set_params(
                             sig_param.frequency,
                             sig_param.traction_direction,
                             sig_param.count_anti_node,
+                            volume,
                         )
-                        # 値域調整 16bit & 音量調整
-                        sig = (traction_wave * 32767 * player_param.volume).astype(np.int16)
-
-                else:
-                    continue
-
-                previus_page = gui_state.current_page
-                player.write(sig)
+                        oscillator.render(traction_block)
+                        traction_voice.play(traction_block)
+
+                    mix_len, mix_pos = mixer.mix_into(mix_block), 0
+                    if mix_len == 0:
+                        # 再生する信号がない画面ではイベントを待つ
+                        loop_rate.count(LoopState.idle)
+                        events.wait(_idle_wait_sec)
+                        continue
+
+                loop_rate.count(LoopState.playing)
+                written = player.write(mix_block[mix_pos:mix_len])
+                mix_pos += written
+                trace.written(written)
+
+            print(f"{__file__}: {loop_rate.rate()}")
+            if isinstance(player, CallbackPlayer):
+                print(f"{__file__}: {player.latency_stats()}")
+            trace.close()
 
     except Exception as e:
         print(f"{__file__}: {e}")
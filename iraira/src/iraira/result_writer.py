@@ -0,0 +1,324 @@
+from __future__ import annotations
+
+import json
+import os
+import queue
+import random
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from collections.abc import Iterable
+from datetime import datetime
+from pathlib import Path
+from typing import Union, cast
+
+import numpy as np
+
+from iraira.audio_output import LatencyStats
+from iraira.results_store import FinishedGame, ResultsStore, SignalSettings
+from iraira.state import TractionDirection
+from iraira.util import RepoPath
+
+_default_db_path = RepoPath().db_dir / "results.sqlite3"
+_default_journal_path = RepoPath().db_dir / "results.journal"
+
+_STOP = object()  # 書き込みスレッドを終了する
+
+
+class ResultJournal:
+    """保存前の結果を追記するジャーナル
+
+    1行に1件、CRC32と連番付きのJSONで追記する。書き込み途中で終了した末尾の行はCRCが一致しないため読み飛ばす。
+    """
+
+    def __init__(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._path = path
+        self._file = path.open("ab")
+
+    def append(self, entries: Iterable[tuple[int, FinishedGame]]) -> None:
+        """連番と結果を追記してfsyncする"""
+        lines = []
+        for seq, g in entries:
+            data = json.dumps(
+                {
+                    "seq": seq,
+                    "name": g.name,
+                    "start_datetime": g.start_datetime.isoformat(),
+                    "time_sec": g.time_sec,
+                    "touch_count": g.touch_count,
+                    "touch_time_sec": g.touch_time_sec,
+                    "signal": None if g.signal is None else _signal_to_json(g.signal),
+                    "checkpoint_sec": g.checkpoint_sec,
+                },
+                ensure_ascii=False,
+            ).encode()
+            lines.append(b"%08x %s\n" % (zlib.crc32(data), data))
+        self._file.write(b"".join(lines))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def read(self) -> list[tuple[int, FinishedGame]]:
+        """読み込める全ての連番と結果"""
+        entries = []
+        for line in self._path.read_bytes().split(b"\n"):
+            crc, _, data = line.partition(b" ")
+            if not data or crc != b"%08x" % zlib.crc32(data):
+                continue
+            d = json.loads(data)
+            game = FinishedGame(
+                d["name"],
+                datetime.fromisoformat(d["start_datetime"]),
+                d["time_sec"],
+                d["touch_count"],
+                d["touch_time_sec"],
+                None if d.get("signal") is None else _signal_from_json(d["signal"]),
+                d.get("checkpoint_sec"),
+            )
+            entries.append((d["seq"], game))
+        return entries
+
+    def truncate(self) -> None:
+        """全ての結果がデータベースに反映された後に空にする"""
+        self._file.truncate(0)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def _signal_to_json(signal: SignalSettings) -> list:
+    return [signal.frequency, signal.traction_direction.name, signal.count_anti_node]
+
+
+def _signal_from_json(values: list) -> SignalSettings:
+    frequency, traction_direction, count_anti_node = values
+    return SignalSettings(frequency, TractionDirection[traction_direction], count_anti_node)
+
+
+class ResultWriter:
+    """終了したゲームの結果を別スレッドでまとめて保存する
+
+    submit() はキューに積むだけで、ディスクの読み書きを待たない。書き込みスレッドは結果をまとめて
+    ジャーナルに追記してfsyncした後にデータベースに追記し、checkpoint_interval_sec ごとに
+    データベースをfsyncしてからジャーナルを空にする。
+    異常終了した場合は、次に開いたときにジャーナルのうちデータベースに未反映の結果を追記する。
+    """
+
+    def __init__(
+        self,
+        db_path: Path = _default_db_path,
+        journal_path: Path = _default_journal_path,
+        batch_size: int = 64,
+        batch_delay_sec: float = 0.05,
+        checkpoint_interval_sec: float = 5.0,
+        latency_history: int = 65536,
+    ) -> None:
+        """
+        :param db_path: 結果のデータベース
+        :param journal_path: ジャーナルのファイル
+        :param batch_size: まとめて書き込む結果の最大数
+        :param batch_delay_sec: 最初の結果を受け取ってから、まとめる結果を待つ最大時間[sec]
+        :param checkpoint_interval_sec: データベースをfsyncしてジャーナルを空にする間隔[sec]
+        :param latency_history: 保持する遅延計測値の数
+        """
+        self._db_path = db_path
+        self._journal_path = journal_path
+        self._batch_size = batch_size
+        self._batch_delay_sec = batch_delay_sec
+        self._checkpoint_interval_sec = checkpoint_interval_sec
+
+        self._queue: queue.SimpleQueue[Union[tuple[int, FinishedGame], object]] = queue.SimpleQueue()
+        self._condition = threading.Condition()
+        self._submitted = 0
+        self._durable = 0
+        self._latencies_ns = np.zeros(latency_history, dtype=np.int64)
+        self._error: Exception | None = None
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, game: FinishedGame) -> None:
+        """結果を保存待ちのキューに積む。ブロックしない"""
+        with self._condition:
+            self._submitted += 1
+        self._queue.put((time.perf_counter_ns(), game))
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """それまでに積んだ結果がジャーナルに記録されるまで待つ
+
+        :return: 記録された場合True, タイムアウトした場合False
+        """
+        with self._condition:
+            target = self._submitted
+            return self._condition.wait_for(lambda: self._durable >= target or self._error is not None, timeout)
+
+    def latency_stats(self) -> LatencyStats:
+        """submit() からジャーナルへの記録までの遅延"""
+        with self._condition:
+            n = min(self._durable, len(self._latencies_ns))
+            return LatencyStats.from_ns(self._latencies_ns[:n].copy())
+
+    def close(self) -> None:
+        """積んだ全ての結果を保存して終了する"""
+        self._queue.put(_STOP)
+        self._thread.join()
+        if self._error is not None:
+            print(f"{__file__}: {self._error}")
+
+    def __enter__(self) -> ResultWriter:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):  # type: ignore
+        self.close()
+
+    def _run(self) -> None:
+        try:
+            # SQLiteの接続は作成したスレッドでのみ使える
+            with ResultsStore(self._db_path) as store:
+                journal = ResultJournal(self._journal_path)
+                seq = self._recover(store, journal)
+
+                checkpoint_at = time.monotonic() + self._checkpoint_interval_sec
+                is_stopping = False
+                while not is_stopping:
+                    batch, is_stopping = self._take_batch(max(0.0, checkpoint_at - time.monotonic()))
+                    if batch:
+                        entries = [(seq + i + 1, game) for i, (_, game) in enumerate(batch)]
+                        seq += len(batch)
+                        journal.append(entries)
+                        self._on_durable(t for t, _ in batch)
+                        store.write_results([game for _, game in entries], seq)
+
+                    if is_stopping or time.monotonic() >= checkpoint_at:
+                        store.checkpoint()
+                        journal.truncate()
+                        checkpoint_at = time.monotonic() + self._checkpoint_interval_sec
+
+                journal.close()
+
+        except Exception as e:
+            with self._condition:
+                self._error = e
+                self._condition.notify_all()
+
+    def _recover(self, store: ResultsStore, journal: ResultJournal) -> int:
+        """ジャーナルのうちデータベースに未反映の結果を追記する
+
+        :return: 最後の連番
+        """
+        applied_seq = store.journal_seq()
+        entries = [(seq, game) for seq, game in journal.read() if seq > applied_seq]
+        if entries:
+            store.write_results([game for _, game in entries], entries[-1][0])
+            print(f"{__file__}: recovered {len(entries)} results from journal")
+        store.checkpoint()
+        journal.truncate()
+        return store.journal_seq()
+
+    def _take_batch(self, timeout: float) -> tuple[list[tuple[int, FinishedGame]], bool]:
+        """最初の結果を timeout まで待ち、続く結果を batch_delay_sec まで待ってまとめる
+
+        :return: まとめた結果, 終了要求を受け取った場合True
+        """
+        batch: list[tuple[int, FinishedGame]] = []
+        deadline: float | None = None
+        while len(batch) < self._batch_size:
+            wait = timeout if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=wait)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch + self._drain(), True
+            batch.append(cast(tuple[int, FinishedGame], item))
+            if deadline is None:
+                deadline = time.monotonic() + self._batch_delay_sec
+        return batch, False
+
+    def _drain(self) -> list[tuple[int, FinishedGame]]:
+        items: list[tuple[int, FinishedGame]] = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return items
+            if item is not _STOP:
+                items.append(cast(tuple[int, FinishedGame], item))
+
+    def _on_durable(self, submitted_ns: Iterable[int]) -> None:
+        now = time.perf_counter_ns()
+        with self._condition:
+            for t in submitted_ns:
+                self._latencies_ns[self._durable % len(self._latencies_ns)] = now - t
+                self._durable += 1
+            self._condition.notify_all()
+
+
+def benchmark_result_writer(bursts: int = 20, burst_size: int = 500, interval_sec: float = 0.2) -> None:
+    """結果をまとめて積んだときの submit() の所要時間、ジャーナルへの記録までの遅延、保存のスループットを計測する"""
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as d:
+        db_path = Path(d) / "results.sqlite3"
+        with ResultsStore(db_path) as store:
+            base = store.count()  # 従来のCSVを取り込んだ件数
+
+        writer = ResultWriter(db_path, Path(d) / "results.journal")
+        submit_ns = []
+        for _ in range(bursts):
+            for _ in range(burst_size):
+                game = FinishedGame("player", datetime.now(), rng.uniform(30, 250), rng.randrange(40), 0.0)
+                t = time.perf_counter_ns()
+                writer.submit(game)
+                submit_ns.append(time.perf_counter_ns() - t)
+            time.sleep(interval_sec)
+        burst_latency = writer.latency_stats()
+
+        # スループット: 全件をまとめて積んでからジャーナルに記録されるまで
+        count = bursts * burst_size
+        start = time.perf_counter()
+        for _ in range(count):
+            writer.submit(FinishedGame("player", datetime.now(), rng.uniform(30, 250), rng.randrange(40), 0.0))
+        writer.flush()
+        elapsed = time.perf_counter() - start
+        writer.close()
+
+        with ResultsStore(db_path) as store:
+            assert store.count() == base + count * 2, "results lost"
+
+    print(f"{bursts} bursts x {burst_size} results")
+    print(f"submit:  {LatencyStats.from_ns(np.array(submit_ns, dtype=np.int64))}")
+    print(f"durable: {burst_latency}")
+    print(f"throughput: {count / elapsed:.0f} results/s ({count} results at once)")
+
+
+def check_recovery() -> None:
+    """ジャーナルに記録済みでデータベースに未反映の結果を、次に開いたときに1回だけ追記することを確認する"""
+    with tempfile.TemporaryDirectory() as d:
+        db_path, journal_path = Path(d) / "results.sqlite3", Path(d) / "results.journal"
+        with ResultsStore(db_path) as store:
+            base = store.count()
+
+        # データベースへの追記前に異常終了した状態: ジャーナルのみに記録があり、末尾の行は書き込み途中
+        journal = ResultJournal(journal_path)
+        journal.append((seq, FinishedGame(f"p{seq}", datetime.now(), 60.0, seq, 0.0)) for seq in (1, 2, 3))
+        journal.close()
+        with journal_path.open("ab") as f:
+            f.write(b"0000")
+
+        for _ in range(2):
+            ResultWriter(db_path, journal_path).close()
+            with ResultsStore(db_path) as store:
+                assert store.count() == base + 3, f"expected {base + 3} results, got {store.count()}"
+
+    print("recovery ok")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["recovery"]:
+        check_recovery()
+    else:
+        benchmark_result_writer()
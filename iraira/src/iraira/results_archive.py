@@ -0,0 +1,576 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import tempfile
+import time
+from collections.abc import Callable, Iterator, Sequence
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from enum import Enum
+from functools import partial
+from pathlib import Path
+from typing import IO
+
+import numpy as np
+import numpy.typing as npt
+
+from iraira.results_store import Result, ResultsStore
+from iraira.scoring import DEFAULT_FORMULA, ScoringFormula, formulas, get_formula
+from iraira.state import TractionDirection
+from iraira.util import RepoPath
+
+_default_archive_dir = RepoPath().db_dir / "results_archive"
+
+# 1件の結果。start_sec は記録時のローカル時刻を1970-01-01からの秒数としたもので、日・時間帯の集計に使う
+# 信号パラメータを記録していない結果は frequency, count_anti_node が -1, traction_direction が 0
+# スコアは算出式を変えられるよう保存せず、集計のたびに算出する
+# 時間は結果のデータベース (REAL) と同じ値からスコアを算出するよう倍精度とする
+_ARCHIVE_DTYPE = np.dtype(
+    [
+        ("id", "<i8"),
+        ("start_sec", "<i8"),
+        ("time_sec", "<f8"),
+        ("touch_count", "<i4"),
+        ("touch_time_sec", "<f8"),
+        ("player", "<i4"),
+        ("frequency", "<i4"),
+        ("traction_direction", "i1"),
+        ("count_anti_node", "<i4"),
+    ]
+)
+_NAMES: tuple[str, ...] = _ARCHIVE_DTYPE.names or ()
+_CHUNK_PATTERN = "chunk-*.id.npy"
+_PLAYERS_FILE = "players.json"
+_EPOCH = datetime(1970, 1, 1)
+
+SCORE_RESOLUTION = 0.1  # 百分位を求めるスコアの分解能
+_MAX_HISTOGRAM = 1 << 24  # グループごとのスコアの度数分布の最大要素数。超える場合はソートして求める
+_BLOCK_ROWS = 1 << 16  # 集計でまとめて演算する結果の数。一時配列をCPUキャッシュに収める
+
+
+class GroupBy(Enum):
+    """集計のグループ"""
+
+    day = "day"  # 記録した日
+    hour = "hour"  # 記録した時間帯 (0-23時)
+    player = "player"
+    frequency = "frequency"
+    traction_direction = "traction_direction"
+    count_anti_node = "count_anti_node"
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class ResultsArchive:
+    """集計用のゲーム結果の列指向の保存先
+
+    結果をチャンクごと・列ごとの .npy ファイルに追記し、メモリマップで読み込む。
+    集計は必要な列の配列に対するベクトル演算のみで行い、結果ごとのPythonオブジェクトを作らない。
+    ResultsStore から sync() で追記された結果のみを取り込む。
+    """
+
+    def __init__(self, path: Path = _default_archive_dir, chunk_rows: int = 1 << 20) -> None:
+        """
+        :param path: チャンクファイルを置くディレクトリ
+        :param chunk_rows: 1チャンクの結果の数
+        """
+        path.mkdir(parents=True, exist_ok=True)
+        self._path = path
+        self._chunk_rows = chunk_rows
+        self._chunks = [self._load_chunk(i) for i in range(len(list(path.glob(_CHUNK_PATTERN))))]
+
+        players_path = path / _PLAYERS_FILE
+        self._players: list[str] = json.loads(players_path.read_text("utf-8")) if players_path.exists() else []
+        self._player_index = {name: i for i, name in enumerate(self._players)}
+
+    def _chunk_path(self, index: int, column: str) -> Path:
+        return self._path / f"chunk-{index:06d}.{column}.npy"
+
+    def _load_chunk(self, index: int) -> dict[str, npt.NDArray]:
+        columns = {name: np.load(self._chunk_path(index, name), mmap_mode="r") for name in _NAMES}
+        # 追記の途中で終了した場合は列ごとに長さが異なるため、全ての列が揃った結果のみとする
+        n = min(len(c) for c in columns.values())
+        return {name: c[:n] for name, c in columns.items()}
+
+    def __len__(self) -> int:
+        return sum(len(c["id"]) for c in self._chunks)
+
+    def last_id(self) -> int:
+        """最後に取り込んだ結果のid, 結果がない場合は0"""
+        if not self._chunks or len(self._chunks[-1]["id"]) == 0:
+            return 0
+        return int(self._chunks[-1]["id"][-1])
+
+    def player_names(self) -> list[str]:
+        """player 列の値ごとのプレイヤー名"""
+        return list(self._players)
+
+    def chunks(self, start: int = 0) -> list[dict[str, npt.NDArray]]:
+        """チャンクごとの列。集計はチャンクごとに行い、列全体の配列を作らない
+
+        :param start: 最初の結果の位置。これより前の結果は含めない
+        """
+        chunks = []
+        for chunk in self._chunks:
+            n = len(chunk["id"])
+            if start < n:
+                chunks.append({name: c[start:] for name, c in chunk.items()} if start > 0 else chunk)
+            start = max(0, start - n)
+        return chunks
+
+    def column(self, name: str) -> npt.NDArray:
+        """全ての結果の1列"""
+        chunks = [c[name] for c in self._chunks]
+        return np.concatenate(chunks) if chunks else np.zeros(0, dtype=_ARCHIVE_DTYPE[name])
+
+    def columns(self) -> dict[str, npt.NDArray]:
+        """全ての結果の全ての列"""
+        return {name: self.column(name) for name in _NAMES}
+
+    def append(self, rows: npt.NDArray[np.void]) -> None:
+        """結果を追記する。最後のチャンクに空きがあれば埋めてから新しいチャンクを作る
+
+        :param rows: _ARCHIVE_DTYPE の構造化配列。idの昇順
+        """
+        rows = rows.astype(_ARCHIVE_DTYPE, copy=False)
+        while len(rows) > 0:
+            if self._chunks and len(self._chunks[-1]["id"]) < self._chunk_rows:
+                # メモリマップを閉じてから置き換える
+                last = {name: np.array(c) for name, c in self._chunks.pop().items()}
+                n = self._chunk_rows - len(last["id"])
+                chunk = {name: np.concatenate((last[name], rows[name][:n])) for name in _NAMES}
+            else:
+                n = self._chunk_rows
+                chunk = {name: rows[name][:n] for name in _NAMES}
+            rows = rows[n:]
+
+            # チャンクの有無は id 列のファイルで判定するため、id 列を最後に書き込む
+            index = len(self._chunks)
+            for name in sorted(chunk, key=lambda name: name == "id"):
+                _replace(self._chunk_path(index, name), partial(np.save, arr=chunk[name]))
+            self._chunks.append(self._load_chunk(index))
+
+    def append_results(self, results: Sequence[Result]) -> None:
+        """ResultsStore の結果を追記する"""
+        rows = np.zeros(len(results), dtype=_ARCHIVE_DTYPE)
+        for i, r in enumerate(results):
+            rows[i] = (
+                r.id,
+                (r.start_datetime - _EPOCH) // timedelta(seconds=1),
+                r.time_sec,
+                r.touch_count,
+                r.touch_time_sec,
+                self._player(r.name),
+                -1 if r.signal is None else r.signal.frequency,
+                0 if r.signal is None else r.signal.traction_direction.value,
+                -1 if r.signal is None else r.signal.count_anti_node,
+            )
+        # チャンクより先にプレイヤー名を保存し、チャンクが参照する名前が常に存在するようにする
+        players = json.dumps(self._players, ensure_ascii=False)
+        _replace(self._path / _PLAYERS_FILE, lambda f: f.write(players.encode()))
+        self.append(rows)
+
+    def _player(self, name: str) -> int:
+        if name not in self._player_index:
+            self._player_index[name] = len(self._players)
+            self._players.append(name)
+        return self._player_index[name]
+
+    def sync(self, store: ResultsStore, batch: int = 100_000) -> int:
+        """ResultsStore に追記された結果を取り込む
+
+        :return: 取り込んだ結果の数
+        """
+        count = 0
+        while True:
+            results = store.results_since(self.last_id(), batch)
+            if not results:
+                return count
+            self.append_results(results)
+            count += len(results)
+
+
+def _replace(path: Path, write: Callable[[IO[bytes]], object]) -> None:
+    """一時ファイルに書き込んでから置き換え、書き込み途中のファイルを残さない"""
+    with tempfile.NamedTemporaryFile(dir=path.parent, suffix=".tmp", delete=False) as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(f.name, path)
+
+
+@dataclass(frozen=True)
+class GroupStats:
+    """グループごとの集計"""
+
+    by: GroupBy
+    labels: tuple[str, ...]
+    count: npt.NDArray[np.int64]
+    mean_time_sec: npt.NDArray[np.float64]
+    mean_touch_count: npt.NDArray[np.float64]
+    percentiles: tuple[float, ...]
+    score_percentiles: npt.NDArray[np.float64]  # (グループ, 百分位) 分解能は SCORE_RESOLUTION
+
+    def __str__(self) -> str:
+        header = f"{str(self.by):>20} {'count':>9} {'time_sec':>9} {'touches':>8}"
+        header += "".join(f" {f'p{p:g}':>7}" for p in self.percentiles)
+        lines = [header]
+        for i, label in enumerate(self.labels):
+            line = f"{label:>20} {self.count[i]:9d} {self.mean_time_sec[i]:9.1f} {self.mean_touch_count[i]:8.2f}"
+            line += "".join(f" {s:7.1f}" for s in self.score_percentiles[i])
+            lines.append(line)
+        return "\n".join(lines)
+
+
+def _blocks(chunk: dict[str, npt.NDArray]) -> Iterator[tuple[int, dict[str, npt.NDArray]]]:
+    """チャンクを _BLOCK_ROWS ごとに分けた列と、チャンク内の開始位置"""
+    for start in range(0, len(chunk["id"]), _BLOCK_ROWS):
+        yield start, {name: c[start : start + _BLOCK_ROWS] for name, c in chunk.items()}
+
+
+def _chunk_groups(chunk: dict[str, npt.NDArray], by: GroupBy) -> npt.NDArray[np.intp]:
+    """チャンクの結果ごとのグループの値"""
+    if by == GroupBy.day:
+        return chunk["start_sec"] // 86400
+    if by == GroupBy.hour:
+        return chunk["start_sec"] // 3600 % 24
+    return chunk[by.value].astype(np.intp)
+
+
+def _group_range(archive: ResultsArchive, by: GroupBy) -> tuple[int, int]:
+    """グループの値の最小値と範囲の大きさ"""
+    if by == GroupBy.hour:
+        return 0, 24
+
+    ranges = [
+        (int(g.min()), int(g.max()))
+        for g in (_chunk_groups(block, by) for chunk in archive.chunks() for _, block in _blocks(chunk))
+        if len(g) > 0
+    ]
+    if not ranges:
+        return 0, 0
+    lo = min(r[0] for r in ranges)
+    return lo, max(r[1] for r in ranges) - lo + 1
+
+
+def _label(by: GroupBy, key: int, archive: ResultsArchive) -> str:
+    if by == GroupBy.day:
+        return (_EPOCH + timedelta(days=key)).date().isoformat()
+    if by == GroupBy.hour:
+        return f"{key:02d}:00"
+    if by == GroupBy.player:
+        return archive.player_names()[key]
+    if by == GroupBy.traction_direction:
+        return "unknown" if key == 0 else TractionDirection(key).name
+    return "unknown" if key < 0 else str(key)
+
+
+def chunk_scores(chunk: dict[str, npt.NDArray], formula: ScoringFormula) -> npt.NDArray[np.float64]:
+    """チャンクの結果ごとのスコア"""
+    return formula.score_array(chunk["time_sec"], chunk["touch_count"], chunk["touch_time_sec"])
+
+
+def _score_bins(score: npt.NDArray[np.float64], bins: int) -> npt.NDArray[np.intp]:
+    """スコアを SCORE_RESOLUTION で量子化した値"""
+    return np.clip(np.rint(score / SCORE_RESOLUTION), 0, bins - 1).astype(np.intp)
+
+
+def group_stats(
+    archive: ResultsArchive,
+    by: GroupBy,
+    percentiles: Sequence[float] = (50, 90, 99),
+    formula: ScoringFormula = DEFAULT_FORMULA,
+) -> GroupStats:
+    """グループごとの件数、平均クリア時間、平均接触回数、スコアの百分位を求める
+
+    グループの値の範囲の配列に _BLOCK_ROWS ごとに集計を加算し、列全体やチャンクの大きさの一時配列を作らない。
+    大きな一時配列は確保のたびにページフォールトが起きるため、集計時間の大半を占める。
+    スコアの百分位はグループとスコアの2次元の度数分布の累積から求める (最近順位法)。
+    グループが多く度数分布が大きくなる場合は、グループとスコアの組をソートして求める。
+
+    :param formula: スコアの算出式
+    """
+    lo, n = _group_range(archive, by)
+    score_bins = int(round(formula.base / SCORE_RESOLUTION)) + 1
+    count = np.zeros(n, dtype=np.int64)
+    time_sum = np.zeros(n)
+    touch_sum = np.zeros(n)
+    histogram = np.zeros(n * score_bins, dtype=np.int64) if n * score_bins <= _MAX_HISTOGRAM else None
+    # 度数分布は要素数が多く、加算はチャンクごとにまとめて行う
+    chunks = archive.chunks()
+    keys = np.empty(max((len(c["id"]) for c in chunks), default=0), dtype=np.intp)
+    for chunk in chunks:
+        for start, block in _blocks(chunk):
+            groups = _chunk_groups(block, by) - lo
+            count += np.bincount(groups, minlength=n)
+            time_sum += np.bincount(groups, block["time_sec"], n)
+            touch_sum += np.bincount(groups, block["touch_count"], n)
+            if histogram is not None:
+                block_keys = keys[start : start + len(groups)]
+                np.multiply(groups, score_bins, out=block_keys)
+                block_keys += _score_bins(chunk_scores(block, formula), score_bins)
+        if histogram is not None:
+            histogram += np.bincount(keys[: len(chunk["id"])], minlength=len(histogram))
+
+    # 百分位 p の値は、小さい方から ceil(p / 100 * 件数) 番目の値
+    present = np.flatnonzero(count)
+    count = count[present]
+    ranks = np.maximum(np.ceil(np.outer(count, percentiles) / 100), 1).astype(np.int64)
+    if histogram is not None:
+        cumulative = np.cumsum(histogram.reshape(n, score_bins)[present], axis=1)
+        bins = np.stack([(cumulative < ranks[:, [j]]).sum(axis=1) for j in range(len(percentiles))], axis=1)
+    else:
+        columns = archive.columns()
+        keys = (_chunk_groups(columns, by) - lo) * score_bins + _score_bins(chunk_scores(columns, formula), score_bins)
+        keys.sort()
+        starts: npt.NDArray[np.int64] = np.concatenate((np.zeros(1, dtype=np.int64), np.cumsum(count)[:-1]))
+        bins = keys[starts[:, None] + ranks - 1] % score_bins
+
+    return GroupStats(
+        by,
+        tuple(_label(by, int(k) + lo, archive) for k in present),
+        count,
+        time_sum[present] / count,
+        touch_sum[present] / count,
+        tuple(percentiles),
+        bins * SCORE_RESOLUTION,
+    )
+
+
+def touch_count_distribution(
+    archive: ResultsArchive, by: GroupBy, max_count: int = 20
+) -> tuple[list[str], npt.NDArray[np.int64]]:
+    """グループごとの接触回数の度数分布
+
+    :param max_count: 度数分布の最後の階級。これ以上の接触回数はこの階級に含める
+    :return: グループごとのラベル, (グループ, 接触回数) の度数
+    """
+    lo, n = _group_range(archive, by)
+    bins = max_count + 1
+    distribution = np.zeros(n * bins, dtype=np.int64)
+    for chunk in archive.chunks():
+        for _, block in _blocks(chunk):
+            groups = _chunk_groups(block, by) - lo
+            touches = np.clip(block["touch_count"], 0, max_count)
+            distribution += np.bincount(groups * bins + touches, minlength=len(distribution))
+
+    table = distribution.reshape(n, bins)
+    present = np.flatnonzero(table.sum(axis=1))
+    return [_label(by, int(k) + lo, archive) for k in present], table[present]
+
+
+@dataclass(frozen=True)
+class Ranking:
+    """1つの算出式による全ての結果の順位"""
+
+    formula: ScoringFormula
+    ids: npt.NDArray[np.int64]  # 順位順の結果のid
+    scores: npt.NDArray[np.float64]  # 順位順のスコア
+
+    def top(self, count: int) -> list[tuple[int, float]]:
+        """上位の結果のidとスコア"""
+        return list(zip(self.ids[:count].tolist(), self.scores[:count].tolist()))
+
+    def rank_of(self, id: int) -> int | None:
+        """結果の順位 (1位から), 結果がない場合はNone"""
+        found = np.flatnonzero(self.ids == id)
+        return int(found[0]) + 1 if len(found) > 0 else None
+
+
+def _rank_order(scores: npt.NDArray[np.float64]) -> tuple[npt.NDArray[np.int64], npt.NDArray[np.float64]]:
+    """スコアの高い順、同点の場合は位置の順の並び替え。np.argsort(-scores, kind="stable") と同じ順
+
+    浮動小数点数の安定ソートは遅いため、スコアの上位ビットと位置を1つの整数にまとめて整数としてソートする。
+    切り捨てた下位ビットのみ異なるスコアは位置の順となるため、順が逆になった範囲のみ並べ直す。
+    整数は _BLOCK_ROWS ごとに組み立て、結果の数の大きさの一時配列を作らない。
+
+    :param scores: 0以上のスコア
+    :return: 並び替えの位置, 並び替えたスコア
+    """
+    n = len(scores)
+    shift = max(1, (n - 1).bit_length())
+    keys = np.empty(n, dtype=np.int64)
+    for start in range(0, n, _BLOCK_ROWS):
+        block = keys[start : start + _BLOCK_ROWS]
+        # 0以上の浮動小数点数のビット列は整数としても値の順。-0.0 は 0.0 とする
+        np.add(scores[start : start + _BLOCK_ROWS], 0.0, out=block.view(np.float64))
+        np.subtract(np.iinfo(np.int64).max, block, out=block)
+        block >>= shift
+        block <<= shift
+        block |= np.arange(start, start + len(block))
+    keys.sort()
+    order = keys & ((1 << shift) - 1)
+
+    sorted_scores = scores[order]
+    keys >>= shift
+    same = keys[1:] == keys[:-1]
+    inverted = same & (sorted_scores[1:] > sorted_scores[:-1])
+    if inverted.any():
+        # 上位ビットが同じ範囲ごとに、逆順を含む範囲のみスコアと位置で並べ直す
+        run = np.concatenate((np.zeros(1, dtype=np.int64), np.cumsum(~same)))
+        is_inverted = np.zeros(run[-1] + 1, dtype=bool)
+        is_inverted[run[1:][inverted]] = True
+        sub = np.flatnonzero(is_inverted[run])
+        resorted = np.lexsort((order[sub], -sorted_scores[sub], run[sub]))
+        order[sub] = order[sub][resorted]
+        sorted_scores[sub] = sorted_scores[sub][resorted]
+    return order, sorted_scores
+
+
+class RankingCache:
+    """算出式ごとに全ての結果の順位を保持する
+
+    保持した順位は算出式と取り込み済みの結果の数が変わらない限り再利用する。
+    アーカイブは追記のみのため、結果が追加された場合は追加分のみスコアを算出して保持した順位に併合する。
+    """
+
+    def __init__(self, archive: ResultsArchive) -> None:
+        self._archive = archive
+        self._rankings: dict[str, tuple[int, Ranking]] = {}  # 算出式のkeyごとの、順位に含めた結果の数と順位
+
+    def ranking(self, formula: ScoringFormula = DEFAULT_FORMULA) -> Ranking:
+        """スコアの高い順、同点の場合は先に記録した順の順位"""
+        rows = len(self._archive)
+        cached_rows, cached = self._rankings.get(formula.key, (0, None))
+        if cached is not None and cached.formula != formula:
+            cached_rows, cached = 0, None
+        if cached is not None and cached_rows == rows:
+            return cached
+
+        chunks = self._archive.chunks(cached_rows)
+        ids = np.concatenate([c["id"] for c in chunks]) if chunks else np.zeros(0, dtype=np.int64)
+        scores = np.concatenate([chunk_scores(c, formula) for c in chunks]) if chunks else np.zeros(0, np.float64)
+        # アーカイブはidの昇順のため、同点は先に記録した順となる
+        order, scores = _rank_order(scores)
+        ids = ids[order]
+        if cached is not None:
+            # 追加分は保持した結果より後に記録したため、同点の場合は保持した結果の後に入れる
+            positions = np.searchsorted(-cached.scores, -scores, side="right")
+            ids, scores = np.insert(cached.ids, positions, ids), np.insert(cached.scores, positions, scores)
+
+        ranking = Ranking(formula, ids, scores)
+        self._rankings[formula.key] = (rows, ranking)
+        return ranking
+
+
+def _synthetic_rows(rows: int, players: int, seed: int = 0) -> npt.NDArray[np.void]:
+    """集計の計測用の結果"""
+    rng = np.random.default_rng(seed)
+    data = np.zeros(rows, dtype=_ARCHIVE_DTYPE)
+    data["id"] = np.arange(1, rows + 1)
+    origin = (datetime(2022, 9, 1) - _EPOCH) // timedelta(seconds=1)
+    data["start_sec"] = origin + np.arange(rows) * 3 + rng.integers(0, 3, rows)
+    data["time_sec"] = rng.uniform(30, 250, rows)
+    data["touch_count"] = rng.poisson(8, rows)
+    data["touch_time_sec"] = rng.uniform(0, 20, rows)
+    data["player"] = rng.integers(0, players, rows)
+    data["frequency"] = rng.choice([40, 60, 80, 100], rows)
+    data["traction_direction"] = rng.integers(1, 3, rows)
+    data["count_anti_node"] = rng.integers(1, 6, rows)
+    return data
+
+
+def benchmark_results_archive(rows: int = 10_000_000, players: int = 1000, added: int = 1000) -> None:
+    """rows 件の結果について、各グループの集計時間と、算出式ごとの全件の順位付けの時間を計測する"""
+    with tempfile.TemporaryDirectory() as d:
+        (Path(d) / _PLAYERS_FILE).write_text(json.dumps([f"player{i}" for i in range(players)]), "utf-8")
+        archive = ResultsArchive(Path(d))
+        start = time.perf_counter()
+        synthetic = _synthetic_rows(rows + added, players)
+        archive.append(synthetic[:rows])
+        append_sec = time.perf_counter() - start
+
+        # メモリマップを開き直した状態から計測する
+        archive = ResultsArchive(Path(d))
+        print(f"{len(archive)} rows, append {append_sec:.2f} s")
+        for by in GroupBy:
+            start = time.perf_counter()
+            stats = group_stats(archive, by)
+            stats_sec = time.perf_counter() - start
+
+            start = time.perf_counter()
+            touch_count_distribution(archive, by)
+            touches_sec = time.perf_counter() - start
+            print(
+                f"{str(by):>20}: {len(stats.labels):5d} groups, "
+                f"stats {stats_sec * 1e3:7.1f} ms, touch distribution {touches_sec * 1e3:7.1f} ms"
+            )
+
+        rankings = RankingCache(archive)
+        for formula in formulas():
+            start = time.perf_counter()
+            for chunk in archive.chunks():
+                chunk_scores(chunk, formula)
+            rescore_sec = time.perf_counter() - start
+
+            start = time.perf_counter()
+            rankings.ranking(formula)
+            rank_sec = time.perf_counter() - start
+
+            start = time.perf_counter()
+            rankings.ranking(formula)
+            cached_sec = time.perf_counter() - start
+            print(
+                f"{formula.key:>20}: rescore {rescore_sec * 1e3:7.1f} ms, rank all {rank_sec * 1e3:7.1f} ms, "
+                f"cached {cached_sec * 1e3:5.3f} ms"
+            )
+
+        archive.append(synthetic[rows:])
+        for formula in formulas():
+            start = time.perf_counter()
+            merged = rankings.ranking(formula)
+            merge_sec = time.perf_counter() - start
+            expected = RankingCache(archive).ranking(formula)
+            assert np.array_equal(merged.ids, expected.ids), "merged ranking mismatch"
+            print(f"{formula.key:>20}: merge {added} added results {merge_sec * 1e3:7.1f} ms")
+
+
+def _print_touch_count_distribution(archive: ResultsArchive, by: GroupBy, max_count: int = 20) -> None:
+    labels, distribution = touch_count_distribution(archive, by, max_count)
+    print(f"{str(by):>20} " + " ".join(f"{i:>6}" for i in range(max_count)) + f" {f'{max_count}+':>6}")
+    for label, counts in zip(labels, distribution):
+        print(f"{label:>20} " + " ".join(f"{c:6d}" for c in counts))
+
+
+def _print_ranking(archive: ResultsArchive, formula: ScoringFormula, count: int) -> None:
+    ranking = RankingCache(archive).ranking(formula)
+    print(f"{formula.key}: {len(ranking.ids)} results")
+    for rank, (id, score) in enumerate(ranking.top(count), 1):
+        print(f"{rank:5d} id={id:<10d} score={score:.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="iraira.results_archive")
+    parser.add_argument("--archive", type=Path, default=_default_archive_dir, help="アーカイブのディレクトリ")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("sync", help="結果のデータベースから追記された結果を取り込む")
+    for name, help in (
+        ("stats", "グループごとの集計を表示する"),
+        ("touches", "グループごとの接触回数の度数分布を表示する"),
+        ("ranking", "全ての結果の順位を表示する"),
+    ):
+        p = commands.add_parser(name, help=help)
+        if name == "ranking":
+            p.add_argument("--count", type=int, default=10)
+        else:
+            p.add_argument("--by", type=GroupBy, choices=list(GroupBy), default=GroupBy.day)
+        if name != "touches":
+            p.add_argument("--formula", type=get_formula, default=DEFAULT_FORMULA, help="スコアの算出式 (名前@バージョン)")
+    p = commands.add_parser("benchmark", help="集計時間を計測する")
+    p.add_argument("--rows", type=int, default=10_000_000)
+    args = parser.parse_args()
+
+    if args.command == "sync":
+        with ResultsStore() as store:
+            print(f"synced {ResultsArchive(args.archive).sync(store)} results")
+    elif args.command == "stats":
+        print(group_stats(ResultsArchive(args.archive), args.by, formula=args.formula))
+    elif args.command == "touches":
+        _print_touch_count_distribution(ResultsArchive(args.archive), args.by)
+    elif args.command == "ranking":
+        _print_ranking(ResultsArchive(args.archive), args.formula, args.count)
+    elif args.command == "benchmark":
+        benchmark_results_archive(args.rows)
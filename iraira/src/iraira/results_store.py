@@ -0,0 +1,429 @@
+from __future__ import annotations
+
+import bisect
+import csv
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from collections.abc import Iterator, Sequence
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from iraira.scoring import DEFAULT_FORMULA, ScoringFormula
+from iraira.state import SignalParam, TractionDirection
+from iraira.util import RepoPath
+
+_default_db_path = RepoPath().db_dir / "results.sqlite3"
+_legacy_csv_path = RepoPath().db_dir / "result.csv"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    start_datetime TEXT NOT NULL,
+    time_sec REAL NOT NULL,
+    touch_count INTEGER NOT NULL,
+    touch_time_sec REAL NOT NULL,
+    score REAL NOT NULL,
+    frequency INTEGER,
+    traction_direction TEXT,
+    count_anti_node INTEGER,
+    checkpoint_sec REAL
+);
+CREATE INDEX IF NOT EXISTS results_score ON results (score DESC, id);
+CREATE TABLE IF NOT EXISTS journal (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    applied_seq INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO journal (id, applied_seq) VALUES (0, 0);
+CREATE TABLE IF NOT EXISTS scoring (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    formula TEXT
+);
+INSERT OR IGNORE INTO scoring (id, formula) VALUES (0, NULL);
+"""
+# 以前のデータベースにない場合に追加する列
+_ADDED_COLUMNS = {
+    "frequency": "INTEGER",
+    "traction_direction": "TEXT",
+    "count_anti_node": "INTEGER",
+    "checkpoint_sec": "REAL",
+}
+_COLUMNS = (
+    "id, name, start_datetime, time_sec, touch_count, touch_time_sec, frequency, traction_direction, count_anti_node, "
+    "checkpoint_sec"
+)
+
+
+@dataclass(frozen=True)
+class SignalSettings:
+    """ゲーム終了時の信号パラメータ。設定ごとのスコアの集計に使う"""
+
+    frequency: int
+    traction_direction: TractionDirection
+    count_anti_node: int
+
+    @staticmethod
+    def of(sig_param: SignalParam) -> SignalSettings:
+        return SignalSettings(sig_param.frequency, sig_param.traction_direction, sig_param.count_anti_node)
+
+
+@dataclass(frozen=True)
+class FinishedGame:
+    """終了したゲームの結果。保存時にidを割り当てて Result とする"""
+
+    name: str
+    start_datetime: datetime
+    time_sec: float
+    touch_count: int
+    touch_time_sec: float
+    signal: SignalSettings | None = None  # 記録していない場合はNone
+    checkpoint_sec: float | None = None  # スタートからチェックポイントまでの時間, 記録していない場合はNone
+
+
+@dataclass(frozen=True)
+class Result:
+    id: int
+    name: str
+    start_datetime: datetime
+    time_sec: float
+    touch_count: int
+    touch_time_sec: float
+    signal: SignalSettings | None = None  # 記録していない場合はNone
+    checkpoint_sec: float | None = None  # スタートからチェックポイントまでの時間, 記録していない場合はNone
+
+    @property
+    def start_datetime_iso(self) -> str:
+        return self.start_datetime.isoformat()
+
+    @property
+    def score(self) -> float:
+        """スコアの算出"""
+        return DEFAULT_FORMULA.score(self.time_sec, self.touch_count, self.touch_time_sec)
+
+
+class ResultsStore:
+    """ゲーム結果の保存先
+
+    SQLiteにスコアの索引付きで追記する。上位K件の取得は索引を先頭からK件読むだけであり、
+    追記は索引への挿入のため、どちらも保存済みの件数によらずほぼ一定時間で終わる。
+    複数のプロセスから同時に開いて使える。
+    """
+
+    def __init__(
+        self,
+        path: Path = _default_db_path,
+        legacy_csv_path: Path | None = _legacy_csv_path,
+        formula: ScoringFormula = DEFAULT_FORMULA,
+    ) -> None:
+        """
+        :param path: データベースのファイル
+        :param legacy_csv_path: データベースを新規作成したときに取り込む従来のCSV, Noneの場合は取り込まない
+        :param formula: スコアの算出式。保存済みの結果と異なる場合は全ての結果のスコアを算出し直す
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._formula = formula
+        self._conn = sqlite3.connect(path, timeout=5.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.executescript(_SCHEMA)
+            self._add_columns()
+            self._rescore()
+
+        if legacy_csv_path is not None and legacy_csv_path.exists() and self.count() == 0:
+            self._import_csv(legacy_csv_path)
+
+    def _add_columns(self) -> None:
+        """信号パラメータやチェックポイントの列がない以前のデータベースに列を追加する"""
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(results)")}
+        for name, type in _ADDED_COLUMNS.items():
+            if name not in columns:
+                self._conn.execute(f"ALTER TABLE results ADD COLUMN {name} {type}")
+
+    def _rescore(self) -> None:
+        """保存済みの結果のスコアの算出式が異なる場合は、全ての結果のスコアを1回のUPDATEで算出し直す
+
+        スコアの索引はSQLiteが更新するため、ランキングの並べ直しは不要
+        """
+        (applied,) = self._conn.execute("SELECT formula FROM scoring WHERE id = 0").fetchone()
+        if applied != self._formula.key:
+            self._conn.execute(f"UPDATE results SET score = {self._formula.sql()}")
+            self._conn.execute("UPDATE scoring SET formula = ? WHERE id = 0", (self._formula.key,))
+
+    @property
+    def formula(self) -> ScoringFormula:
+        return self._formula
+
+    def _import_csv(self, path: Path) -> None:
+        rows = [
+            (
+                r.id,
+                r.name,
+                r.start_datetime_iso,
+                r.time_sec,
+                r.touch_count,
+                r.touch_time_sec,
+                self._formula.score(r.time_sec, r.touch_count, r.touch_time_sec),
+            )
+            for r in iter_results_csv(path)
+        ]
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO results "
+                "(id, name, start_datetime, time_sec, touch_count, touch_time_sec, score) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    def write_result(
+        self,
+        name: str,
+        start_datetime: datetime,
+        time_sec: float,
+        touch_count: int,
+        touch_time_sec: float,
+        signal: SignalSettings | None = None,
+        checkpoint_sec: float | None = None,
+    ) -> Result:
+        """ゲーム結果を追記する
+
+        :return: idを割り当てた結果
+        """
+        with self._conn:
+            return self._insert(
+                FinishedGame(name, start_datetime, time_sec, touch_count, touch_time_sec, signal, checkpoint_sec)
+            )
+
+    def write_results(self, games: Sequence[FinishedGame], journal_seq: int) -> list[Result]:
+        """ジャーナルに記録済みの結果をまとめて追記する
+
+        :param journal_seq: 追記する結果の最後のジャーナルの連番。追記と同じトランザクションで保存する
+        :return: idを割り当てた結果
+        """
+        with self._conn:
+            results = [self._insert(g) for g in games]
+            self._conn.execute("UPDATE journal SET applied_seq = ? WHERE id = 0", (journal_seq,))
+        return results
+
+    def _insert(self, g: FinishedGame) -> Result:
+        signal: tuple[int | None, str | None, int | None] = (None, None, None)
+        if g.signal is not None:
+            signal = (g.signal.frequency, g.signal.traction_direction.name, g.signal.count_anti_node)
+        cursor = self._conn.execute(
+            "INSERT INTO results (name, start_datetime, time_sec, touch_count, touch_time_sec, score, "
+            "frequency, traction_direction, count_anti_node, checkpoint_sec) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                g.name,
+                g.start_datetime.isoformat(),
+                g.time_sec,
+                g.touch_count,
+                g.touch_time_sec,
+                self._formula.score(g.time_sec, g.touch_count, g.touch_time_sec),
+                *signal,
+                g.checkpoint_sec,
+            ),
+        )
+        assert cursor.lastrowid is not None
+        return Result(
+            cursor.lastrowid,
+            g.name,
+            g.start_datetime,
+            g.time_sec,
+            g.touch_count,
+            g.touch_time_sec,
+            g.signal,
+            g.checkpoint_sec,
+        )
+
+    def journal_seq(self) -> int:
+        """追記済みのジャーナルの最後の連番"""
+        return self._conn.execute("SELECT applied_seq FROM journal WHERE id = 0").fetchone()[0]
+
+    def checkpoint(self) -> None:
+        """追記済みの結果をデータベースのファイルに反映してfsyncする"""
+        self._conn.execute("PRAGMA wal_checkpoint(FULL)")
+
+    def top(self, count: int) -> list[Result]:
+        """スコアの高い順に結果を取得する。同点の場合は先に記録した結果を上位とする"""
+        rows = self._conn.execute(
+            f"SELECT {_COLUMNS} FROM results ORDER BY score DESC, id LIMIT ?",
+            (count,),
+        )
+        return [_to_result(row) for row in rows]
+
+    def results_since(self, last_id: int, limit: int = -1) -> list[Result]:
+        """last_id より後に追記された結果を追記順に取得する
+
+        :param limit: 取得する最大の件数, 負の場合は全て
+        """
+        rows = self._conn.execute(
+            f"SELECT {_COLUMNS} FROM results WHERE id > ? ORDER BY id LIMIT ?",
+            (last_id, limit),
+        )
+        return [_to_result(row) for row in rows]
+
+    def last_id(self) -> int:
+        """最後に追記された結果のid, 結果がない場合は0"""
+        return self._conn.execute("SELECT coalesce(max(id), 0) FROM results").fetchone()[0]
+
+    def count(self) -> int:
+        return self._conn.execute("SELECT count(*) FROM results").fetchone()[0]
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def __enter__(self) -> ResultsStore:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):  # type: ignore
+        self.close()
+
+
+class LeaderboardCache:
+    """スコア上位の結果をメモリに保持する
+
+    生成時に一度だけ上位を読み込み、以降は追加された結果のみで上位を更新する。
+    """
+
+    def __init__(self, store: ResultsStore, count: int) -> None:
+        """
+        :param store: 結果の保存先
+        :param count: 保持する上位の件数
+        """
+        self._store = store
+        self._count = count
+        self._top = store.top(count)
+        self._keys = [_rank_key(r, store.formula) for r in self._top]
+        self._last_id = store.last_id()
+
+    def top(self) -> list[Result]:
+        """スコアの高い順の結果"""
+        return list(self._top)
+
+    def add(self, result: Result) -> bool:
+        """新しい結果を上位に反映する
+
+        :return: 上位が変わった場合True
+        """
+        self._last_id = max(self._last_id, result.id)
+        key = _rank_key(result, self._store.formula)
+        i = bisect.bisect_left(self._keys, key)
+        if i >= self._count or (i < len(self._keys) and self._keys[i] == key):
+            return False
+
+        self._keys.insert(i, key)
+        self._top.insert(i, result)
+        del self._keys[self._count :], self._top[self._count :]
+        return True
+
+    def refresh(self) -> bool:
+        """他のプロセスが追記した結果を上位に反映する
+
+        :return: 上位が変わった場合True
+        """
+        is_changed = False
+        for result in self._store.results_since(self._last_id):
+            is_changed |= self.add(result)
+        return is_changed
+
+
+def _rank_key(result: Result, formula: ScoringFormula) -> tuple[float, int]:
+    """順位の並び順。スコアの高い順、同点の場合は先に記録した順"""
+    return -formula.score(result.time_sec, result.touch_count, result.touch_time_sec), result.id
+
+
+def _to_result(row: tuple) -> Result:
+    id, name, start_datetime, time_sec, touch_count, touch_time_sec = row[:6]
+    frequency, traction_direction, anti_node, checkpoint_sec = row[6:]
+    signal = None
+    if frequency is not None:
+        signal = SignalSettings(frequency, TractionDirection[traction_direction], anti_node)
+    start = datetime.fromisoformat(start_datetime)
+    return Result(id, name, start, time_sec, touch_count, touch_time_sec, signal, checkpoint_sec)
+
+
+def iter_results_csv(path: Path) -> Iterator[Result]:
+    """従来のCSVの結果を読み込む"""
+    with path.open(encoding="utf-8", newline="") as f:
+        reader = csv.reader(f)
+        _ = next(reader)
+
+        for row in reader:
+            yield Result(
+                id=int(row[0]),
+                name=row[1],
+                start_datetime=datetime.fromisoformat(row[2]),
+                time_sec=float(row[3]),
+                touch_count=int(row[4]),
+                touch_time_sec=float(row[5]),
+            )
+
+
+def read_results_csv(path: Path, count: int) -> list[Result]:
+    """従来のCSVから全件を読み込んでスコア順に並べる。計測の比較用"""
+    return sorted(iter_results_csv(path), key=lambda r: r.score, reverse=True)[:count]
+
+
+def benchmark_results_store(rows: int = 1_000_000, top_count: int = 5, repeat: int = 100) -> None:
+    """rows 件の結果について、CSVの全件読み込みとデータベースの上位取得・追記の時間を比較する"""
+    rng = random.Random(0)
+    origin = datetime(2022, 9, 1)
+    results = [
+        (
+            i + 1,
+            f"player{i}",
+            (origin + timedelta(seconds=i * 30)).isoformat(),
+            round(rng.uniform(30, 250), 1),
+            rng.randrange(40),
+            round(rng.uniform(0, 20), 1),
+        )
+        for i in range(rows)
+    ]
+
+    with tempfile.TemporaryDirectory() as d:
+        csv_path = Path(d) / "result.csv"
+        with csv_path.open("w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(("id", "name", "start_datetime_iso", "time_sec", "touch_count", "touch_time_sec"))
+            writer.writerows(results)
+
+        start = time.perf_counter()
+        expected = read_results_csv(csv_path, top_count)
+        csv_sec = time.perf_counter() - start
+
+        start = time.perf_counter()
+        store = ResultsStore(Path(d) / "results.sqlite3", legacy_csv_path=csv_path)
+        import_sec = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            top = store.top(top_count)
+        top_sec = (time.perf_counter() - start) / repeat
+
+        leaderboard = LeaderboardCache(store, top_count)
+        start = time.perf_counter()
+        for i in range(repeat):
+            store.write_result(f"new{i}", datetime.now(), rng.uniform(30, 250), rng.randrange(40), 0.0)
+        write_sec = (time.perf_counter() - start) / repeat
+
+        start = time.perf_counter()
+        leaderboard.refresh()
+        refresh_sec = time.perf_counter() - start
+
+        assert [r.score for r in top] == [r.score for r in expected], "top results mismatch"
+        assert leaderboard.top() == store.top(top_count), "leaderboard mismatch"
+        store.close()
+
+    print(f"{rows} rows")
+    print(f"csv full scan top{top_count}: {csv_sec * 1e3:9.2f} ms")
+    print(f"store top{top_count}:          {top_sec * 1e3:9.3f} ms")
+    print(f"store write_result:     {write_sec * 1e3:9.3f} ms")
+    print(f"leaderboard refresh:    {refresh_sec * 1e3:9.3f} ms ({repeat} new results)")
+    print(f"store import from csv:  {import_sec:9.2f} s (one-time)")
+
+
+if __name__ == "__main__":
+    benchmark_results_store(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
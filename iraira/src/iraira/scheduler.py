@@ -0,0 +1,212 @@
+from __future__ import annotations
+
+import multiprocessing
+import os
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+from multiprocessing.synchronize import Event
+
+import numpy as np
+
+from iraira.audio_output import LatencyStats
+from iraira.clock import REAL_CLOCK, Clock
+
+
+@dataclass(frozen=True)
+class PeriodStats:
+    """周期実行の集計結果"""
+
+    period_sec: float  # 予定の周期[sec]
+    elapsed_sec: float  # 集計期間[sec]
+    ticks: int  # 実行した回数
+    overruns: int  # 次の期限を過ぎてから実行した回数
+    skipped: int  # 遅れたために実行しなかった周期の数
+    jitter: LatencyStats  # 期限から実行までの遅れ
+
+    @property
+    def rate(self) -> float:
+        """1秒あたりの実行回数"""
+        return self.ticks / self.elapsed_sec if self.elapsed_sec > 0 else 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"rate={self.rate:,.1f}/s (target {1 / self.period_sec:,.1f}/s) overruns={self.overruns} "
+            f"skipped={self.skipped} jitter p50={self.jitter.p50_ms:.3f}ms p99={self.jitter.p99_ms:.3f}ms "
+            f"max={self.jitter.max_ms:.3f}ms"
+        )
+
+
+class PeriodicScheduler:
+    """一定周期の絶対時刻の期限を管理する
+
+    n回目の期限は 開始時刻 + n * 周期 とし、処理時間や待ち時間の延びを次の周期に持ち越さない。
+    実行が次の期限より遅れた場合は overrun として数え、max_catch_up 周期を超える遅れは取り戻さずに飛ばす。
+    待ち方は呼び出し側が選べるように、sleep() の他に remaining_sec() と advance() を持つ。
+    """
+
+    def __init__(
+        self,
+        period_sec: float,
+        clock: Clock = REAL_CLOCK,
+        start_ns: int | None = None,
+        max_catch_up: int = 0,
+        history: int = 4096,
+    ) -> None:
+        """
+        :param period_sec: 周期[sec]
+        :param clock: 期限に使う時刻源
+        :param start_ns: 最初の期限, Noneの場合は現在時刻
+        :param max_catch_up: 遅れた場合に間隔を詰めて実行する周期数の上限。0の場合は遅れた周期を全て飛ばす
+        :param history: 遅れの統計に使う直近の実行回数
+        """
+        self._period_ns = max(1, int(period_sec * 1e9))
+        self._clock = clock
+        self._max_catch_up = max_catch_up
+        self._jitter_ns = np.zeros(history, dtype=np.int64)
+        self.reset(start_ns)
+
+    @property
+    def period_sec(self) -> float:
+        return self._period_ns / 1e9
+
+    def reset(self, start_ns: int | None = None) -> None:
+        """期限と集計をリセットする。停止していたループを再開する場合に呼ぶ
+
+        :param start_ns: 最初の期限, Noneの場合は現在時刻
+        """
+        now_ns = self._clock.monotonic_ns()
+        self._deadline_ns = now_ns if start_ns is None else start_ns
+        self._since_ns = now_ns
+        self._ticks = 0
+        self._overruns = 0
+        self._skipped = 0
+
+    def next_deadline_ns(self) -> int:
+        return self._deadline_ns
+
+    def remaining_sec(self, now_ns: int | None = None) -> float:
+        """次の期限までの時間[sec], 期限を過ぎている場合は0"""
+        if now_ns is None:
+            now_ns = self._clock.monotonic_ns()
+        return max(0, self._deadline_ns - now_ns) / 1e9
+
+    def is_due(self, now_ns: int | None = None) -> bool:
+        if now_ns is None:
+            now_ns = self._clock.monotonic_ns()
+        return now_ns >= self._deadline_ns
+
+    def advance(self, now_ns: int | None = None) -> int:
+        """期限に達した周期の実行を記録し、次の期限に進める
+
+        :param now_ns: 実行した時刻, Noneの場合は現在時刻
+        :return: 飛ばした周期の数
+        """
+        if now_ns is None:
+            now_ns = self._clock.monotonic_ns()
+        late_ns = now_ns - self._deadline_ns
+        self._jitter_ns[self._ticks % len(self._jitter_ns)] = max(0, late_ns)
+        self._ticks += 1
+
+        missed = late_ns // self._period_ns if late_ns > 0 else 0
+        skipped = max(0, missed - self._max_catch_up)
+        if missed > 0:
+            self._overruns += 1
+            self._skipped += skipped
+        self._deadline_ns += (1 + skipped) * self._period_ns
+        return skipped
+
+    def sleep(self) -> int:
+        """次の期限まで待ってから advance() する
+
+        :return: 飛ばした周期の数
+        """
+        self._clock.sleep(self.remaining_sec())
+        return self.advance()
+
+    def stats(self) -> PeriodStats:
+        """前回のリセットからの集計結果"""
+        n = min(self._ticks, len(self._jitter_ns))
+        return PeriodStats(
+            self.period_sec,
+            (self._clock.monotonic_ns() - self._since_ns) / 1e9,
+            self._ticks,
+            self._overruns,
+            self._skipped,
+            LatencyStats.from_ns(self._jitter_ns[:n].copy()),
+        )
+
+
+def _burn_cpu(stop: Event) -> None:
+    """cpu_load の負荷プロセス"""
+    x = 0
+    while not stop.is_set():
+        for i in range(10_000):
+            x += i * i
+
+
+@contextmanager
+def cpu_load(processes: int) -> Iterator[None]:
+    """計測の間、processes 個のプロセスでCPUを使い続ける"""
+    stop = multiprocessing.Event()
+    burners = [multiprocessing.Process(target=_burn_cpu, args=(stop,), daemon=True) for _ in range(processes)]
+    for p in burners:
+        p.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        for p in burners:
+            p.join()
+
+
+def _busy(sec: float) -> None:
+    end = time.perf_counter() + sec
+    while time.perf_counter() < end:
+        pass
+
+
+def _run_fixed_sleep(period_sec: float, work_sec: float, duration_sec: float) -> PeriodStats:
+    """処理の後に一定時間待つ従来のループ"""
+    start = time.monotonic()
+    ticks = 0
+    while time.monotonic() - start < duration_sec:
+        _busy(work_sec)
+        ticks += 1
+        time.sleep(period_sec)
+    elapsed = time.monotonic() - start
+    empty = LatencyStats(0, 0.0, 0.0, 0.0, 0.0)
+    return PeriodStats(period_sec, elapsed, ticks, 0, 0, empty)
+
+
+def _run_scheduled(period_sec: float, work_sec: float, duration_sec: float, max_catch_up: int) -> PeriodStats:
+    scheduler = PeriodicScheduler(period_sec, max_catch_up=max_catch_up, history=1 << 20)
+    start = time.monotonic()
+    while time.monotonic() - start < duration_sec:
+        scheduler.sleep()
+        _busy(work_sec)
+    return scheduler.stats()
+
+
+def benchmark_scheduler(duration_sec: float = 3.0, load_processes: int | None = None) -> None:
+    """処理の後に一定時間待つループと期限まで待つループの実行頻度と遅れを、CPU負荷の有無で比較する
+
+    :param load_processes: CPU負荷をかけるプロセス数, Noneの場合はCPU数
+    """
+    # (周期, 1周期の処理時間, 間隔を詰めて取り戻す周期数)
+    cases = [(0.005, 0.001, 0), (0.01, 0.002, 0), (0.0001, 0.00002, 0), (0.0001, 0.00002, 10)]
+    load_processes = load_processes or os.cpu_count() or 1
+
+    for label, load in (("idle", 0), (f"{load_processes} busy processes", load_processes)):
+        with cpu_load(load):
+            print(f"-- {label}")
+            for period, work, catch_up in cases:
+                fixed = _run_fixed_sleep(period, work, duration_sec)
+                scheduled = _run_scheduled(period, work, duration_sec, catch_up)
+                print(f"{1 / period:>7,.0f}Hz fixed sleep: rate={fixed.rate:,.1f}/s")
+                print(f"{1 / period:>7,.0f}Hz deadline (catch up {catch_up}): {scheduled}")
+
+
+if __name__ == "__main__":
+    benchmark_scheduler()
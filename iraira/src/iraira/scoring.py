@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+
+import numpy as np
+import numpy.typing as npt
+
+
+@dataclass(frozen=True)
+class ScoringFormula:
+    """スコアの算出式
+
+    score = base - time_weight * クリア時間[sec] - touch_count_weight * 接触回数 - touch_time_weight * 接触時間[sec]
+    ただし0未満の場合は0とする。
+    保存済みの結果やランキングは key で算出式を区別するため、重みを変える場合は version を上げるか name を変える。
+    """
+
+    name: str
+    version: int
+    base: float = 200.0
+    time_weight: float = 1.0
+    touch_count_weight: float = 5.0
+    touch_time_weight: float = 0.0
+
+    @property
+    def key(self) -> str:
+        return f"{self.name}@{self.version}"
+
+    def score(self, time_sec: float, touch_count: int, touch_time_sec: float = 0.0) -> float:
+        """1件のスコア"""
+        s = (
+            self.base
+            - self.time_weight * time_sec
+            - self.touch_count_weight * touch_count
+            - self.touch_time_weight * touch_time_sec
+        )
+        return 0 if s < 0 else s
+
+    def score_array(
+        self, time_sec: npt.NDArray, touch_count: npt.NDArray, touch_time_sec: npt.NDArray
+    ) -> npt.NDArray[np.float64]:
+        """結果ごとのスコアをまとめて算出する
+
+        score() やSQLの式 (REAL) と同じ順に倍精度で計算し、同点の判定と順位を一致させる
+        """
+        s = np.full(len(time_sec), self.base, dtype=np.float64)
+        s -= np.multiply(self.time_weight, time_sec, dtype=np.float64)
+        s -= np.multiply(self.touch_count_weight, touch_count, dtype=np.float64)
+        if self.touch_time_weight != 0:
+            s -= np.multiply(self.touch_time_weight, touch_time_sec, dtype=np.float64)
+        return np.maximum(s, 0, out=s)
+
+    def sql(self) -> str:
+        """結果のデータベースの列からスコアを算出するSQLの式"""
+        return (
+            f"max(0, {self.base!r} - {self.time_weight!r} * time_sec - {self.touch_count_weight!r} * touch_count"
+            f" - {self.touch_time_weight!r} * touch_time_sec)"
+        )
+
+
+_FORMULAS: dict[str, ScoringFormula] = {}
+
+
+def register_formula(formula: ScoringFormula) -> ScoringFormula:
+    """算出式を名前で選べるように登録する"""
+    if _FORMULAS.get(formula.key, formula) != formula:
+        raise ValueError(f"scoring formula {formula.key} is already registered with different weights")
+    _FORMULAS[formula.key] = formula
+    return formula
+
+
+def get_formula(key: str) -> ScoringFormula:
+    """登録済みの算出式
+
+    :param key: "名前@バージョン", バージョンを省略した場合は最新のバージョン
+    """
+    if key in _FORMULAS:
+        return _FORMULAS[key]
+    versions = [f for f in _FORMULAS.values() if f.name == key]
+    if not versions:
+        raise KeyError(f"unknown scoring formula: {key}")
+    return max(versions, key=lambda f: f.version)
+
+
+def formulas() -> list[ScoringFormula]:
+    """登録済みの全ての算出式"""
+    return list(_FORMULAS.values())
+
+
+# 従来の算出式
+STANDARD = register_formula(ScoringFormula("standard", 1))
+# 接触時間も減点する算出式
+TOUCH_TIME = register_formula(ScoringFormula("touch_time", 1, touch_time_weight=2.0))
+
+# ゲーム結果の保存とランキングに使う算出式。イベントなどで変える場合はここを変更する
+# 結果のデータベースは次に開いたときに保存済みの全ての結果のスコアをこの算出式で算出し直す
+DEFAULT_FORMULA = STANDARD
+
+
+def score(time_sec: float, touch_count: int, touch_time_sec: float = 0.0) -> float:
+    """DEFAULT_FORMULA によるスコアの算出"""
+    return DEFAULT_FORMULA.score(time_sec, touch_count, touch_time_sec)
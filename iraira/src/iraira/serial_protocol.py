@@ -0,0 +1,285 @@
+from __future__ import annotations
+
+import os
+import struct
+import sys
+import threading
+import time
+from collections.abc import Iterable
+from enum import Enum
+from typing import NamedTuple
+
+# M5Atomとのシリアル通信のフレーム形式
+#   | SYNC (0xA5) | 種類 (1byte) | ペイロード長 (1byte) | ペイロード | CRC-8 (1byte) |
+# CRC-8 は多項式 0x07、初期値 0 で、種類・ペイロード長・ペイロードから計算する。
+# iraira_analog_emb/src/main.cpp の送信処理と一致させること。
+SYNC = 0xA5
+MAX_PAYLOAD = 16
+ANALOG_MAX = 4095  # M5AtomのADC最大値
+
+_ANALOG_STRUCT = struct.Struct("<H")
+
+
+class FrameKind(Enum):
+    """フレームの種類"""
+
+    analog = 0x01  # アナログ値 payload: ADC値 uint16 little endian
+    button = 0x02  # ボタン操作 payload: ButtonEvent.value uint8
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class ButtonEvent(Enum):
+    """ボタン操作"""
+
+    pressed = 0  # 押下
+    released = 1  # 開放
+    long_pressed = 2  # 長押し
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class Frame(NamedTuple):
+    """受信したフレーム"""
+
+    kind: FrameKind
+    payload: bytes
+
+    def analog_value(self) -> float:
+        """アナログ値 0~1"""
+        (raw,) = _ANALOG_STRUCT.unpack(self.payload)
+        return raw / ANALOG_MAX
+
+    def button_event(self) -> ButtonEvent:
+        return ButtonEvent(self.payload[0])
+
+
+_FRAME_KINDS = {k.value: k for k in FrameKind}
+
+
+def _crc8_table() -> tuple[int, ...]:
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        table.append(crc)
+    return tuple(table)
+
+
+_CRC8_TABLE = _crc8_table()
+
+
+def crc8(data: Iterable[int], crc: int = 0) -> int:
+    for b in data:
+        crc = _CRC8_TABLE[crc ^ b]
+    return crc
+
+
+def encode_frame(kind: FrameKind, payload: bytes) -> bytes:
+    """フレームを組み立てる"""
+    if len(payload) > MAX_PAYLOAD:
+        raise ValueError(f"payload expected {MAX_PAYLOAD} bytes or less")
+    body = bytes((kind.value, len(payload))) + payload
+    return bytes((SYNC,)) + body + bytes((crc8(body),))
+
+
+def encode_analog(raw: int) -> bytes:
+    """
+    :param raw: ADC値 0~ANALOG_MAX
+    """
+    return encode_frame(FrameKind.analog, _ANALOG_STRUCT.pack(raw))
+
+
+def encode_button(event: ButtonEvent) -> bytes:
+    return encode_frame(FrameKind.button, bytes((event.value,)))
+
+
+class FrameParser:
+    """受信したバイト列を順に与えてフレームを取り出す
+
+    受信バッファは1つのbytearrayを使い回し、フレームの途中で区切られた受信にも対応する。
+    SYNCの位置がずれた場合やCRCが一致しない場合は、次のSYNCまで読み飛ばして同期を取り直す。
+    """
+
+    def __init__(self) -> None:
+        self._buf = bytearray()
+        self.crc_errors = 0  # CRC不一致で破棄したフレーム数
+        self.skipped_bytes = 0  # 同期を取り直すために読み飛ばしたバイト数
+
+    def feed(self, data: bytes) -> list[Frame]:
+        """受信したバイト列を追加し、完成したフレームを取り出す
+
+        :param data: 受信したバイト列
+        :return: 完成したフレーム, 受信順
+        """
+        buf = self._buf
+        buf += data
+        frames: list[Frame] = []
+
+        pos = 0
+        while True:
+            sync = buf.find(SYNC, pos)
+            if sync < 0:
+                self.skipped_bytes += len(buf) - pos
+                pos = len(buf)
+                break
+            self.skipped_bytes += sync - pos
+            pos = sync
+
+            if len(buf) - pos < 3:
+                break
+            kind = _FRAME_KINDS.get(buf[pos + 1])
+            length = buf[pos + 2]
+            if length > MAX_PAYLOAD or kind is None:
+                pos += 1
+                self.skipped_bytes += 1
+                continue
+
+            end = pos + 3 + length
+            if len(buf) <= end:
+                break
+            body = buf[pos + 1 : end]
+            if crc8(body) != buf[end]:
+                self.crc_errors += 1
+                pos += 1
+                self.skipped_bytes += 1
+                continue
+
+            frames.append(Frame(kind, bytes(body[2:])))
+            pos = end + 1
+
+        del buf[:pos]
+        return frames
+
+
+class FakeM5Atom:
+    """疑似端末でM5Atomの送信を模擬する
+
+    port を実機のシリアルポートの代わりに開くと、M5Atomと同じフレームを受信できる。
+    実機のない環境での受信処理の動作確認に使う。
+    """
+
+    def __init__(self, interval_sec: float = 0.02) -> None:
+        """
+        :param interval_sec: アナログ値の送信間隔[sec]
+        """
+        # tty・疑似端末はUnixでのみ使えるため、使うときに読み込む
+        import tty
+
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self._interval_sec = interval_sec
+        self._lock = threading.Lock()
+        self._analog_raw = ANALOG_MAX // 2
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self.sent: list[bytes] = []  # 送信したフレーム, 送信順
+
+    @property
+    def port(self) -> str:
+        """受信側が開く疑似端末のパス"""
+        return os.ttyname(self._slave)
+
+    def set_analog(self, value: float) -> None:
+        """
+        :param value: 送信するアナログ値 0~1
+        """
+        self._analog_raw = round(min(max(value, 0.0), 1.0) * ANALOG_MAX)
+
+    def send(self, data: bytes) -> None:
+        with self._lock:
+            os.write(self._master, data)
+            self.sent.append(data)
+
+    def press(self, long: bool = False) -> None:
+        """ボタン操作を送信する
+
+        :param long: Trueの場合は長押しを送信する
+        """
+        self.send(encode_button(ButtonEvent.pressed))
+        if long:
+            self.send(encode_button(ButtonEvent.long_pressed))
+        self.send(encode_button(ButtonEvent.released))
+
+    def stop(self) -> None:
+        """アナログ値の送信を止める"""
+        self._closed.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _run(self) -> None:
+        while not self._closed.wait(self._interval_sec):
+            self.send(encode_analog(self._analog_raw))
+
+    def __enter__(self) -> FakeM5Atom:
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):  # type: ignore
+        self.stop()
+        os.close(self._master)
+        os.close(self._slave)
+
+
+def benchmark_parser(frames: int = 100_000, frame_rate: float = 50.0) -> None:
+    """フレーム解析速度と、M5Atomの送信間隔で受信した場合のCPU使用率を計測する
+
+    :param frames: 解析するフレーム数
+    :param frame_rate: M5Atomの1秒あたりの送信フレーム数
+    """
+    import random
+
+    rng = random.Random(0)
+    stream = b"".join(
+        encode_button(ButtonEvent.pressed) if i % 100 == 0 else encode_analog(rng.randrange(ANALOG_MAX + 1))
+        for i in range(frames)
+    )
+
+    for read_size in (1, 6, 64, 512):
+        parser = FrameParser()
+        start = time.perf_counter()
+        count = 0
+        for i in range(0, len(stream), read_size):
+            count += len(parser.feed(stream[i : i + read_size]))
+        sec = time.perf_counter() - start
+        assert count == frames
+
+        print(
+            f"read={read_size:>3}: {count / sec:>10,.0f} frames/s  "
+            f"cpu at {frame_rate:.0f} frames/s {frame_rate / (count / sec) * 100:.4f}%"
+        )
+
+
+def check_fake_m5atom(duration_sec: float = 1.0) -> None:
+    """疑似端末のM5Atomからシリアルポート経由で受信し、送信したフレームをすべて解析できることを確認する"""
+    import serial
+
+    with FakeM5Atom() as atom, serial.Serial(atom.port, 115200, timeout=0.05) as serial_port:
+        parser = FrameParser()
+        received: list[Frame] = []
+        start = time.monotonic()
+        while time.monotonic() - start < duration_sec:
+            received += parser.feed(serial_port.read(max(1, serial_port.in_waiting)))
+            atom.set_analog((time.monotonic() - start) / duration_sec)
+        atom.press(long=True)
+        atom.stop()
+        # 送信済みのフレームを読み切る
+        deadline = time.monotonic() + 1.0
+        while len(received) < len(atom.sent) and time.monotonic() < deadline:
+            received += parser.feed(serial_port.read(max(1, serial_port.in_waiting)))
+
+    buttons = [f.button_event() for f in received if f.kind == FrameKind.button]
+    print(f"sent {len(atom.sent)} received {len(received)} crc errors {parser.crc_errors} buttons {buttons}")
+    assert [encode_frame(f.kind, f.payload) for f in received] == atom.sent
+    assert parser.crc_errors == 0 and parser.skipped_bytes == 0
+    assert buttons == [ButtonEvent.pressed, ButtonEvent.long_pressed, ButtonEvent.released]
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["benchmark"]:
+        benchmark_parser()
+    else:
+        check_fake_m5atom()
@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import heapq
+import struct
+import threading
+from collections.abc import Iterator
+from dataclasses import dataclass
+from enum import Enum
+from pathlib import Path
+from typing import BinaryIO, NamedTuple
+
+from iraira.clock import REAL_CLOCK, Clock
+from iraira.gpio_backend import Edge
+from iraira.state import Page
+
+# セッションログのファイル形式
+# ヘッダ: MAGIC(4) | VERSION(u8)
+# 記録: t_ns(i64) | RecordKind(u8) | 長さ(u16) | ペイロード, リトルエンディアン
+MAGIC = b"IRSL"
+VERSION = 1
+_HEADER = struct.Struct("<4sB")
+_RECORD = struct.Struct("<qBH")
+_EDGE = struct.Struct("<BB")
+_KEY = struct.Struct("<I")
+_PAGE = struct.Struct("<B")
+MAX_PAYLOAD = 0xFFFF
+
+SESSION_LOG_SUFFIX = ".irsl"
+
+
+class RecordKind(Enum):
+    """記録する入力の種類"""
+
+    edge = 0x01  # GPIOのエッジ payload: ピン番号(u8), レベル(u8)
+    serial = 0x02  # M5Atomから受信したバイト列 payload: 受信したバイト列
+    key = 0x03  # GUIのキー入力 payload: keysym_num(u32)
+    click = 0x04  # GUIのクリック payload: なし
+    page = 0x05  # headless による画面遷移 payload: Page.value(u8)
+
+    def __str__(self) -> str:
+        return self.name
+
+
+_RECORD_KINDS = {k.value: k for k in RecordKind}
+
+
+class SessionRecord(NamedTuple):
+    """記録した入力1件"""
+
+    t_ns: int  # 入力の時刻 Clock.monotonic_ns()
+    kind: RecordKind
+    payload: bytes
+
+    def edge(self) -> Edge:
+        pin, level = _EDGE.unpack(self.payload)
+        return Edge(pin, level, self.t_ns)
+
+    def key(self) -> int:
+        return _KEY.unpack(self.payload)[0]
+
+    def page(self) -> Page:
+        return Page(_PAGE.unpack(self.payload)[0])
+
+
+class SessionWriter:
+    """入力を時刻付きでセッションログに書き込む
+
+    プロセスごとに別のファイルへ書き込み、再生時に時刻順に統合する。
+    書き込みはバッファし、flush_interval_sec ごとにファイルへ書き出す。
+    エッジ通知のスレッドからも書き込むため、書き込みはスレッドセーフとする。
+    """
+
+    def __init__(self, path: Path, clock: Clock = REAL_CLOCK, flush_interval_sec: float = 1.0) -> None:
+        """
+        :param path: 書き込むファイル
+        :param clock: 記録の時刻源。全プロセスで同じ時刻源を使う
+        :param flush_interval_sec: ファイルへ書き出す間隔[sec]
+        """
+        self._clock = clock
+        self._flush_interval_ns = int(flush_interval_sec * 1e9)
+        self._lock = threading.Lock()
+        self._file: BinaryIO = path.open("wb")
+        self._file.write(_HEADER.pack(MAGIC, VERSION))
+        self._flushed_ns = clock.monotonic_ns()
+
+    def write(self, kind: RecordKind, payload: bytes = b"", t_ns: int | None = None) -> None:
+        """
+        :param t_ns: 入力の時刻, Noneの場合は時刻源の現在時刻
+        """
+        now_ns = self._clock.monotonic_ns()
+        t_ns = now_ns if t_ns is None else t_ns
+        with self._lock:
+            for i in range(0, max(1, len(payload)), MAX_PAYLOAD):
+                chunk = payload[i : i + MAX_PAYLOAD]
+                self._file.write(_RECORD.pack(t_ns, kind.value, len(chunk)))
+                self._file.write(chunk)
+
+            if now_ns - self._flushed_ns >= self._flush_interval_ns:
+                self._file.flush()
+                self._flushed_ns = now_ns
+
+    def write_edge(self, edge: Edge) -> None:
+        self.write(RecordKind.edge, _EDGE.pack(edge.pin, edge.level), edge.t_ns)
+
+    def write_serial(self, data: bytes) -> None:
+        self.write(RecordKind.serial, data)
+
+    def write_key(self, keysym_num: int) -> None:
+        self.write(RecordKind.key, _KEY.pack(keysym_num))
+
+    def write_click(self) -> None:
+        self.write(RecordKind.click)
+
+    def write_page(self, page: Page) -> None:
+        self.write(RecordKind.page, _PAGE.pack(page.value))
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self) -> SessionWriter:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):  # type: ignore
+        self.close()
+
+
+@dataclass
+class Session:
+    """セッションログを時刻順に統合した入力列"""
+
+    records: list[SessionRecord]
+    truncated: int = 0  # 末尾が欠けていた、または種類が不明で読めなかった記録の数
+
+    @property
+    def duration_sec(self) -> float:
+        if not self.records:
+            return 0.0
+        return (self.records[-1].t_ns - self.records[0].t_ns) / 1e9
+
+    @staticmethod
+    def load(session_dir: Path) -> Session:
+        """セッションのディレクトリにある全プロセスのログを読み込む"""
+        logs = [read_session_log(path) for path in sorted(session_dir.glob(f"*{SESSION_LOG_SUFFIX}"))]
+        if not logs:
+            raise FileNotFoundError(f"no session log in {session_dir}")
+
+        # 各ログは時刻順に書かれているため、マージのみで全体が時刻順となる
+        records = list(heapq.merge(*(records for records, _ in logs), key=lambda r: r.t_ns))
+        return Session(records, sum(truncated for _, truncated in logs))
+
+
+def read_session_log(path: Path) -> tuple[list[SessionRecord], int]:
+    """1プロセスのセッションログを読み込む
+
+    :return: 記録, 読めなかった記録の数
+    """
+    data = path.read_bytes()
+    magic, version = _HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path}: unsupported session log")
+
+    records: list[SessionRecord] = []
+    truncated = 0
+    for t_ns, kind, payload in _iter_records(data, _HEADER.size):
+        if kind is None:
+            truncated += 1
+        else:
+            records.append(SessionRecord(t_ns, kind, payload))
+    return records, truncated
+
+
+def _iter_records(data: bytes, pos: int) -> Iterator[tuple[int, RecordKind | None, bytes]]:
+    while pos < len(data):
+        # 異常終了したプロセスのログは末尾の記録が欠けている場合がある
+        if pos + _RECORD.size > len(data):
+            yield 0, None, b""
+            return
+        t_ns, kind_value, size = _RECORD.unpack_from(data, pos)
+        pos += _RECORD.size
+        if pos + size > len(data):
+            yield t_ns, None, b""
+            return
+        yield t_ns, _RECORD_KINDS.get(kind_value), data[pos : pos + size]
+        pos += size
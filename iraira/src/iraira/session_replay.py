@@ -0,0 +1,197 @@
+from __future__ import annotations
+
+import argparse
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+
+from iraira.analog_input import apply_frames
+from iraira.audio_output import LatencyStats
+from iraira.clock import ManualClock
+from iraira.gpio_backend import SimulatedGpioBackend
+from iraira.gui_input import apply_key, change_page_state, enter_page
+from iraira.headless import change_page
+from iraira.serial_protocol import FrameParser
+from iraira.session_log import RecordKind, Session, SessionRecord
+from iraira.state import (
+    GameDict,
+    Page,
+    SharedAppState,
+    SharedGameState,
+    SharedGuiState,
+    SharedPlayerState,
+    SharedSignalParam,
+)
+from iraira.touch_detector import EdgeQueue
+from iraira.touch_sensing import GPIO_TOUCH_PINS, SplitTimer, apply_touch_update, create_touch_detector, start_detection
+
+
+@dataclass(frozen=True)
+class ReplayReport:
+    """セッションの再生結果"""
+
+    duration_sec: float  # 記録の長さ[sec]
+    elapsed_sec: float  # 再生にかかった時間[sec]
+    latency: dict[RecordKind, LatencyStats]  # 入力の種類ごとの処理遅延
+    dropped: int  # 読めなかった記録とCRC不一致で破棄したフレームの数
+    touch_count: int
+    touch_time: float
+    is_goaled: bool
+    checkpoint_sec: float | None
+    goal_sec: float | None
+    page: Page
+
+    def __str__(self) -> str:
+        lines = [
+            f"replay {self.duration_sec:.1f}s in {self.elapsed_sec:.3f}s dropped={self.dropped}",
+            f"game touch_count={self.touch_count} touch_time={self.touch_time:.3f}s "
+            f"is_goaled={self.is_goaled} page={self.page.name}",
+            f"splits checkpoint={_format_sec(self.checkpoint_sec)} goal={_format_sec(self.goal_sec)}",
+        ]
+        lines += [f"{str(kind):>6}: {stats}" for kind, stats in self.latency.items()]
+        return "\n".join(lines)
+
+
+def _format_sec(sec: float | None) -> str:
+    return "-" if sec is None else f"{sec:.3f}s"
+
+
+def _local_dict() -> Any:
+    """再生はプロセス内で行うため、状態の共有に DictProxy の代わりに dict を使う"""
+    return {}
+
+
+class SessionReplayer:
+    """記録した入力をシミュレーションした入力として、実機と同じ判定・状態変更の処理で再生する
+
+    全ての入力を1スレッドで時刻順に処理し、記録時の時刻を ManualClock で再現するため、
+    再生速度によらず同じセッションからは同じゲーム状態となる。
+    処理遅延は入力ごとの処理時間であり、等倍再生では入力の時刻からの遅れを含む。
+    """
+
+    def __init__(self, session: Session, speed: float | None = None) -> None:
+        """
+        :param session: 再生するセッション
+        :param speed: 記録時に対する再生の速さの倍率, Noneの場合は待たずに再生する
+        """
+        self._session = session
+        self._speed = speed
+        self._clock = ManualClock()
+
+        self.app_state = SharedAppState.get_with_init(_local_dict())
+        self.player_state = SharedPlayerState.get_with_init(_local_dict())
+        self.sig_param = SharedSignalParam.get_with_init(_local_dict())
+        self.game_state = SharedGameState.get_with_init(GameDict())
+        self.gui_state = SharedGuiState.get_with_init(_local_dict())
+
+        self._gpio = SimulatedGpioBackend(self._clock)
+        self._edges = EdgeQueue(self._gpio, GPIO_TOUCH_PINS, self._clock)
+        self._detector = create_touch_detector()
+        self._splits = SplitTimer(self.game_state)
+        self._is_detecting = False
+        self._page: Page | None = None
+        self._parser = FrameParser()
+
+    def run(self) -> ReplayReport:
+        records = self._session.records
+        latencies_ns: dict[RecordKind, list[int]] = defaultdict(list)
+        origin_ns = records[0].t_ns if records else 0
+        self._clock.set_ns(origin_ns)
+
+        start = time.perf_counter_ns()
+        for record in records:
+            if self._speed is None:
+                begin = time.perf_counter_ns()
+            else:
+                begin = start + int((record.t_ns - origin_ns) / self._speed)
+                time.sleep(max(0, begin - time.perf_counter_ns()) / 1e9)
+
+            self._dispatch(record)
+            latencies_ns[record.kind].append(time.perf_counter_ns() - begin)
+            if not self.app_state.is_running:
+                break
+
+        elapsed_sec = (time.perf_counter_ns() - start) / 1e9
+        return ReplayReport(
+            duration_sec=self._session.duration_sec,
+            elapsed_sec=elapsed_sec,
+            latency={k: LatencyStats.from_ns(np.array(v, dtype=np.int64)) for k, v in latencies_ns.items()},
+            dropped=self._session.truncated + self._parser.crc_errors,
+            touch_count=self.game_state.touch_count,
+            touch_time=self.game_state.touch_time,
+            is_goaled=self.game_state.is_goaled,
+            checkpoint_sec=self.game_state.checkpoint_sec,
+            goal_sec=self.game_state.goal_sec,
+            page=self.gui_state.current_page,
+        )
+
+    def _dispatch(self, record: SessionRecord) -> None:
+        self._clock.set_ns(record.t_ns)
+        # 前の入力からこの入力までの接触継続を判定する
+        if self._is_detecting:
+            self._detector.poll(record.t_ns)
+
+        if record.kind == RecordKind.edge:
+            edge = record.edge()
+            self._gpio.set_level(edge.pin, edge.level, edge.t_ns)
+        elif record.kind == RecordKind.serial:
+            frames = self._parser.feed(record.payload)
+            apply_frames(frames, self.sig_param, self.player_state, self.game_state, self.gui_state)
+        elif record.kind == RecordKind.key:
+            apply_key(record.key(), self.app_state, self.player_state, self.sig_param, self.game_state, self.gui_state)
+        elif record.kind == RecordKind.click:
+            change_page_state(self.game_state, self.gui_state)
+        elif record.kind == RecordKind.page:
+            change_page(record.page(), self.game_state, self.gui_state)
+
+        self._update_page()
+        self._update_touch()
+
+    def _update_page(self) -> None:
+        """GUI・headless_listener と同じく、表示する画面が切り替わったときに再生状態を変更する"""
+        page = self.gui_state.current_page
+        if page != self._page:
+            self._page = page
+            enter_page(page, self.player_state)
+
+    def _update_touch(self) -> None:
+        """touch_listener と同じく、ゲーム画面でのみエッジから接触を判定する"""
+        if self.gui_state.current_page != Page.GAME:
+            self._is_detecting = False
+            return
+
+        if not self._is_detecting:
+            self._splits.start(self._clock.monotonic_ns())
+            start_detection(self._detector, self._edges)
+            self._is_detecting = True
+
+        edge = self._edges.get(0)
+        while edge is not None:
+            self._detector.feed(edge)
+            edge = self._edges.get(0)
+        apply_touch_update(self._detector.take(), self.game_state, self._splits)
+
+
+def replay_sessions(session_dirs: list[Path], speed: float | None = None) -> None:
+    """セッションを再生して結果を表示する。性能の変更前後で結果と処理遅延を比較するために使う"""
+    for session_dir in session_dirs:
+        session = Session.load(session_dir)
+        print(f"{session_dir}: {len(session.records)} records")
+        print(SessionReplayer(session, speed).run())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="iraira.session_replay")
+    parser.add_argument("session_dirs", type=Path, nargs="+", help="--record-session で記録したディレクトリ")
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=None,
+        help="記録時に対する再生の速さの倍率, 省略した場合は待たずに再生する",
+    )
+    args = parser.parse_args()
+    replay_sessions(args.session_dirs, args.speed)
@@ -0,0 +1,532 @@
+from __future__ import annotations
+
+import math
+import multiprocessing
+import struct
+import sys
+import time
+from dataclasses import dataclass
+from multiprocessing.managers import DictProxy  # type: ignore
+from multiprocessing.shared_memory import SharedMemory
+from multiprocessing.synchronize import Lock
+from typing import Any
+
+from iraira.events import NULL_PUBLISHER, EventKind, EventPublisher
+from iraira.state import Page, Split, TractionDirection
+
+# 共有メモリ上の固定レイアウト (フィールド名, structフォーマット)
+# 8byte境界に揃うように大きい型から並べる
+_LAYOUT: tuple[tuple[str, str], ...] = (
+    ("volume", "d"),
+    ("touch_time", "d"),
+    ("start_time", "d"),
+    ("checkpoint_sec", "d"),  # 記録していない場合はNaN
+    ("goal_sec", "d"),  # 記録していない場合はNaN
+    ("fs", "i"),
+    ("frequency", "i"),
+    ("count_anti_node", "i"),
+    ("touch_count", "i"),
+    ("game_epoch", "i"),
+    ("traction_direction", "B"),
+    ("current_page", "B"),
+    ("is_running", "?"),
+    ("play_state", "?"),
+    ("is_goaled", "?"),
+)
+
+
+def _build_fields() -> tuple[dict[str, tuple[int, struct.Struct]], int]:
+    fields: dict[str, tuple[int, struct.Struct]] = {}
+    offset = 0
+    for name, fmt in _LAYOUT:
+        s = struct.Struct(fmt)
+        offset = (offset + s.size - 1) // s.size * s.size  # 型サイズ境界に揃える
+        fields[name] = (offset, s)
+        offset += s.size
+    return fields, offset
+
+
+_FIELDS, _BLOCK_SIZE = _build_fields()
+
+
+class SharedStateBlock:
+    """全状態を格納する固定レイアウトの共有メモリブロック
+
+    DictProxyと異なり読み書きはサーバープロセスを経由せず、共有メモリへの直接アクセスとなる。
+    複数のフィールドの読み書きを不可分に行う場合は lock を取得する。
+    プロセスの起動時に引数として渡せば、別プロセスでも同名の共有メモリに再接続し、同じ lock を使う。
+    """
+
+    def __init__(self, shm: SharedMemory, lock: Lock, owner: bool = False) -> None:
+        self._shm = shm
+        self._buf: memoryview = shm.buf  # type: ignore
+        self._lock = lock
+        self._owner = owner
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    @property
+    def lock(self) -> Lock:
+        return self._lock
+
+    def read(self, field: str) -> Any:
+        offset, s = _FIELDS[field]
+        return s.unpack_from(self._buf, offset)[0]
+
+    def write(self, field: str, value: Any) -> None:
+        offset, s = _FIELDS[field]
+        s.pack_into(self._buf, offset, value)
+
+    def close(self) -> None:
+        self._buf = None  # type: ignore
+        self._shm.close()
+
+    @staticmethod
+    def create() -> SharedStateBlock:
+        """共有メモリブロックを新規作成する。作成したプロセスが破棄の責任を持つ"""
+        return SharedStateBlock(SharedMemory(create=True, size=_BLOCK_SIZE), multiprocessing.Lock(), owner=True)
+
+    @staticmethod
+    def attach(name: str, lock: Lock) -> SharedStateBlock:
+        """作成済みの共有メモリブロックに接続する"""
+        return SharedStateBlock(SharedMemory(name=name), lock)
+
+    def __getstate__(self) -> dict[str, Any]:
+        # Lock はプロセスの起動時にのみpickleできる
+        return {"name": self.name, "lock": self._lock}
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        self._shm = SharedMemory(name=state["name"])
+        self._buf = self._shm.buf  # type: ignore
+        self._lock = state["lock"]
+        self._owner = False
+
+    def __enter__(self) -> SharedStateBlock:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):  # type: ignore
+        self.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+@dataclass
+class ShmAppState:
+    """共有メモリを使った AppState の実装"""
+
+    _block: SharedStateBlock
+    _events: EventPublisher = NULL_PUBLISHER
+
+    @property
+    def is_running(self) -> bool:
+        return self._block.read("is_running")
+
+    @is_running.setter
+    def is_running(self, value: bool) -> None:
+        self._block.write("is_running", value)
+        if not value:
+            self._events.publish(EventKind.app_stopped)
+
+    @staticmethod
+    def get(block: SharedStateBlock, events: EventPublisher = NULL_PUBLISHER) -> ShmAppState:
+        return ShmAppState(block, events)
+
+    @staticmethod
+    def get_with_init(block: SharedStateBlock, events: EventPublisher = NULL_PUBLISHER) -> ShmAppState:
+        block.write("is_running", True)
+        return ShmAppState(block, events)
+
+
+@dataclass
+class ShmPlayerState:
+    """共有メモリを使った PlayerState の実装"""
+
+    _block: SharedStateBlock
+    _events: EventPublisher = NULL_PUBLISHER
+
+    @property
+    def fs(self) -> int:
+        return self._block.read("fs")
+
+    @property
+    def play_state(self) -> bool:
+        return self._block.read("play_state")
+
+    @play_state.setter
+    def play_state(self, value: bool) -> None:
+        if self._block.read("play_state") == value:
+            return
+        self._block.write("play_state", value)
+        self._events.publish(EventKind.play_state_changed, value)
+
+    @property
+    def volume(self) -> float:
+        return self._block.read("volume")
+
+    @volume.setter
+    def volume(self, value: float) -> None:
+        if value > 1:
+            value = 1
+        if value < 0:
+            value = 0
+        self._block.write("volume", value)
+
+    def volume_up(self) -> None:
+        v = self.volume + 0.1
+        if v > 1:
+            v = 1
+        self._block.write("volume", v)
+
+    def volume_down(self) -> None:
+        v = self.volume - 0.1
+        if v < 0:
+            v = 0
+        self._block.write("volume", v)
+
+    def change_play_state(self) -> None:
+        self.play_state = not self.play_state
+
+    @staticmethod
+    def get(block: SharedStateBlock, events: EventPublisher = NULL_PUBLISHER) -> ShmPlayerState:
+        return ShmPlayerState(block, events)
+
+    @staticmethod
+    def get_with_init(
+        block: SharedStateBlock,
+        fs: int = 44_100,
+        volume: float = 0.5,
+        play_state: bool = False,
+        events: EventPublisher = NULL_PUBLISHER,
+    ) -> ShmPlayerState:
+        block.write("fs", fs)
+        block.write("volume", volume)
+        block.write("play_state", play_state)
+        return ShmPlayerState(block, events)
+
+
+@dataclass
+class ShmSignalParam:
+    """共有メモリを使った SignalParam の実装"""
+
+    _block: SharedStateBlock
+    _events: EventPublisher = NULL_PUBLISHER
+
+    @property
+    def frequency(self) -> int:
+        return self._block.read("frequency")
+
+    def frequency_up(self) -> None:
+        f = self.frequency
+        assert f <= 1000
+        if f == 1000:
+            return
+        self._block.write("frequency", f + 1)
+        self._events.publish(EventKind.signal_param_changed)
+
+    def frequency_down(self) -> None:
+        f = self.frequency
+        assert f >= 20
+        if f == 20:
+            return
+        self._block.write("frequency", f - 1)
+        self._events.publish(EventKind.signal_param_changed)
+
+    @property
+    def traction_direction(self) -> TractionDirection:
+        return TractionDirection(self._block.read("traction_direction"))
+
+    def traction_change(self) -> None:
+        if self.traction_direction == TractionDirection.up:
+            self.traction_down()
+        else:
+            self.traction_up()
+
+    def traction_up(self) -> None:
+        self._set_traction_direction(TractionDirection.up)
+
+    def traction_down(self) -> None:
+        self._set_traction_direction(TractionDirection.down)
+
+    def _set_traction_direction(self, direction: TractionDirection) -> None:
+        # アナログ入力は同じ方向を毎フレーム設定するため、変化した場合のみ通知する
+        if self._block.read("traction_direction") == direction.value:
+            return
+        self._block.write("traction_direction", direction.value)
+        self._events.publish(EventKind.signal_param_changed)
+
+    @property
+    def count_anti_node(self) -> int:
+        return self._block.read("count_anti_node")
+
+    def count_anti_node_up(self) -> None:
+        n = self.count_anti_node
+        assert n <= 1000
+        if n == 1000:
+            return
+        self._block.write("count_anti_node", n + 1)
+        self._events.publish(EventKind.signal_param_changed)
+
+    def count_anti_node_down(self) -> None:
+        n = self.count_anti_node
+        assert n >= 3
+        if n == 3:
+            return
+        self._block.write("count_anti_node", n - 1)
+        self._events.publish(EventKind.signal_param_changed)
+
+    @staticmethod
+    def get(block: SharedStateBlock, events: EventPublisher = NULL_PUBLISHER) -> ShmSignalParam:
+        return ShmSignalParam(block, events)
+
+    @staticmethod
+    def get_with_init(
+        block: SharedStateBlock,
+        frequency: int = 63,
+        direction: TractionDirection = TractionDirection.up,
+        count_anti_node: int = 4,
+        events: EventPublisher = NULL_PUBLISHER,
+    ) -> ShmSignalParam:
+        block.write("frequency", frequency)
+        block.write("traction_direction", direction.value)
+        block.write("count_anti_node", count_anti_node)
+        return ShmSignalParam(block, events)
+
+
+@dataclass
+class ShmGameState:
+    """共有メモリを使った GameState の実装"""
+
+    _block: SharedStateBlock
+    _events: EventPublisher = NULL_PUBLISHER
+
+    @property
+    def touch_count(self) -> int:
+        return self._block.read("touch_count")
+
+    @property
+    def touch_time(self) -> float:
+        return self._block.read("touch_time")
+
+    @property
+    def is_goaled(self) -> bool:
+        return self._block.read("is_goaled")
+
+    @is_goaled.setter
+    def is_goaled(self, value: bool) -> None:
+        self._block.write("is_goaled", value)
+        self._events.publish(EventKind.goaled, value)
+
+    @property
+    def start_time(self) -> float:
+        return self._block.read("start_time")
+
+    @start_time.setter
+    def start_time(self, value: float) -> None:
+        self._block.write("start_time", value)
+
+    @property
+    def game_epoch(self) -> int:
+        return self._block.read("game_epoch")
+
+    @property
+    def checkpoint_sec(self) -> float | None:
+        return _nan_to_none(self._block.read("checkpoint_sec"))
+
+    @property
+    def goal_sec(self) -> float | None:
+        return _nan_to_none(self._block.read("goal_sec"))
+
+    def record_split(self, split: Split, elapsed_sec: float, epoch: int | None = None) -> bool:
+        field = f"{split.name}_sec"
+        with self._block.lock:
+            if epoch is not None and epoch != self._block.read("game_epoch"):
+                return False
+            if not math.isnan(self._block.read(field)):
+                return False
+            self._block.write(field, elapsed_sec)
+        return True
+
+    def add_touch(self, touch_count: int, touch_time: float, epoch: int | None = None) -> int | None:
+        with self._block.lock:
+            if epoch is not None and epoch != self._block.read("game_epoch"):
+                return None
+            count = self._block.read("touch_count") + touch_count
+            self._block.write("touch_count", count)
+            self._block.write("touch_time", self._block.read("touch_time") + touch_time)
+        if touch_count > 0:
+            self._events.publish(EventKind.touched, count)
+        return count
+
+    def increment_touch_count(self) -> None:
+        self.add_touch(1, 0.0)
+
+    def add_touch_time(self, touching_time: float) -> None:
+        self.add_touch(0, touching_time)
+
+    def clear_game_state(self) -> None:
+        with self._block.lock:
+            self._block.write("touch_count", 0)
+            self._block.write("touch_time", 0.0)
+            self._block.write("is_goaled", False)
+            self._block.write("start_time", time.time())
+            self._block.write("checkpoint_sec", math.nan)
+            self._block.write("goal_sec", math.nan)
+            self._block.write("game_epoch", self._block.read("game_epoch") + 1)
+        self._events.publish(EventKind.game_cleared)
+
+    @staticmethod
+    def get(block: SharedStateBlock, events: EventPublisher = NULL_PUBLISHER) -> ShmGameState:
+        return ShmGameState(block, events)
+
+    @staticmethod
+    def get_with_init(
+        block: SharedStateBlock,
+        touch_count: int = 0,
+        touch_time: float = 0.0,
+        is_goaled: bool = False,
+        events: EventPublisher = NULL_PUBLISHER,
+    ) -> ShmGameState:
+        block.write("touch_count", touch_count)
+        block.write("touch_time", touch_time)
+        block.write("is_goaled", is_goaled)
+        block.write("start_time", 0.0)
+        block.write("checkpoint_sec", math.nan)
+        block.write("goal_sec", math.nan)
+        block.write("game_epoch", 0)
+        return ShmGameState(block, events)
+
+
+def _nan_to_none(value: float) -> float | None:
+    return None if math.isnan(value) else value
+
+
+@dataclass
+class ShmGuiState:
+    """共有メモリを使った GuiState の実装"""
+
+    _block: SharedStateBlock
+    _events: EventPublisher = NULL_PUBLISHER
+
+    @property
+    def current_page(self) -> Page:
+        return Page(self._block.read("current_page"))
+
+    @current_page.setter
+    def current_page(self, value: Page) -> None:
+        self._block.write("current_page", value.value)
+        self._events.publish(EventKind.page_changed, value.value)
+
+    @staticmethod
+    def get(block: SharedStateBlock, events: EventPublisher = NULL_PUBLISHER) -> ShmGuiState:
+        return ShmGuiState(block, events)
+
+    @staticmethod
+    def get_with_init(block: SharedStateBlock, events: EventPublisher = NULL_PUBLISHER) -> ShmGuiState:
+        block.write("current_page", Page.TITLE.value)
+        return ShmGuiState(block, events)
+
+
+def benchmark_state(count: int = 20_000) -> None:
+    """DictProxy実装と共有メモリ実装の読み書き速度を比較する"""
+    import multiprocessing
+
+    from iraira.state import SharedGuiState, SharedPlayerState
+
+    def measure(label: str, player_state: Any, gui_state: Any) -> None:
+        start = time.perf_counter()
+        for _ in range(count):
+            _ = player_state.volume
+            _ = gui_state.current_page
+        read_sec = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(count):
+            player_state.volume = 0.5
+            gui_state.current_page = Page.GAME
+        write_sec = time.perf_counter() - start
+
+        print(f"{label:>13}: read {2 * count / read_sec:>12,.0f} ops/s  write {2 * count / write_sec:>12,.0f} ops/s")
+
+    with multiprocessing.Manager() as manager:
+        d: DictProxy[str, Any] = manager.dict()
+        measure("DictProxy", SharedPlayerState.get_with_init(d), SharedGuiState.get_with_init(d))
+
+    with SharedStateBlock.create() as block:
+        measure("SharedMemory", ShmPlayerState.get_with_init(block), ShmGuiState.get_with_init(block))
+
+
+def _add_touches(game_state: Any, count: int, use_epoch: bool, result: Any) -> None:
+    """stress_test_game_state の加算プロセス
+
+    世代を指定する場合は、最後に加算できた世代と、その世代に加算できた回数を result に書く
+    """
+    last_epoch, last_applied = -1, 0
+    for _ in range(count):
+        epoch = game_state.game_epoch if use_epoch else None
+        if game_state.add_touch(1, 0.5, epoch) is not None and epoch is not None:
+            last_applied = last_applied + 1 if epoch == last_epoch else 1
+            last_epoch = epoch
+    result[0], result[1] = last_epoch, last_applied
+
+
+def stress_test_game_state(workers: int = 4, count: int = 2_000) -> None:
+    """複数のプロセスから同時に加算・リセットしても、加算が失われないことを確認する
+
+    1. 全プロセスが同時に加算した後の接触回数・接触時間が、加算した回数と一致する
+    2. 加算中に別のプロセスがリセットを繰り返した場合、最後のリセット後の値が、その世代に加算できた回数と一致する
+    """
+    import multiprocessing
+
+    from iraira.state import SharedGameState, StateManager
+
+    def run_workers(game_state: Any, use_epoch: bool, clear: bool) -> tuple[list[Any], int]:
+        results = [multiprocessing.Array("q", 2) for _ in range(workers)]
+        processes = [
+            multiprocessing.Process(target=_add_touches, args=(game_state, count, use_epoch, r)) for r in results
+        ]
+        for p in processes:
+            p.start()
+        clears = 0
+        while clear and any(p.is_alive() for p in processes):
+            game_state.clear_game_state()
+            clears += 1
+            time.sleep(0.001)
+        for p in processes:
+            p.join()
+        return results, clears
+
+    def run(label: str, game_state: Any) -> None:
+        # 1. 同時加算
+        start = time.perf_counter()
+        run_workers(game_state, False, False)
+        elapsed = time.perf_counter() - start
+        expected = workers * count
+        assert game_state.touch_count == expected, f"{label}: lost {expected - game_state.touch_count} counts"
+        assert game_state.touch_time == expected * 0.5, f"{label}: touch_time {game_state.touch_time}"
+
+        # 2. 加算中のリセット
+        results, clears = run_workers(game_state, True, True)
+        epoch = game_state.game_epoch
+        applied = sum(r[1] for r in results if r[0] == epoch)
+        assert game_state.touch_count == applied, f"{label}: {game_state.touch_count} != {applied}"
+        assert game_state.touch_time == applied * 0.5, f"{label}: touch_time {game_state.touch_time}"
+
+        print(
+            f"{label:>13}: {expected:,} adds from {workers} processes ({expected / elapsed:,.0f} adds/s), "
+            f"{clears} clears while adding: no lost updates"
+        )
+
+    with StateManager() as manager:
+        run("DictProxy", SharedGameState.get_with_init(manager.game_dict()))  # type: ignore
+
+    with SharedStateBlock.create() as block:
+        run("SharedMemory", ShmGameState.get_with_init(block))
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["stress"]:
+        stress_test_game_state()
+    else:
+        benchmark_state()
@@ -0,0 +1,225 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import math
+import os
+import time
+import wave
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+import numpy as np
+import numpy.typing as npt
+
+from iraira.util import RepoPath
+
+_default_cache_dir = RepoPath().db_dir / "sound_cache"
+_converter_version = 2  # 変換方法を変更したら上げ、古い変換結果を使わないようにする
+
+
+def read_wav_mono(file: Path) -> tuple[npt.NDArray[np.float64], int]:
+    """wavファイルを読み込み、チャンネルを平均したモノラル信号にする
+
+    :param file: wavファイル (8, 16, 24 bit)
+    :return: int16の値域の信号, サンプリング周波数[Hz]
+    """
+    with wave.open(str(file), "rb") as fr:
+        channel = fr.getnchannels()
+        sample_width = fr.getsampwidth()
+        fs = fr.getframerate()
+        frame = fr.readframes(fr.getnframes())
+
+    if sample_width == 1:
+        w = (np.frombuffer(frame, dtype=np.uint8).astype(np.float64) - 128) * 256
+    elif sample_width == 2:
+        w = np.frombuffer(frame, dtype=np.int16).astype(np.float64)
+    elif sample_width == 3:
+        # 24bitは上位2byteのみ使う (リトルエンディアン)
+        b = np.frombuffer(frame, dtype=np.uint8).reshape(-1, 3)
+        w = b[:, 1:].copy().view(np.int16).ravel().astype(np.float64)
+    else:
+        raise NotImplementedError()
+
+    return w.reshape(-1, channel).mean(axis=1), fs
+
+
+def resample(
+    sig: npt.NDArray[np.float64],
+    fs_in: int,
+    fs_out: int,
+    taps_per_phase: int = 32,
+    chunk: int = 1 << 16,
+) -> npt.NDArray[np.float64]:
+    """ポリフェーズフィルタでサンプリング周波数を変換する
+
+    fs_out/fs_in を既約分数 up/down とし、up倍のゼロ挿入・窓付きsincによる低域通過・1/down間引きを
+    出力サンプルごとに必要な係数だけで計算する。
+
+    :param sig: 入力信号
+    :param fs_in: 入力のサンプリング周波数[Hz]
+    :param fs_out: 出力のサンプリング周波数[Hz]
+    :param taps_per_phase: 位相1つあたりのフィルタ係数の数
+    :param chunk: 一度に計算する出力サンプル数。作業領域の大きさを制限する
+    :return: 変換後の信号
+    """
+    if fs_in == fs_out:
+        return sig
+
+    g = math.gcd(fs_in, fs_out)
+    up, down = fs_out // g, fs_in // g
+
+    # アップサンプル後の周波数で設計した低域通過フィルタ。遮断周波数は入出力の低い方のナイキスト周波数
+    n_taps = taps_per_phase * up
+    center = (n_taps - 1) // 2
+    cutoff = 0.5 / max(up, down)  # [cycle/sample]
+    t = np.arange(n_taps) - center
+    h = 2 * cutoff * np.sinc(2 * cutoff * t) * np.kaiser(n_taps, 8.0) * up
+    # polyphase[phase, k] = h[phase + k * up]
+    polyphase = h.reshape(taps_per_phase, up).T
+
+    # 出力 m はアップサンプル後の位置 m * down + center に対応し、入力 base - k に係数 polyphase[phase, k] を掛ける
+    n_out = -(-len(sig) * up // down)
+    padded = np.concatenate([np.zeros(taps_per_phase), sig, np.zeros(taps_per_phase)])
+    k = np.arange(taps_per_phase)
+    out = np.empty(n_out)
+    for start in range(0, n_out, chunk):
+        pos = np.arange(start, min(start + chunk, n_out)) * down + center
+        phase, base = np.divmod(pos, up)[::-1]
+        window = padded[(base + taps_per_phase)[:, np.newaxis] - k]
+        out[start : start + len(pos)] = np.einsum("ij,ij->i", window, polyphase[phase])
+    return out
+
+
+def saturate_int16(sig: npt.NDArray[np.floating]) -> npt.NDArray[np.int16]:
+    """int16の値域で飽和させて変換する。桁あふれによる折り返しを起こさない"""
+    return np.clip(sig, -32768, 32767).astype(np.int16)
+
+
+@dataclass(frozen=True)
+class SoundAsset:
+    """効果音素材と変換方法"""
+
+    path: Path
+    gain: float = 1.0  # 音量調整
+    duration_sec: float | None = None  # 先頭から使用する長さ, Noneの場合は全体
+
+
+@dataclass(frozen=True)
+class _CacheMeta:
+    source_mtime_ns: int
+    source_size: int
+    source_sha256: str
+    fs: int
+    gain: float
+    duration_sec: float | None
+
+
+class SoundAssetCache:
+    """変換済み効果音のキャッシュ
+
+    効果音をプレーヤーのサンプリング周波数のモノラルint16に一度だけ変換して .npy で保存し、以降はメモリマップで読み込む。
+    メモリマップはページキャッシュを共有するため、複数プロセスで読み込んでもデコード済み信号の複製を持たない。
+    変換元ファイルの更新日時とサイズが一致すればそのまま使い、異なればハッシュ値を確認して変化していれば変換し直す。
+    """
+
+    def __init__(self, fs: int, cache_dir: Path = _default_cache_dir) -> None:
+        """
+        :param fs: 変換後のサンプリング周波数[Hz]
+        :param cache_dir: 変換結果を保存するディレクトリ
+        """
+        self._fs = fs
+        self._cache_dir = cache_dir
+
+    @staticmethod
+    def _source_key(path: Path) -> str:
+        """キャッシュのキーとする変換元のパス。素材ディレクトリ内はその相対パスとし、リポジトリの場所によらない"""
+        resolved = path.resolve()
+        try:
+            return resolved.relative_to(RepoPath().assert_dir.resolve()).as_posix()
+        except ValueError:
+            return str(resolved)
+
+    def _cache_path(self, asset: SoundAsset) -> Path:
+        key = f"{_converter_version}|{self._source_key(asset.path)}|{self._fs}|{asset.gain}|{asset.duration_sec}"
+        return self._cache_dir / f"{hashlib.sha1(key.encode()).hexdigest()[:16]}.npy"
+
+    @staticmethod
+    def _sha256(path: Path) -> str:
+        h = hashlib.sha256()
+        with path.open("rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def _convert(self, asset: SoundAsset) -> npt.NDArray[np.int16]:
+        sig, fs = read_wav_mono(asset.path)
+        if asset.duration_sec is not None:
+            sig = sig[: int(fs * asset.duration_sec)]
+        return saturate_int16(resample(sig, fs, self._fs) * asset.gain)
+
+    def _is_valid(self, asset: SoundAsset, meta_path: Path) -> bool:
+        try:
+            meta = _CacheMeta(**json.loads(meta_path.read_text(encoding="utf-8")))
+        except (OSError, ValueError, TypeError):
+            return False
+
+        if (meta.fs, meta.gain, meta.duration_sec) != (self._fs, asset.gain, asset.duration_sec):
+            return False
+
+        try:
+            stat = asset.path.stat()
+        except OSError:
+            # 変換元がない場合はキャッシュがない場合と同じく、変換時の読み込みエラーとして報告する
+            return False
+        if (meta.source_mtime_ns, meta.source_size) == (stat.st_mtime_ns, stat.st_size):
+            return True
+
+        # 更新日時のみ変わった場合(チェックアウトし直しなど)は内容が同じなら再利用する
+        if meta.source_sha256 != self._sha256(asset.path):
+            return False
+        self._write_meta(asset, meta_path, meta.source_sha256)
+        return True
+
+    def _write_meta(self, asset: SoundAsset, meta_path: Path, sha256: str) -> None:
+        stat = asset.path.stat()
+        meta = _CacheMeta(stat.st_mtime_ns, stat.st_size, sha256, self._fs, asset.gain, asset.duration_sec)
+        meta_path.write_text(json.dumps(asdict(meta)), encoding="utf-8")
+
+    def load(self, asset: SoundAsset) -> npt.NDArray[np.int16]:
+        """変換済みの効果音を読み込む。キャッシュがないか古い場合は変換して保存する
+
+        :param asset: 効果音素材
+        :return: 読み込み専用のメモリマップ
+        """
+        path = self._cache_path(asset)
+        meta_path = path.with_suffix(".json")
+
+        if not (path.exists() and self._is_valid(asset, meta_path)):
+            sig = self._convert(asset)
+            self._cache_dir.mkdir(parents=True, exist_ok=True)
+            # 書き込み途中のファイルを他プロセスが読まないよう一時ファイルから置き換える
+            tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+            with tmp_path.open("wb") as f:
+                np.save(f, sig)
+            os.replace(tmp_path, path)
+            self._write_meta(asset, meta_path, self._sha256(asset.path))
+
+        return np.load(path, mmap_mode="r")
+
+
+def benchmark_sound_assets(fs: int = 44_100) -> None:
+    """効果音の変換時と変換済みキャッシュ読み込み時の所要時間を比較する"""
+    import tempfile
+
+    assets = [SoundAsset(p) for p in sorted(RepoPath().assert_dir.glob("**/*.wav"))]
+    with tempfile.TemporaryDirectory() as d:
+        cache = SoundAssetCache(fs, Path(d))
+        for label in ("convert", "cached"):
+            start = time.perf_counter()
+            total = sum(len(cache.load(a)) for a in assets)
+            print(f"{label:>7}: {(time.perf_counter() - start) * 1000:8.2f} ms  ({total:,} samples)")
+
+
+if __name__ == "__main__":
+    benchmark_sound_assets()
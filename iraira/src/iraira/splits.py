@@ -0,0 +1,249 @@
+from __future__ import annotations
+
+import math
+import random
+import tempfile
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from enum import Enum, auto
+from pathlib import Path
+
+import numpy as np
+
+from iraira.results_store import FinishedGame, Result, ResultsStore
+
+
+class Segment(Enum):
+    """区切りの間の区間"""
+
+    first_stage = auto()  # スタートからチェックポイントまで
+    second_stage = auto()  # チェックポイントからゴールまで
+    total = auto()  # スタートからゴールまで
+
+    def __str__(self) -> str:
+        return self.name
+
+
+def segment_times(time_sec: float, checkpoint_sec: float | None) -> dict[Segment, float]:
+    """ゴールまでの時間とチェックポイントまでの時間から区間ごとの時間を求める
+
+    :param time_sec: スタートからゴールまでの時間[sec]
+    :param checkpoint_sec: スタートからチェックポイントまでの時間[sec], Noneの場合は total のみとする
+    """
+    times = {Segment.total: time_sec}
+    if checkpoint_sec is not None and 0 <= checkpoint_sec <= time_sec:
+        times[Segment.first_stage] = checkpoint_sec
+        times[Segment.second_stage] = time_sec - checkpoint_sec
+    return times
+
+
+class QuantileSketch:
+    """値の分布を対数間隔のビンの度数で保持し、相対誤差 relative_accuracy 以内で分位数を求める (DDSketch)
+
+    ビンiは (gamma^(i-1), gamma^i] の値を数える。ビンの数は値の範囲の比の対数に比例し、件数によらない。
+    例えば relative_accuracy=0.01 で 0.1 ~ 1000 秒の値は高々約460個のビンで表せる。
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01, min_value: float = 1e-3) -> None:
+        """
+        :param relative_accuracy: 分位数の相対誤差の上限
+        :param min_value: これより小さい値は min_value として数える
+        """
+        if not 0 < relative_accuracy < 1:
+            raise ValueError("relative_accuracy expected between 0 and 1")
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self._min_value = min_value
+        self._bins: dict[int, int] = {}
+        self._count = 0
+        self._sum = 0.0
+        self._min = math.inf
+        self._max = -math.inf
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    @property
+    def bins(self) -> int:
+        """使っているビンの数"""
+        return len(self._bins)
+
+    @property
+    def mean(self) -> float:
+        return self._sum / self._count if self._count else math.nan
+
+    @property
+    def min(self) -> float:
+        return self._min if self._count else math.nan
+
+    @property
+    def max(self) -> float:
+        return self._max if self._count else math.nan
+
+    def add(self, value: float) -> None:
+        i = math.ceil(math.log(max(value, self._min_value)) / self._log_gamma)
+        self._bins[i] = self._bins.get(i, 0) + 1
+        self._count += 1
+        self._sum += value
+        self._min = min(self._min, value)
+        self._max = max(self._max, value)
+
+    def quantile(self, q: float) -> float:
+        """q分位数 (0 <= q <= 1), 値がない場合はNaN"""
+        if not self._count:
+            return math.nan
+        rank = q * (self._count - 1)
+        seen = 0
+        for i in sorted(self._bins):
+            seen += self._bins[i]
+            if seen > rank:
+                # ビンの範囲で相対誤差が最小となる代表値。最小値・最大値を超えないようにする
+                value = 2 * self._gamma**i / (self._gamma + 1)
+                return min(max(value, self._min), self._max)
+        return self._max
+
+
+@dataclass(frozen=True)
+class SegmentStats:
+    """区間の時間の統計"""
+
+    count: int
+    mean_sec: float
+    p50_sec: float
+    p90_sec: float
+    best_sec: float
+
+    def __str__(self) -> str:
+        return (
+            f"count={self.count} mean={self.mean_sec:.2f}s p50={self.p50_sec:.2f}s p90={self.p90_sec:.2f}s "
+            f"best={self.best_sec:.2f}s"
+        )
+
+
+class SplitStatsCache:
+    """区間ごとの時間の統計と最速の時間をメモリに保持する
+
+    生成時に一度だけ全ての結果を読み込み、以降は追加された結果のみを反映する。
+    統計は QuantileSketch に逐次加えるため、結果の件数によらず一定のメモリで保持し、一定時間で参照できる。
+    """
+
+    def __init__(self, store: ResultsStore) -> None:
+        """
+        :param store: 結果の保存先
+        """
+        self._store = store
+        self._sketches = {segment: QuantileSketch() for segment in Segment}
+        self._last_id = 0
+        self.refresh()
+
+    def add(self, result: Result) -> None:
+        """新しい結果を統計に反映する"""
+        self._last_id = max(self._last_id, result.id)
+        for segment, sec in segment_times(result.time_sec, result.checkpoint_sec).items():
+            self._sketches[segment].add(sec)
+
+    def refresh(self) -> int:
+        """他のプロセスが追記した結果を統計に反映する
+
+        :return: 反映した結果の数
+        """
+        results = self._store.results_since(self._last_id)
+        for result in results:
+            self.add(result)
+        return len(results)
+
+    def stats(self, segment: Segment) -> SegmentStats | None:
+        """区間の時間の統計, 記録がない場合はNone"""
+        sketch = self._sketches[segment]
+        if not sketch.count:
+            return None
+        return SegmentStats(sketch.count, sketch.mean, sketch.quantile(0.5), sketch.quantile(0.9), sketch.min)
+
+    def best(self, segment: Segment) -> float | None:
+        """区間の最速の時間[sec], 記録がない場合はNone"""
+        sketch = self._sketches[segment]
+        return sketch.min if sketch.count else None
+
+    def delta(self, elapsed_sec: float, checkpoint_sec: float | None) -> float | None:
+        """プレイ中のゲームの最速の区間の時間に対する差[sec]。負の場合は先行、正の場合は遅れ
+
+        チェックポイントの前は1段目の最速と比べ、最速を過ぎて遅れが確定した場合のみ差を返す。
+        チェックポイントの後はチェックポイントでの差を返し、1段目と2段目の最速の和を過ぎた場合はその遅れを返す。
+
+        :param elapsed_sec: ゲーム開始からの時間[sec]
+        :param checkpoint_sec: チェックポイントに達した時間[sec], 達していない場合はNone
+        :return: 差, 比べる記録がない場合や差が確定していない場合はNone
+        """
+        best_first = self.best(Segment.first_stage)
+        if best_first is None:
+            return None
+        if checkpoint_sec is None:
+            return elapsed_sec - best_first if elapsed_sec > best_first else None
+
+        delta = checkpoint_sec - best_first
+        best_second = self.best(Segment.second_stage)
+        if best_second is not None:
+            delta = max(delta, elapsed_sec - (best_first + best_second))
+        return delta
+
+
+def benchmark_split_stats(rows: int = 100_000, repeat: int = 10_000) -> None:
+    """区間の統計の精度と、プレイ中の差の算出・追加された結果の反映にかかる時間を計測する
+
+    精度は全ての時間を numpy で並べ替えて求めた分位数と比べる。
+    """
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as d:
+        store = ResultsStore(Path(d) / "results.sqlite3", legacy_csv_path=None)
+        games = []
+        for _ in range(rows):
+            checkpoint = rng.lognormvariate(math.log(40), 0.4)
+            games.append(
+                FinishedGame(
+                    "player",
+                    datetime.now(),
+                    checkpoint + rng.lognormvariate(math.log(50), 0.4),
+                    0,
+                    0.0,
+                    None,
+                    checkpoint,
+                )
+            )
+        store.write_results(games, 0)
+
+        start = time.perf_counter()
+        cache = SplitStatsCache(store)
+        load_sec = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for i in range(repeat):
+            cache.delta(i % 200 * 0.5, None if i % 2 else 45.0)
+        delta_us = (time.perf_counter() - start) / repeat * 1e6
+
+        store.write_result("player", datetime.now(), 90.0, 0, 0.0, checkpoint_sec=40.0)
+        start = time.perf_counter()
+        cache.refresh()
+        refresh_ms = (time.perf_counter() - start) * 1e3
+        store.close()
+
+    total = np.sort([g.time_sec for g in games] + [90.0])
+    stats = cache.stats(Segment.total)
+    assert stats is not None
+    print(f"load {rows:,} results: {load_sec * 1e3:.0f} ms, refresh 1 result: {refresh_ms:.2f} ms")
+    print(f"delta: {delta_us:.2f} us")
+    for q, estimate in ((0.5, stats.p50_sec), (0.9, stats.p90_sec)):
+        exact = float(total[int(q * (len(total) - 1))])
+        print(f"total p{q * 100:g}: exact {exact:.3f}s sketch {estimate:.3f}s error {abs(estimate / exact - 1):.3%}")
+
+    sketch = QuantileSketch()
+    for sec in total:
+        sketch.add(float(sec))
+    print(f"sketch bins: {sketch.bins} for {sketch.count:,} values")
+    for segment in Segment:
+        print(f"{str(segment):>12}: {cache.stats(segment)}")
+
+
+if __name__ == "__main__":
+    benchmark_split_stats()
@@ -1,11 +1,14 @@
 from __future__ import annotations
 
+import threading
 import time
 from dataclasses import dataclass
 from enum import Enum, auto
-from multiprocessing.managers import DictProxy  # type: ignore
+from multiprocessing.managers import DictProxy, SyncManager  # type: ignore
 from typing import Any, Protocol
 
+from iraira.events import NULL_PUBLISHER, EventKind, EventPublisher
+
 
 class AppState(Protocol):
     """アプリ動作中の状態"""
@@ -30,6 +33,7 @@ class SharedAppState:
     """
 
     _raw: DictProxy[str, Any]
+    _events: EventPublisher = NULL_PUBLISHER
 
     @property
     def is_running(self) -> bool:
@@ -38,15 +42,17 @@ class SharedAppState:
     @is_running.setter
     def is_running(self, value: bool) -> None:
         self._raw["is_running"] = value
+        if not value:
+            self._events.publish(EventKind.app_stopped)
 
     @staticmethod
-    def get(d: DictProxy) -> SharedAppState:
-        return SharedAppState(d)
+    def get(d: DictProxy, events: EventPublisher = NULL_PUBLISHER) -> SharedAppState:
+        return SharedAppState(d, events)
 
     @staticmethod
-    def get_with_init(d: DictProxy) -> SharedAppState:
+    def get_with_init(d: DictProxy, events: EventPublisher = NULL_PUBLISHER) -> SharedAppState:
         d["is_running"] = True
-        return SharedAppState(d)
+        return SharedAppState(d, events)
 
 
 class PlayerState(Protocol):
@@ -91,6 +97,7 @@ class SharedPlayerState:
     """
 
     _raw: DictProxy[str, Any]
+    _events: EventPublisher = NULL_PUBLISHER
 
     @property
     def fs(self) -> int:
@@ -102,7 +109,10 @@ class SharedPlayerState:
 
     @play_state.setter
     def play_state(self, value: bool) -> None:
+        if self._raw["play_state"] == value:
+            return
         self._raw["play_state"] = value
+        self._events.publish(EventKind.play_state_changed, value)
 
     @property
     def volume(self) -> float:
@@ -131,11 +141,11 @@ class SharedPlayerState:
         self._raw["volume"] = v
 
     def change_play_state(self) -> None:
-        self._raw["play_state"] = not self._raw["play_state"]
+        self.play_state = not self._raw["play_state"]
 
     @staticmethod
-    def get(d: DictProxy) -> SharedPlayerState:
-        return SharedPlayerState(d)
+    def get(d: DictProxy, events: EventPublisher = NULL_PUBLISHER) -> SharedPlayerState:
+        return SharedPlayerState(d, events)
 
     @staticmethod
     def get_with_init(
@@ -143,11 +153,12 @@ class SharedPlayerState:
         fs: int = 44_100,
         volume: float = 0.5,
         play_state: bool = False,
+        events: EventPublisher = NULL_PUBLISHER,
     ) -> SharedPlayerState:
         d["fs"] = fs
         d["volume"] = volume
         d["play_state"] = play_state
-        return SharedPlayerState(d)
+        return SharedPlayerState(d, events)
 
 
 class TractionDirection(Enum):
@@ -204,6 +215,7 @@ class SharedSignalParam:
     """
 
     _raw: DictProxy[str, Any]
+    _events: EventPublisher = NULL_PUBLISHER
 
     @property
     def frequency(self) -> int:
@@ -215,6 +227,7 @@ class SharedSignalParam:
         if f == 1000:
             return
         self._raw["frequency"] = f + 1
+        self._events.publish(EventKind.signal_param_changed)
 
     def frequency_down(self) -> None:
         f = self._raw["frequency"]
@@ -222,6 +235,7 @@ class SharedSignalParam:
         if f == 20:
             return
         self._raw["frequency"] = f - 1
+        self._events.publish(EventKind.signal_param_changed)
 
     @property
     def traction_direction(self) -> TractionDirection:
@@ -229,15 +243,22 @@ class SharedSignalParam:
 
     def traction_change(self) -> None:
         if self.traction_direction == TractionDirection.up:
-            self._raw["traction_direction"] = TractionDirection.down
+            self.traction_down()
         else:
-            self._raw["traction_direction"] = TractionDirection.up
+            self.traction_up()
 
     def traction_up(self) -> None:
-        self._raw["traction_direction"] = TractionDirection.up
+        self._set_traction_direction(TractionDirection.up)
 
     def traction_down(self) -> None:
-        self._raw["traction_direction"] = TractionDirection.down
+        self._set_traction_direction(TractionDirection.down)
+
+    def _set_traction_direction(self, direction: TractionDirection) -> None:
+        # アナログ入力は同じ方向を毎フレーム設定するため、変化した場合のみ通知する
+        if self._raw["traction_direction"] == direction:
+            return
+        self._raw["traction_direction"] = direction
+        self._events.publish(EventKind.signal_param_changed)
 
     @property
     def count_anti_node(self) -> int:
@@ -249,6 +270,7 @@ class SharedSignalParam:
         if n == 1000:
             return
         self._raw["count_anti_node"] = n + 1
+        self._events.publish(EventKind.signal_param_changed)
 
     def count_anti_node_down(self) -> None:
         n = self._raw["count_anti_node"]
@@ -256,10 +278,11 @@ class SharedSignalParam:
         if n == 3:
             return
         self._raw["count_anti_node"] = n - 1
+        self._events.publish(EventKind.signal_param_changed)
 
     @staticmethod
-    def get(d: DictProxy) -> SharedSignalParam:
-        return SharedSignalParam(d)
+    def get(d: DictProxy, events: EventPublisher = NULL_PUBLISHER) -> SharedSignalParam:
+        return SharedSignalParam(d, events)
 
     @staticmethod
     def get_with_init(
@@ -267,11 +290,22 @@ class SharedSignalParam:
         frequency: int = 63,
         direction: TractionDirection = TractionDirection.up,
         count_anti_node: int = 4,
+        events: EventPublisher = NULL_PUBLISHER,
     ) -> SharedSignalParam:
         d["frequency"] = frequency
         d["traction_direction"] = direction
         d["count_anti_node"] = count_anti_node
-        return SharedSignalParam(d)
+        return SharedSignalParam(d, events)
+
+
+class Split(Enum):
+    """ゲーム開始からの経過時間を記録するコースの区切り"""
+
+    checkpoint = auto()  # 1段目を抜けてチェックポイントに触れた
+    goal = auto()  # 2段目を抜けてゴールに触れた
+
+    def __str__(self) -> str:
+        return self.name
 
 
 class GameState(Protocol):
@@ -301,6 +335,44 @@ class GameState(Protocol):
     def start_time(self, value: float) -> None:
         ...
 
+    @property
+    def game_epoch(self) -> int:
+        """ゲームの世代。clear_game_state() ごとに1増える"""
+        ...
+
+    @property
+    def checkpoint_sec(self) -> float | None:
+        """ゲーム開始からチェックポイントに触れるまでの時間[sec], 触れていない場合はNone"""
+        ...
+
+    @property
+    def goal_sec(self) -> float | None:
+        """ゲーム開始からゴールに触れるまでの時間[sec], ゴールしていない場合はNone"""
+        ...
+
+    def record_split(self, split: Split, elapsed_sec: float, epoch: int | None = None) -> bool:
+        """区切りに最初に達した時間を記録する。同じゲームで2回目以降に達した場合は記録しない
+
+        :param split: 達した区切り
+        :param elapsed_sec: ゲーム開始からの時間[sec]
+        :param epoch: 時間を計ったゲームの世代。現在の世代と異なる場合は記録しない。Noneの場合は世代によらず記録する
+        :return: 記録した場合True
+        """
+        ...
+
+    def add_touch(self, touch_count: int, touch_time: float, epoch: int | None = None) -> int | None:
+        """接触回数と接触時間に増分を加算する
+
+        読み出しと書き込みを他のプロセスの加算・リセットと競合しない1回の操作で行う。
+
+        :param touch_count: 接触回数の増分
+        :param touch_time: 接触時間の増分[sec]
+        :param epoch: 増分を数えたゲームの世代。現在の世代と異なる場合はリセット前の接触として加算しない。
+            Noneの場合は世代によらず加算する
+        :return: 加算後の接触回数, 加算しなかった場合はNone
+        """
+        ...
+
     def increment_touch_count(self) -> None:
         ...
 
@@ -311,11 +383,76 @@ class GameState(Protocol):
         ...
 
 
+class GameDict(dict):
+    """ゲーム状態を保持する辞書
+
+    接触回数・接触時間の加算とリセットをメソッドとして持ち、StateManager のサーバープロセス上で実行する。
+    DictProxy の読み出しと書き込みを別々に呼ぶ場合と異なり、1回のプロセス間通信で競合なく更新できる。
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        # サーバープロセスは接続ごとのスレッドでメソッドを実行する
+        self._lock = threading.Lock()
+
+    def add_touch(self, touch_count: int, touch_time: float, epoch: int | None) -> int | None:
+        with self._lock:
+            if epoch is not None and epoch != self["game_epoch"]:
+                return None
+            self["touch_count"] += touch_count
+            self["touch_time"] += touch_time
+            return self["touch_count"]
+
+    def record_split(self, split: Split, elapsed_sec: float, epoch: int | None) -> bool:
+        key = f"{split.name}_sec"
+        with self._lock:
+            if (epoch is not None and epoch != self["game_epoch"]) or self.get(key) is not None:
+                return False
+            self[key] = elapsed_sec
+            return True
+
+    def clear_game(self, start_time: float) -> None:
+        with self._lock:
+            self["touch_count"] = 0
+            self["touch_time"] = 0.0
+            self["isGoaled"] = False
+            self["start_time"] = start_time
+            self["checkpoint_sec"] = None
+            self["goal_sec"] = None
+            self["game_epoch"] += 1
+
+
+class GameDictProxy(DictProxy):  # type: ignore
+    """GameDict のプロキシ"""
+
+    _exposed_ = DictProxy._exposed_ + ("add_touch", "record_split", "clear_game")  # type: ignore
+
+    def add_touch(self, touch_count: int, touch_time: float, epoch: int | None) -> int | None:
+        return self._callmethod("add_touch", (touch_count, touch_time, epoch))  # type: ignore
+
+    def record_split(self, split: Split, elapsed_sec: float, epoch: int | None) -> bool:
+        return self._callmethod("record_split", (split, elapsed_sec, epoch))  # type: ignore
+
+    def clear_game(self, start_time: float) -> None:
+        self._callmethod("clear_game", (start_time,))
+
+
+class StateManager(SyncManager):
+    """状態共有に使う Manager。dict() などに加えて game_dict() で GameDict を生成できる"""
+
+
+StateManager.register("game_dict", GameDict, GameDictProxy)
+
+
 @dataclass
 class SharedGameState:
-    """GameStateの実装"""
+    """GameStateの実装
 
-    _raw: DictProxy[str, Any]
+    StateManager.game_dict() のプロキシ、またはプロセス内で使う場合は GameDict を保持する
+    """
+
+    _raw: GameDict
+    _events: EventPublisher = NULL_PUBLISHER
 
     @property
     def touch_count(self) -> int:
@@ -332,6 +469,7 @@ class SharedGameState:
     @is_goaled.setter
     def is_goaled(self, value: bool) -> None:
         self._raw["isGoaled"] = value
+        self._events.publish(EventKind.goaled, value)
 
     @property
     def start_time(self) -> float:
@@ -341,36 +479,57 @@ class SharedGameState:
     def start_time(self, value: float) -> None:
         self._raw["start_time"] = value
 
+    @property
+    def game_epoch(self) -> int:
+        return self._raw["game_epoch"]
+
+    @property
+    def checkpoint_sec(self) -> float | None:
+        return self._raw["checkpoint_sec"]
+
+    @property
+    def goal_sec(self) -> float | None:
+        return self._raw["goal_sec"]
+
+    def record_split(self, split: Split, elapsed_sec: float, epoch: int | None = None) -> bool:
+        return self._raw.record_split(split, elapsed_sec, epoch)
+
+    def add_touch(self, touch_count: int, touch_time: float, epoch: int | None = None) -> int | None:
+        count = self._raw.add_touch(touch_count, touch_time, epoch)
+        if count is not None and touch_count > 0:
+            self._events.publish(EventKind.touched, count)
+        return count
+
     def increment_touch_count(self) -> None:
-        count = self._raw["touch_count"]
-        self._raw["touch_count"] = count + 1
+        self.add_touch(1, 0.0)
 
     def add_touch_time(self, touching_time: float) -> None:
-        current_touching_time = self._raw["touch_time"]
-        self._raw["touch_time"] = current_touching_time + touching_time
+        self.add_touch(0, touching_time)
 
     def clear_game_state(self) -> None:
-        self._raw["touch_count"] = 0
-        self._raw["touch_time"] = 0
-        self._raw["isGoaled"] = False
-        self._raw["start_time"] = time.time()
+        self._raw.clear_game(time.time())
+        self._events.publish(EventKind.game_cleared)
 
     @staticmethod
-    def get(d: DictProxy) -> SharedGameState:
-        return SharedGameState(d)
+    def get(d: GameDict, events: EventPublisher = NULL_PUBLISHER) -> SharedGameState:
+        return SharedGameState(d, events)
 
     @staticmethod
     def get_with_init(
-        d: DictProxy,
+        d: GameDict,
         touch_count: int = 0,
         touch_time: float = 0.0,
         is_goaled: bool = False,
+        events: EventPublisher = NULL_PUBLISHER,
     ) -> SharedGameState:
         d["touch_count"] = touch_count
         d["touch_time"] = touch_time
         d["isGoaled"] = is_goaled
         d["start_time"] = 0
-        return SharedGameState(d)
+        d["checkpoint_sec"] = None
+        d["goal_sec"] = None
+        d["game_epoch"] = 0
+        return SharedGameState(d, events)
 
 
 class GuiState(Protocol):
@@ -390,6 +549,7 @@ class SharedGuiState:
     """GuiStateの実装"""
 
     _raw: DictProxy[str, Any]
+    _events: EventPublisher = NULL_PUBLISHER
 
     @property
     def current_page(self) -> Page:
@@ -398,15 +558,16 @@ class SharedGuiState:
     @current_page.setter
     def current_page(self, value: Page) -> None:
         self._raw["current_page"] = value
+        self._events.publish(EventKind.page_changed, value.value)
 
     @staticmethod
-    def get(d: DictProxy) -> SharedGuiState:
-        return SharedGuiState(d)
+    def get(d: DictProxy, events: EventPublisher = NULL_PUBLISHER) -> SharedGuiState:
+        return SharedGuiState(d, events)
 
     @staticmethod
-    def get_with_init(d: DictProxy) -> SharedGuiState:
+    def get_with_init(d: DictProxy, events: EventPublisher = NULL_PUBLISHER) -> SharedGuiState:
         d["current_page"] = Page.TITLE
-        return SharedGuiState(d)
+        return SharedGuiState(d, events)
 
 
 class Page(Enum):
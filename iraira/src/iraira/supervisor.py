@@ -0,0 +1,307 @@
+from __future__ import annotations
+
+import multiprocessing
+import os
+import signal
+import time
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass, field
+from multiprocessing.connection import wait
+from multiprocessing.process import BaseProcess
+from typing import Any
+
+from iraira.events import EventSubscriber
+from iraira.state import AppState
+
+_CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+@dataclass(frozen=True)
+class ProcessSpec:
+    """監視するプロセス"""
+
+    name: str
+    target: Callable[..., None]
+    args: tuple[Any, ...] = ()
+    cpus: frozenset[int] | None = None  # 実行するCPU, Noneの場合は指定しない
+    realtime_priority: int | None = None  # SCHED_FIFO の優先度 (1-99), Noneの場合は通常のスケジューリング
+    restart: bool = True  # 異常終了した場合に再起動する
+
+
+@dataclass(frozen=True)
+class ProcessMetrics:
+    """プロセスの状態"""
+
+    name: str
+    pid: int | None
+    is_alive: bool
+    restarts: int  # 異常終了による再起動の回数
+    exitcode: int | None  # 最後に終了したときの終了コード
+    cpu_percent: float | None  # 前回の取得からのCPU使用率[%], 取得できない場合はNone
+    rss_kb: int | None  # 常駐メモリ[KiB], 取得できない場合はNone
+
+    def __str__(self) -> str:
+        cpu = "-" if self.cpu_percent is None else f"{self.cpu_percent:.1f}%"
+        rss = "-" if self.rss_kb is None else f"{self.rss_kb / 1024:.1f}MiB"
+        state = "alive" if self.is_alive else f"exit={self.exitcode}"
+        return f"{self.name}: pid={self.pid} {state} restarts={self.restarts} cpu={cpu} rss={rss}"
+
+
+@dataclass
+class _Child:
+    spec: ProcessSpec
+    process: BaseProcess | None = None
+    started_at: float = 0.0
+    restart_at: float | None = None  # 再起動する時刻, Noneの場合は再起動待ちではない
+    restarts: int = 0
+    failures: int = 0  # 連続した異常終了の回数
+    exitcode: int | None = None
+    is_finished: bool = False  # 正常終了した、または再起動を諦めた
+    cpu_sample: tuple[float, float] | None = field(default=None, repr=False)  # (時刻, CPU時間)
+
+
+class Supervisor:
+    """サブシステムごとのプロセスを起動・監視する
+
+    各プロセスは専用のプロセスで実行し、異常終了 (終了コードが0以外) した場合は待ち時間を倍々に延ばしながら再起動する。
+    起動直後に異常終了を繰り返す場合は max_failures 回で再起動を諦める。
+
+    終了は app_state.is_running で通知する。SIGINT/SIGTERM を受けた場合も is_running をFalseにして、
+    各プロセスが自分で終了するのを grace_sec まで待ち、終了しないプロセスは SIGTERM, SIGKILL で終了させる。
+    子プロセスは SIGINT を無視し、端末の Ctrl-C でも監視プロセスからの終了通知で終了する。
+    """
+
+    def __init__(
+        self,
+        specs: Iterable[ProcessSpec],
+        app_state: AppState,
+        events: EventSubscriber | None = None,
+        backoff_sec: float = 0.5,
+        max_backoff_sec: float = 30.0,
+        stable_sec: float = 60.0,
+        max_failures: int = 10,
+        grace_sec: float = 3.0,
+        report_interval_sec: float | None = None,
+        report: Callable[[list[ProcessMetrics]], None] | None = None,
+    ) -> None:
+        """
+        :param specs: 監視するプロセス
+        :param app_state: アプリの動作状態。Falseになった場合に全てのプロセスを終了させる
+        :param events: 状態変化イベント。アプリ終了を待たずに検知するために使う
+        :param backoff_sec: 最初の再起動までの待ち時間[sec]
+        :param max_backoff_sec: 再起動までの最大の待ち時間[sec]
+        :param stable_sec: この時間以上動作した後の異常終了は、連続した異常終了として数えない[sec]
+        :param max_failures: 連続した異常終了がこの回数に達した場合は再起動しない
+        :param grace_sec: 終了を通知してから強制終了するまでの時間[sec]
+        :param report_interval_sec: プロセスの状態を報告する間隔[sec], Noneの場合は報告しない
+        :param report: プロセスの状態を受け取る関数
+        """
+        self._children = [_Child(spec) for spec in specs]
+        self._app_state = app_state
+        self._events = events
+        self._backoff_sec = backoff_sec
+        self._max_backoff_sec = max_backoff_sec
+        self._stable_sec = stable_sec
+        self._max_failures = max_failures
+        self._grace_sec = grace_sec
+        self._report_interval_sec = report_interval_sec
+        self._report = report
+        self._is_stop_requested = False
+
+    def run(self) -> None:
+        """全てのプロセスを起動し、アプリが終了するか全てのプロセスが終了するまで監視する"""
+        previous_handlers = {sig: signal.signal(sig, self._on_signal) for sig in (signal.SIGINT, signal.SIGTERM)}
+        try:
+            for child in self._children:
+                self._start(child)
+            self._monitor()
+        finally:
+            self.shutdown()
+            for sig, handler in previous_handlers.items():
+                signal.signal(sig, handler)
+
+    def _on_signal(self, signum: int, frame: Any) -> None:
+        self._is_stop_requested = True
+
+    def _monitor(self) -> None:
+        next_report = None if self._report_interval_sec is None else time.monotonic() + self._report_interval_sec
+        while not self._is_stop_requested and self._app_state.is_running:
+            now = time.monotonic()
+            deadlines = [c.restart_at for c in self._children if c.restart_at is not None]
+            if next_report is not None:
+                deadlines.append(next_report)
+            # シグナルと取りこぼしたイベントに備え、最長でも1秒ごとに状態を確認する
+            timeout = min([1.0, *(d - now for d in deadlines)])
+
+            waitables: list[Any] = [c.process.sentinel for c in self._children if c.process is not None]
+            if self._events is not None:
+                waitables.append(self._events)
+            wait(waitables, max(0.0, timeout))
+            if self._events is not None:
+                self._events.drain()
+
+            now = time.monotonic()
+            for child in self._children:
+                self._reap(child, now)
+                if child.restart_at is not None and child.restart_at <= now:
+                    self._start(child)
+                    child.restarts += 1
+
+            if all(c.is_finished for c in self._children):
+                return
+
+            if next_report is not None and now >= next_report and self._report is not None:
+                self._report(self.metrics())
+                next_report = now + (self._report_interval_sec or 0)
+
+    def _start(self, child: _Child) -> None:
+        spec = child.spec
+        child.process = multiprocessing.Process(
+            target=_run_child,
+            args=(spec,),
+            name=spec.name,
+            daemon=False,
+        )
+        child.process.start()
+        child.started_at = time.monotonic()
+        child.restart_at = None
+        child.cpu_sample = None
+
+    def _reap(self, child: _Child, now: float) -> None:
+        """終了したプロセスの再起動を予定する"""
+        process = child.process
+        if process is None or process.exitcode is None:
+            return
+
+        process.join()
+        child.exitcode = process.exitcode
+        child.process = None
+        if child.exitcode == 0 or not child.spec.restart:
+            child.is_finished = True
+            return
+
+        child.failures = 1 if now - child.started_at >= self._stable_sec else child.failures + 1
+        if child.failures >= self._max_failures:
+            print(f"{__file__}: {child.spec.name} exited {child.failures} times in a row, giving up")
+            child.is_finished = True
+            return
+
+        delay = min(self._backoff_sec * 2 ** (child.failures - 1), self._max_backoff_sec)
+        print(f"{__file__}: {child.spec.name} exited with {child.exitcode}, restarting in {delay:.1f}s")
+        child.restart_at = now + delay
+
+    def shutdown(self) -> None:
+        """全てのプロセスに終了を通知し、grace_sec 以内に終了しないプロセスを強制終了する"""
+        self._app_state.is_running = False
+        for child in self._children:
+            child.restart_at = None
+
+        deadline = time.monotonic() + self._grace_sec
+        for child in self._children:
+            if child.process is not None:
+                child.process.join(max(0.0, deadline - time.monotonic()))
+
+        for child in self._children:
+            process = child.process
+            if process is None:
+                continue
+            if process.is_alive():
+                print(f"{__file__}: {child.spec.name} did not exit, terminating")
+                process.terminate()
+                process.join(1.0)
+            if process.is_alive():
+                process.kill()
+                process.join()
+            child.exitcode = process.exitcode
+            child.process = None
+
+    def metrics(self) -> list[ProcessMetrics]:
+        """全てのプロセスの状態。CPU使用率は前回の取得からの平均とする"""
+        now = time.monotonic()
+        metrics = []
+        for child in self._children:
+            process = child.process
+            pid = process.pid if process is not None else None
+            cpu_percent, rss_kb = None, None
+            if pid is not None:
+                usage = _read_proc_usage(pid)
+                if usage is not None:
+                    cpu_sec, rss_kb = usage
+                    previous = child.cpu_sample or (child.started_at, 0.0)
+                    cpu_percent = (cpu_sec - previous[1]) / max(now - previous[0], 1e-9) * 100
+                    child.cpu_sample = (now, cpu_sec)
+            metrics.append(
+                ProcessMetrics(
+                    child.spec.name,
+                    pid,
+                    process is not None and process.is_alive(),
+                    child.restarts,
+                    child.exitcode,
+                    cpu_percent,
+                    rss_kb,
+                )
+            )
+        return metrics
+
+
+def _run_child(spec: ProcessSpec) -> None:
+    """子プロセスのエントリーポイント"""
+    # 端末の Ctrl-C は監視プロセスが受けて終了を通知する。SIGTERM は強制終了に使うため既定の動作に戻す
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    _apply_scheduling(spec)
+    spec.target(*spec.args)
+
+
+def _apply_scheduling(spec: ProcessSpec) -> None:
+    """CPUの割り当てと優先度を設定する。対応していない環境や権限がない場合は設定せずに続行する"""
+    if spec.cpus is not None and hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(0, spec.cpus)
+        except OSError as e:
+            print(f"{__file__}: {spec.name}: cpu affinity {sorted(spec.cpus)}: {e}")
+
+    if spec.realtime_priority is not None and hasattr(os, "sched_setscheduler"):
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(spec.realtime_priority))
+        except OSError as e:
+            # 権限がない場合 (CAP_SYS_NICE, RLIMIT_RTPRIO) は通常のスケジューリングで動作する
+            print(f"{__file__}: {spec.name}: realtime priority {spec.realtime_priority}: {e}")
+
+
+def _read_proc_usage(pid: int) -> tuple[float, int] | None:
+    """/proc から累積のCPU時間[sec]と常駐メモリ[KiB]を読む。Linux以外やプロセスが終了した場合はNone"""
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            stat = f.read()
+        with open(f"/proc/{pid}/statm", "rb") as f:
+            statm = f.read()
+    except OSError:
+        return None
+    # 2番目のフィールド (comm) は空白を含みうるため、最後の ")" 以降を分割する。utime, stime は14, 15番目
+    fields = stat[stat.rindex(b")") + 2 :].split()
+    cpu_sec = (int(fields[11]) + int(fields[12])) / _CLOCK_TICKS
+    rss_kb = int(statm.split()[1]) * _PAGE_SIZE // 1024
+    return cpu_sec, rss_kb
+
+
+def cpu_plan(cpus: Iterable[int] | None = None) -> dict[str, frozenset[int] | None]:
+    """プロセスごとのCPUの割り当て
+
+    4CPU以上ある場合は、音声再生と接触検知にそれぞれ専用のCPUを割り当て、その他のプロセスは残りのCPUで実行する。
+    CPUが少ない場合は割り当てない。
+
+    :param cpus: 使用できるCPU, Noneの場合はこのプロセスが実行できる全てのCPU
+    :return: "player", "touch", "other" ごとのCPU
+    """
+    if cpus is None:
+        cpus = os.sched_getaffinity(0) if hasattr(os, "sched_getaffinity") else range(os.cpu_count() or 1)
+    available = sorted(cpus)
+    if len(available) < 4:
+        return {"player": None, "touch": None, "other": None}
+    return {
+        "player": frozenset(available[-1:]),
+        "touch": frozenset(available[-2:-1]),
+        "other": frozenset(available[:-2]),
+    }
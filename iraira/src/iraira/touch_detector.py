@@ -0,0 +1,308 @@
+from __future__ import annotations
+
+import bisect
+import queue
+import time
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass
+
+from iraira.clock import REAL_CLOCK, Clock
+from iraira.gpio_backend import Edge, GpioBackend, SimulatedGpioBackend
+
+
+@dataclass
+class TouchUpdate:
+    """前回の取り出し以降の判定結果"""
+
+    touch_count: int = 0  # 壁接触回数の増分
+    touch_time_sec: float = 0.0  # 壁接触時間の増分
+    is_goaled: bool = False  # ゴールに触れた
+    is_started: bool = False  # スタートに触れた
+    started_ns: int | None = None  # スタートと判定した時刻
+    checkpoint_ns: int | None = None  # チェックポイントに触れた最初の時刻
+    goaled_ns: int | None = None  # ゴールと判定した最初の時刻
+
+    def __bool__(self) -> bool:
+        return (
+            self.touch_count > 0
+            or self.touch_time_sec > 0
+            or self.is_goaled
+            or self.is_started
+            or self.checkpoint_ns is not None
+        )
+
+
+class TouchDetector:
+    """入力ピンのエッジ列から壁接触・チェックポイント・ゴール・スタートを判定する
+
+    接触時間はエッジの時刻差から求めるため、判定の呼び出し間隔によらず接触の長さを正確に計上する。
+    接触中の時間経過による判定(無敵時間経過後の再カウント・ゴールとスタートの接触継続時間)は
+    next_deadline_ns() の時刻に poll() を呼ぶことで判定する。
+    """
+
+    def __init__(
+        self,
+        course_pins: Iterable[int],
+        goal_pin: int,
+        start_pin: int,
+        invincible_sec: float,
+        goal_dwell_sec: float,
+        start_dwell_sec: float,
+        checkpoint_pin: int | None = None,
+    ) -> None:
+        """
+        :param course_pins: コースのピン
+        :param goal_pin: ゴールのピン
+        :param start_pin: スタートのピン
+        :param invincible_sec: 接触を数えてから次の接触を数えない時間[sec]
+        :param goal_dwell_sec: ゴールと判定するまでの接触継続時間[sec]
+        :param start_dwell_sec: スタートと判定するまでの接触継続時間[sec]
+        :param checkpoint_pin: チェックポイントのピン, Noneの場合は判定しない
+        """
+        self._course_pins = frozenset(course_pins)
+        self._goal_pin = goal_pin
+        self._start_pin = start_pin
+        self._checkpoint_pin = checkpoint_pin
+        self._invincible_ns = int(invincible_sec * 1e9)
+        self._goal_dwell_ns = int(goal_dwell_sec * 1e9)
+        self._start_dwell_ns = int(start_dwell_sec * 1e9)
+        self.reset()
+
+    @property
+    def pins(self) -> frozenset[int]:
+        pins = self._course_pins | {self._goal_pin, self._start_pin}
+        return pins if self._checkpoint_pin is None else pins | {self._checkpoint_pin}
+
+    def reset(self) -> None:
+        """接触状態と取り出していない判定結果を破棄する。判定を再開するときは現在のレベルを feed() で与える"""
+        self._update = TouchUpdate()
+        self._touching: set[int] = set()
+        self._course_accounted_ns: int | None = None  # コース接触中の場合、接触時間を計上済みの時刻
+        self._last_touched_ns: int | None = None  # 最後に接触を数えた、または接触し始めた時刻
+        self._goal_since_ns: int | None = None
+        self._start_since_ns: int | None = None
+        self._is_start_held = False
+
+    def feed(self, edge: Edge) -> None:
+        """エッジを時刻順に与える"""
+        self.poll(edge.t_ns)
+
+        if edge.level == 0:
+            self._touching.add(edge.pin)
+        else:
+            self._touching.discard(edge.pin)
+
+        if edge.pin in self._course_pins:
+            self._on_course_edge(edge.t_ns)
+        elif edge.pin == self._goal_pin:
+            self._goal_since_ns = edge.t_ns if edge.level == 0 else None
+        elif edge.pin == self._checkpoint_pin:
+            # 通過の時刻は触れ始めの時刻とする。スタートに触れている間はゲームが始まっていないため記録しない
+            if edge.level == 0 and not self._is_start_held and self._update.checkpoint_ns is None:
+                self._update.checkpoint_ns = edge.t_ns
+        elif edge.pin == self._start_pin:
+            self._start_since_ns = edge.t_ns if edge.level == 0 else None
+            self._is_start_held = False
+
+        self.poll(edge.t_ns)
+
+    def _on_course_edge(self, t_ns: int) -> None:
+        is_touching = not self._touching.isdisjoint(self._course_pins)
+        if is_touching and self._course_accounted_ns is None:
+            # 接触開始: 前回の接触から無敵時間が経過していれば数える
+            elapsed = None if self._last_touched_ns is None else t_ns - self._last_touched_ns
+            self._last_touched_ns = t_ns
+            self._course_accounted_ns = t_ns
+            if not self._is_start_held and (elapsed is None or elapsed >= self._invincible_ns):
+                self._update.touch_count += 1
+        elif not is_touching:
+            self._course_accounted_ns = None
+
+    def poll(self, now_ns: int) -> None:
+        """now_ns までの時間経過を判定に反映する"""
+        if self._course_accounted_ns is not None:
+            if not self._is_start_held:
+                self._update.touch_time_sec += (now_ns - self._course_accounted_ns) / 1e9
+            self._course_accounted_ns = now_ns
+
+            # 接触し続けている場合は無敵時間ごとに数える
+            assert self._last_touched_ns is not None
+            while now_ns - self._last_touched_ns >= self._invincible_ns:
+                self._last_touched_ns += self._invincible_ns
+                if not self._is_start_held:
+                    self._update.touch_count += 1
+
+        if self._goal_since_ns is not None and now_ns - self._goal_since_ns >= self._goal_dwell_ns:
+            self._update.is_goaled = True
+            if self._update.goaled_ns is None:
+                self._update.goaled_ns = self._goal_since_ns + self._goal_dwell_ns
+
+        # スタートに触れている間はゲーム状態をリセットし続けるため、壁接触は数えない
+        if self._start_since_ns is not None and now_ns - self._start_since_ns >= self._start_dwell_ns:
+            if not self._is_start_held:
+                self._update.is_started = True
+                self._update.started_ns = self._start_since_ns + self._start_dwell_ns
+                # スタート前に触れたチェックポイントは、始まったゲームの通過としない
+                self._update.checkpoint_ns = None
+                self._is_start_held = True
+
+    def next_deadline_ns(self) -> int | None:
+        """次に poll() で判定が変わりうる時刻, 時間経過で変わる判定がない場合はNone"""
+        deadlines = []
+        if self._course_accounted_ns is not None and self._last_touched_ns is not None:
+            deadlines.append(self._last_touched_ns + self._invincible_ns)
+        if self._goal_since_ns is not None:
+            deadlines.append(self._goal_since_ns + self._goal_dwell_ns)
+        if self._start_since_ns is not None and not self._is_start_held:
+            deadlines.append(self._start_since_ns + self._start_dwell_ns)
+        return min(deadlines) if deadlines else None
+
+    def take(self) -> TouchUpdate:
+        """前回の取り出し以降の判定結果を取り出す"""
+        update, self._update = self._update, TouchUpdate()
+        return update
+
+
+class EdgeQueue:
+    """GPIOのエッジ通知を受け取り、判定側のスレッドへ時刻順に渡すキュー"""
+
+    def __init__(
+        self,
+        backend: GpioBackend,
+        pins: Iterable[int],
+        clock: Clock = REAL_CLOCK,
+        record: Callable[[Edge], None] | None = None,
+    ) -> None:
+        """
+        :param backend: GPIO入力
+        :param pins: エッジを受け取るピン
+        :param clock: 現在のレベルに付ける時刻の時刻源。backendがエッジに付ける時刻と揃える
+        :param record: 受け取ったエッジと初期レベルを記録する関数, Noneの場合は記録しない
+        """
+        self._backend = backend
+        self._pins = tuple(pins)
+        self._clock = clock
+        self._queue: queue.SimpleQueue[Edge] = queue.SimpleQueue()
+
+        def put(edge: Edge) -> None:
+            if record is not None:
+                record(edge)
+            self._queue.put(edge)
+
+        for pin in self._pins:
+            backend.setup_input(pin)
+        if record is not None:
+            for level in self.current_levels():
+                record(level)
+        for pin in self._pins:
+            backend.add_edge_callback(pin, put)
+
+    def current_levels(self) -> list[Edge]:
+        """現在のレベルをエッジとして取得する。判定の開始時に与える"""
+        levels = self._backend.inputs(self._pins)
+        t_ns = self._clock.monotonic_ns()
+        return [Edge(pin, level, t_ns) for pin, level in zip(self._pins, levels)]
+
+    def get(self, timeout: float | None) -> Edge | None:
+        """エッジを1つ取り出す
+
+        :param timeout: 最大待ち時間[sec], Noneの場合は無期限
+        :return: エッジ, タイムアウトした場合はNone
+        """
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def clear(self) -> None:
+        while self.get(0) is not None:
+            pass
+
+    def close(self) -> None:
+        for pin in self._pins:
+            self._backend.remove_edge_callback(pin)
+
+
+def benchmark_touch_detection(duration_sec: float = 5.0, polling_interval: float = 0.005) -> None:
+    """生成した接触のエッジ列について、エッジからの判定と従来の周期読み取りによる判定の精度とCPU時間を比較する
+
+    正解はエッジ列を時刻どおりに一括で判定した結果とする。
+    """
+    from iraira.hal import simulated_touch_trace
+
+    course_pin, goal_pin, start_pin = 21, 13, 26
+    invincible_sec = 0.5
+    # duration_sec の間に終わる接触のエッジ列。ゴールには触れない
+    generated = simulated_touch_trace((course_pin,), goal_pin, touches_per_sec=5.0, goal_interval_sec=2 * duration_sec)
+    trace: list[Edge] = []
+    for pressed, released in zip(generated, generated):
+        if released.t_ns > duration_sec * 1e9:
+            break
+        trace += [pressed, released]
+
+    reference = TouchDetector((course_pin,), goal_pin, start_pin, invincible_sec, 0.0, 0.0)
+    for e in trace:
+        reference.feed(e)
+    expected = reference.take()
+
+    # エッジからの判定: 疑似GPIOで実時間再生し、キューとタイムアウト付き待ちで判定する
+    backend = SimulatedGpioBackend()
+    edges = EdgeQueue(backend, (course_pin, goal_pin, start_pin))
+    detector = TouchDetector((course_pin,), goal_pin, start_pin, invincible_sec, 0.0, 0.0)
+    for e in edges.current_levels():
+        detector.feed(e)
+
+    cpu_start = time.process_time()
+    player = backend.replay(trace)
+    received = 0
+    while player.is_alive() or received < len(trace):
+        deadline = detector.next_deadline_ns()
+        timeout = 0.05 if deadline is None else max(0.0, (deadline - time.monotonic_ns()) / 1e9)
+        edge = edges.get(min(timeout, 0.05))
+        if edge is not None:
+            detector.feed(edge)
+            received += 1
+        else:
+            detector.poll(time.monotonic_ns())
+    edge_cpu = time.process_time() - cpu_start
+    edge_result = detector.take()
+    edges.close()
+
+    # 従来方式: 周期的にレベルを読み、接触中は周期分の時間を加算する
+    edge_times = [e.t_ns for e in trace]
+    poll_sec = 0.0
+    poll_count = 0
+    poll_contacts = 0
+    last_touched = -1e9
+    is_touching = False
+    t = 0.0
+    while t < duration_sec:
+        # 時刻tより前のエッジ数が奇数なら接触中
+        if bisect.bisect_right(edge_times, int(t * 1e9)) % 2 == 1:
+            elapsed = t - last_touched
+            if not is_touching:
+                last_touched = t
+                is_touching = True
+                poll_contacts += 1
+            else:
+                poll_sec += polling_interval
+            if elapsed > invincible_sec:
+                poll_count += 1
+                last_touched = t
+        else:
+            is_touching = False
+        t += polling_interval
+
+    def row(label: str, contacts: int, count: int, touch_time_sec: float) -> str:
+        return f"{label:>9}: contacts {contacts:3}  count {count:3}  touch time {touch_time_sec * 1000:8.2f} ms"
+
+    print(row("expected", len(trace) // 2, expected.touch_count, expected.touch_time_sec))
+    print(
+        row("edge", received // 2, edge_result.touch_count, edge_result.touch_time_sec)
+        + f"  cpu {edge_cpu / duration_sec * 100:.2f}%"
+    )
+    print(row("polling", poll_contacts, poll_count, poll_sec) + f"  (interval {polling_interval * 1000:.0f} ms)")
+
+
+if __name__ == "__main__":
+    benchmark_touch_detection()
@@ -1,82 +1,264 @@
-import sys
-import time
+from __future__ import annotations
 
-import RPi.GPIO as GPIO
+import sys
 
-from iraira.state import AppState, GameState, GuiState, Page
+from iraira.events import EventKind, EventSubscriber
+from iraira.hal import Hardware, simulated_touch_trace
+from iraira.state import AppState, GameState, GuiState, Page, Split
+from iraira.touch_detector import EdgeQueue, TouchDetector, TouchUpdate
+from iraira.tracing import Flow, Hop
 
 GPIO_1ST_STAGE = 21
 GPIO_START_POINT = 26
 GPIO_CHECK_POINT = 19
 GPIO_GOAL_POINT = 13
 GPIO_2ND_STAGE = 6
+GPIO_TOUCH_PINS = (GPIO_1ST_STAGE, GPIO_2ND_STAGE, GPIO_CHECK_POINT, GPIO_GOAL_POINT, GPIO_START_POINT)
 
-GPIO.setmode(GPIO.BCM)
-GPIO.setup(GPIO_START_POINT, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-GPIO.setup(GPIO_1ST_STAGE, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-GPIO.setup(GPIO_CHECK_POINT, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-GPIO.setup(GPIO_2ND_STAGE, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-GPIO.setup(GPIO_GOAL_POINT, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-
-POLLING_INTERVAL = 0.005  # sec
+EVENT_CHECK_INTERVAL = 0.05  # sec 接触がない間に画面遷移などのイベントを確認する間隔
+IDLE_WAIT_INTERVAL = 1.0  # sec ゲーム画面以外で終了状態を確認する間隔
 INVINCIBLE_INTERVAL = 0.5  # sec
+FLUSH_INTERVAL = 0.1  # sec 接触時間の増分をまとめて共有状態に加算する間隔
 
 GOAL_DETECTION_DURATION = 0.0  # sec
 START_DETECTION_DURATION = 1.0  # sec
 
 
-def touch_listener(app_state: AppState, game_state: GameState, gui_state: GuiState) -> None:
+def touch_listener(
+    app_state: AppState,
+    game_state: GameState,
+    gui_state: GuiState,
+    events: EventSubscriber,
+    hardware: Hardware = Hardware(),
+) -> None:
+    """壁・チェックポイント・ゴール・スタートへの接触を判定する
+
+    GPIOのエッジ通知を時刻付きでキューに積み、エッジの時刻から接触時間や無敵時間を判定する。
+    チェックポイントとゴールに達した時間は、ゲーム画面に遷移した時刻またはスタートと判定した時刻からの時間とする。
+
+    :param hardware: GPIOの実装, 入力を記録するセッションログ, 計測点の記録
+    """
     try:
-        course_last_touched_time: float = 0.0
-        course_is_touching: bool = False
-        course_elapsed_time: float = 0.0
+        clock = hardware.clock
+        gpio = hardware.open_gpio(
+            simulated_touch_trace(
+                (GPIO_1ST_STAGE, GPIO_2ND_STAGE),
+                GPIO_GOAL_POINT,
+                seed=hardware.seed,
+                checkpoint_pin=GPIO_CHECK_POINT,
+            ),
+            hardware.touch_sample_hz,
+        )
+        session_log = hardware.open_session_log("touch")
+        tracer = hardware.open_tracer("touch")
+        edges = EdgeQueue(gpio, GPIO_TOUCH_PINS, clock, None if session_log is None else session_log.write_edge)
+        detector = create_touch_detector()
+        accumulator = TouchAccumulator(game_state)
 
-        goal_touching_time: float = 0.0
-        start_touching_time: float = 0.0
+        current_page = gui_state.current_page
+        is_detecting = False
 
         while app_state.is_running:
-            time.sleep(POLLING_INTERVAL)
+            for event in events.drain():
+                if event.kind == EventKind.page_changed:
+                    current_page = Page(event.value)
+                elif event.kind == EventKind.game_cleared:
+                    accumulator.on_game_cleared(clock.monotonic_ns())
 
-            if gui_state.current_page != Page.GAME:
-                goal_touching_time = 0.0
-                start_touching_time = 0.0
+            if current_page != Page.GAME:
+                accumulator.flush()
+                is_detecting = False
+                # ゲーム画面以外では接触判定しないため、画面遷移などのイベントまで待機する
+                # 終了イベントを上で読み捨てた場合も終了状態を確認できるよう待ち時間に上限を設ける
+                events.wait(clock.to_real(IDLE_WAIT_INTERVAL))
                 continue
 
-            # コース上の接触判定
-            if GPIO.input(GPIO_1ST_STAGE) == 0 or GPIO.input(GPIO_2ND_STAGE) == 0:
-                course_elapsed_time = time.time() - course_last_touched_time
-
-                # 接触時間のカウント
-                if not course_is_touching:
-                    course_last_touched_time = time.time()
-                    course_is_touching = True
-                else:
-                    game_state.add_touch_time(POLLING_INTERVAL)
-
-                # 無敵時間判定
-                if course_elapsed_time > INVINCIBLE_INTERVAL:
-                    game_state.increment_touch_count()
-                    course_last_touched_time = time.time()
-            else:
-                course_is_touching = False
+            if not is_detecting:
+                accumulator.start_game(clock.monotonic_ns())
+                start_detection(detector, edges)
+                is_detecting = True
+
+            # エッジを受け取るか、接触継続による判定時刻になるまで待つ
+            deadlines = [d for d in (detector.next_deadline_ns(), accumulator.next_deadline_ns()) if d is not None]
+            timeout = EVENT_CHECK_INTERVAL
+            if deadlines:
+                timeout = min(timeout, max(0.0, (min(deadlines) - clock.monotonic_ns()) / 1e9))
 
-            # ゴールの接触判定
-            if GPIO.input(GPIO_GOAL_POINT) == 0:
-                goal_touching_time += POLLING_INTERVAL
-                if goal_touching_time >= GOAL_DETECTION_DURATION + POLLING_INTERVAL:
-                    game_state.is_goaled = True
+            edge = edges.get(clock.to_real(timeout))
+            input_ns = edge.t_ns if edge is not None else clock.monotonic_ns()
+            if edge is not None:
+                detector.feed(edge)
             else:
-                goal_touching_time = 0
+                detector.poll(input_ns)
 
-            # スタートの接触判定
-            if GPIO.input(GPIO_START_POINT) == 0:
-                start_touching_time += POLLING_INTERVAL
-                if start_touching_time >= GOAL_DETECTION_DURATION + POLLING_INTERVAL:
-                    game_state.clear_game_state()
+            update = detector.take()
+            written_ns = clock.monotonic_ns()
+            touch_count = accumulator.apply(update, written_ns)
+            if tracer is not None and touch_count is not None:
+                # 書き込みと同時に配信するイベントより前の時刻とするため、書き込み前の時刻を記録する
+                tracer.stamp(Flow.touch, Hop.input, touch_count, input_ns)
+                tracer.stamp(Flow.touch, Hop.written, touch_count, written_ns)
 
-            else:
-                start_touching_time = 0
+        accumulator.flush()
+        edges.close()
+        if session_log is not None:
+            session_log.close()
+        if tracer is not None:
+            tracer.close()
 
     except Exception as e:
         print(f"{__file__}: {e}")
         sys.exit(e)
+
+
+def create_touch_detector() -> TouchDetector:
+    return TouchDetector(
+        (GPIO_1ST_STAGE, GPIO_2ND_STAGE),
+        GPIO_GOAL_POINT,
+        GPIO_START_POINT,
+        invincible_sec=INVINCIBLE_INTERVAL,
+        goal_dwell_sec=GOAL_DETECTION_DURATION,
+        start_dwell_sec=GOAL_DETECTION_DURATION,
+        checkpoint_pin=GPIO_CHECK_POINT,
+    )
+
+
+def start_detection(detector: TouchDetector, edges: EdgeQueue) -> None:
+    """ゲーム画面に遷移したときに判定を始める"""
+    # 判定開始時点で触れているピンは、その時刻に接触し始めたものとして扱う
+    detector.reset()
+    edges.clear()
+    for level in edges.current_levels():
+        detector.feed(level)
+
+
+class SplitTimer:
+    """ゲーム開始からチェックポイント・ゴールに達するまでの時間を計り、ゲーム状態に記録する
+
+    時間は判定結果に含まれるエッジの時刻の差であり、判定の呼び出し間隔や共有状態の書き込みの遅れを含まない。
+    """
+
+    def __init__(self, game_state: GameState) -> None:
+        self._game_state = game_state
+        self._start_ns: int | None = None
+        self._epoch: int | None = None
+
+    def start(self, t_ns: int) -> None:
+        """現在のゲームの開始時刻を t_ns とする"""
+        self._start_ns = t_ns
+        self._epoch = self._game_state.game_epoch
+
+    def apply(self, update: TouchUpdate) -> None:
+        """判定結果に含まれる区切りの時間を記録する。スタートに触れた場合はゲーム状態のリセット後に呼ぶ"""
+        if update.started_ns is not None:
+            self.start(update.started_ns)
+        if self._start_ns is None:
+            return
+
+        for split, t_ns in ((Split.checkpoint, update.checkpoint_ns), (Split.goal, update.goaled_ns)):
+            if t_ns is not None and t_ns >= self._start_ns:
+                self._game_state.record_split(split, (t_ns - self._start_ns) / 1e9, self._epoch)
+
+
+class TouchAccumulator:
+    """接触判定の結果をプロセス内にためて、共有状態への書き込みをまとめる
+
+    接触時間の増分は flush_interval_sec ごとにまとめて加算する。接触回数の増分は音やLEDの反応を遅らせないよう、
+    ためている接触時間と合わせてすぐに加算する。
+    加算は増分をためている間のゲームの世代を指定して行うため、その間に他のプロセスがゲーム状態をリセットした場合は
+    リセット前の接触として加算しない。
+    """
+
+    def __init__(self, game_state: GameState, flush_interval_sec: float = FLUSH_INTERVAL) -> None:
+        """
+        :param game_state: 加算先のゲーム状態
+        :param flush_interval_sec: 接触時間の増分をまとめて加算する間隔[sec]
+        """
+        self._game_state = game_state
+        self._flush_interval_ns = int(flush_interval_sec * 1e9)
+        self._epoch = game_state.game_epoch
+        self._touch_time = 0.0  # 未加算の接触時間[sec]
+        self._flush_at_ns: int | None = None
+        self._splits = SplitTimer(game_state)
+
+    def start_game(self, now_ns: int) -> None:
+        """ゲーム画面に遷移したときに、区切りの時間を計り始める"""
+        self._splits.start(now_ns)
+
+    def apply(self, update: TouchUpdate, now_ns: int) -> int | None:
+        """判定結果を反映する。加算の時刻になっていれば、ためている増分を加算する
+
+        :param update: 判定結果
+        :param now_ns: 現在時刻[ns]
+        :return: 接触回数を加算した場合は加算後の接触回数, それ以外はNone
+        """
+        # スタートに触れてからの接触を残すため、先にリセットする。ためている増分はリセット前の接触となる
+        if update.is_started:
+            self._game_state.clear_game_state()
+            self._epoch = self._game_state.game_epoch
+            self._discard()
+
+        self._touch_time += update.touch_time_sec
+        if self._touch_time > 0 and self._flush_at_ns is None:
+            self._flush_at_ns = now_ns + self._flush_interval_ns
+
+        count = None
+        is_due = self._flush_at_ns is not None and now_ns >= self._flush_at_ns
+        # ゴール時はクリア時間と同時に結果が読まれるため、接触時間も加算してからゴール状態にする
+        if update.touch_count > 0 or update.is_goaled or is_due:
+            count = self._add(update.touch_count)
+        self._splits.apply(update)
+        if update.is_goaled:
+            self._game_state.is_goaled = True
+        return count if update.touch_count > 0 else None
+
+    def flush(self) -> None:
+        """ためている増分をすぐに加算する"""
+        if self._touch_time > 0:
+            self._add(0)
+
+    def next_deadline_ns(self) -> int | None:
+        """ためている増分を加算する時刻, ためている増分がない場合はNone"""
+        return self._flush_at_ns
+
+    def on_game_cleared(self, now_ns: int) -> None:
+        """ゲーム状態がリセットされたことを通知する
+
+        他のプロセスによるリセットの場合は、ためている増分を破棄し、区切りの時間を now_ns から計り直す
+        """
+        epoch = self._game_state.game_epoch
+        if epoch != self._epoch:
+            self._epoch = epoch
+            self._discard()
+            self._splits.start(now_ns)
+
+    def _add(self, touch_count: int) -> int | None:
+        count = self._game_state.add_touch(touch_count, self._touch_time, self._epoch)
+        if count is None:
+            # 他のプロセスがリセットした後に加算しようとした。以降の増分は新しい世代として数える
+            self._epoch = self._game_state.game_epoch
+        self._discard()
+        return count
+
+    def _discard(self) -> None:
+        self._touch_time = 0.0
+        self._flush_at_ns = None
+
+
+def apply_touch_update(update: TouchUpdate, game_state: GameState, splits: SplitTimer | None = None) -> None:
+    """判定結果をすぐに共有状態に反映する
+
+    :param splits: 区切りの時間を記録する場合は、ゲームの開始時刻を与えた SplitTimer
+    """
+    if not update:
+        return
+
+    # スタートに触れてからの接触を残すため、先にリセットする
+    if update.is_started:
+        game_state.clear_game_state()
+    if update.touch_count > 0 or update.touch_time_sec > 0:
+        game_state.add_touch(update.touch_count, update.touch_time_sec)
+    if splits is not None:
+        splits.apply(update)
+    if update.is_goaled:
+        game_state.is_goaled = True
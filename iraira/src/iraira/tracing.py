@@ -0,0 +1,259 @@
+from __future__ import annotations
+
+import argparse
+import bisect
+import json
+from collections import defaultdict
+from dataclasses import dataclass
+from enum import Enum
+from pathlib import Path
+
+import numpy as np
+import numpy.typing as npt
+
+from iraira.clock import REAL_CLOCK, Clock
+
+_STAMP_DTYPE = np.dtype([("t_ns", "<i8"), ("flow", "u1"), ("hop", "u1"), ("key", "<i8")])
+TRACE_SUFFIX = ".npy"
+
+
+class Flow(Enum):
+    """計測する入力から出力までの経路"""
+
+    touch = 0x01  # 壁接触のエッジから接触音の書き込みまで key: 接触回数
+    volume = 0x02  # スティック操作の受信から音量を反映した信号の書き込みまで key: 各プロセスでの連番
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class Hop(Enum):
+    """経路上の計測点"""
+
+    input = 0x01  # 入力を検出した (エッジ・シリアル受信)
+    written = 0x02  # 共有状態に書き込んだ
+    observed = 0x03  # 再生プロセスが状態変化を受け取った
+    enqueued = 0x04  # 状態を反映した信号を Player.write に渡し終えた
+
+    def __str__(self) -> str:
+        return self.name
+
+
+# 入力に続く計測点と、前の計測点との対応付けの方法。Trueの場合は同じkeyで、Falseの場合は時刻のみで対応付ける
+# 音量は再生プロセスがブロックごとに読むため、書き込み後に最初に変化を読んだブロックを対応させる
+_FLOW_HOPS: dict[Flow, tuple[tuple[Hop, bool], ...]] = {
+    Flow.touch: ((Hop.written, True), (Hop.observed, True), (Hop.enqueued, True)),
+    Flow.volume: ((Hop.written, True), (Hop.observed, False), (Hop.enqueued, True)),
+}
+
+
+class Tracer:
+    """計測点の時刻をプロセスごとのリングバッファに記録する
+
+    記録は固定長の配列への書き込みのみで、溢れた場合は古い記録から上書きする。
+    close() でファイルに書き出し、全プロセスの記録を load_traces() で読み込んで経路ごとに対応付ける。
+    時刻は全プロセスで同じ時刻源の Clock.monotonic_ns() とする。
+    """
+
+    def __init__(self, path: Path, clock: Clock = REAL_CLOCK, capacity: int = 1 << 16) -> None:
+        """
+        :param path: 書き出すファイル
+        :param clock: 時刻源
+        :param capacity: 保持する記録の数
+        """
+        self._path = path
+        self._clock = clock
+        self._stamps = np.zeros(capacity, dtype=_STAMP_DTYPE)
+        self._count = 0
+
+    def stamp(self, flow: Flow, hop: Hop, key: int, t_ns: int | None = None) -> None:
+        """
+        :param t_ns: 計測点の時刻, Noneの場合は時刻源の現在時刻
+        """
+        if t_ns is None:
+            t_ns = self._clock.monotonic_ns()
+        self._stamps[self._count % len(self._stamps)] = (t_ns, flow.value, hop.value, key)
+        self._count += 1
+
+    def stamps(self) -> npt.NDArray[np.void]:
+        """保持している記録を時刻順に返す"""
+        n = len(self._stamps)
+        if self._count <= n:
+            return self._stamps[: self._count].copy()
+        i = self._count % n
+        return np.concatenate((self._stamps[i:], self._stamps[:i]))
+
+    def close(self) -> None:
+        np.save(self._path, self.stamps())
+
+
+def load_traces(trace_dir: Path) -> dict[str, npt.NDArray[np.void]]:
+    """全プロセスの記録を読み込む
+
+    :return: プロセス名ごとの記録
+    """
+    traces = {path.stem: np.load(path) for path in sorted(trace_dir.glob(f"*{TRACE_SUFFIX}"))}
+    if not traces:
+        raise FileNotFoundError(f"no trace in {trace_dir}")
+    return traces
+
+
+@dataclass(frozen=True)
+class TraceChain:
+    """1つの入力について対応付けた計測点の時刻"""
+
+    flow: Flow
+    key: int
+    hops: tuple[tuple[Hop, int, str], ...]  # (計測点, 時刻, プロセス名)
+
+    @property
+    def latency_ns(self) -> int:
+        return self.hops[-1][1] - self.hops[0][1]
+
+
+def link_chains(traces: dict[str, npt.NDArray[np.void]], max_hop_sec: float = 1.0) -> list[TraceChain]:
+    """入力から出力まで全ての計測点が揃った経路を対応付ける
+
+    :param max_hop_sec: 計測点の間の最大時間[sec]。画面遷移などで出力されなかった入力を後の入力と対応付けないために使う
+    """
+    # 計測点ごと、および計測点とkeyごとの時刻順の記録 (時刻, key, プロセス名)
+    by_hop: dict[tuple[Flow, Hop], list[tuple[int, int, str]]] = defaultdict(list)
+    by_key: dict[tuple[Flow, Hop, int], list[tuple[int, int, str]]] = defaultdict(list)
+    for process, stamps in traces.items():
+        for t_ns, flow, hop, key in stamps.tolist():
+            point = (t_ns, key, process)
+            by_hop[Flow(flow), Hop(hop)].append(point)
+            by_key[Flow(flow), Hop(hop), key].append(point)
+    for points in (*by_hop.values(), *by_key.values()):
+        points.sort()
+
+    max_hop_ns = int(max_hop_sec * 1e9)
+    chains: list[TraceChain] = []
+    for flow, next_hops in _FLOW_HOPS.items():
+        for input_point in by_hop[flow, Hop.input]:
+            t_ns, key, process = input_point
+            hops = [(Hop.input, t_ns, process)]
+            for hop, same_key in next_hops:
+                points = by_key[flow, hop, key] if same_key else by_hop[flow, hop]
+                i = bisect.bisect_left(points, (t_ns,))
+                if i == len(points) or points[i][0] - t_ns > max_hop_ns:
+                    break
+                t_ns, key, process = points[i]
+                hops.append((hop, t_ns, process))
+            else:
+                chains.append(TraceChain(flow, input_point[1], tuple(hops)))
+    return chains
+
+
+@dataclass(frozen=True)
+class Histogram:
+    """対数間隔の階級による遅延の度数分布"""
+
+    edges_ms: tuple[float, ...]  # 階級の境界[ms]
+    counts: tuple[int, ...]
+    p50_ms: float
+    p99_ms: float
+    max_ms: float
+
+    @staticmethod
+    def from_ns(latencies_ns: npt.NDArray[np.int64], min_ms: float = 0.01, max_ms: float = 1000.0) -> Histogram:
+        ms = latencies_ns / 1e6
+        edges = np.geomspace(min_ms, max_ms, int(np.log10(max_ms / min_ms)) * 4 + 1)
+        counts, _ = np.histogram(np.clip(ms, min_ms, max_ms), edges)
+        p50, p99 = np.percentile(ms, [50, 99]) if len(ms) else (0.0, 0.0)
+        return Histogram(
+            tuple(edges.tolist()),
+            tuple(counts.tolist()),
+            float(p50),
+            float(p99),
+            float(ms.max()) if len(ms) else 0.0,
+        )
+
+    def __str__(self) -> str:
+        lines = [f"n={sum(self.counts)} p50={self.p50_ms:.2f}ms p99={self.p99_ms:.2f}ms max={self.max_ms:.2f}ms"]
+        peak = max(self.counts, default=0)
+        for lo, hi, n in zip(self.edges_ms, self.edges_ms[1:], self.counts):
+            if n > 0:
+                lines.append(f"  {lo:8.2f} - {hi:8.2f} ms {n:6d} {'#' * max(1, round(n / peak * 40))}")
+        return "\n".join(lines)
+
+
+def latency_histograms(chains: list[TraceChain]) -> dict[str, Histogram]:
+    """経路ごとに、入力から出力までと各計測点の間の遅延の度数分布を求める
+
+    :return: "経路 計測点→計測点" ごとの度数分布
+    """
+    latencies: dict[str, list[int]] = defaultdict(list)
+    for chain in chains:
+        latencies[f"{chain.flow} {chain.hops[0][0]}->{chain.hops[-1][0]}"].append(chain.latency_ns)
+        for (hop0, t0, _), (hop1, t1, _) in zip(chain.hops, chain.hops[1:]):
+            latencies[f"{chain.flow} {hop0}->{hop1}"].append(t1 - t0)
+    return {k: Histogram.from_ns(np.array(v, dtype=np.int64)) for k, v in latencies.items()}
+
+
+def chrome_trace(traces: dict[str, npt.NDArray[np.void]], chains: list[TraceChain]) -> dict:
+    """Chromeのトレース形式 (chrome://tracing, Perfetto) に変換する
+
+    計測点はプロセスごとの瞬間イベント、対応付けた経路は計測点の間の区間とフロー矢印で表す。
+    """
+    pids = {process: i + 1 for i, process in enumerate(traces)}
+    events: list[dict] = [
+        {"name": "process_name", "ph": "M", "pid": pid, "args": {"name": process}} for process, pid in pids.items()
+    ]
+    for process, stamps in traces.items():
+        for t_ns, flow, hop, key in stamps.tolist():
+            events.append(
+                {
+                    "name": f"{Flow(flow)} {Hop(hop)}",
+                    "ph": "i",
+                    "s": "t",
+                    "ts": t_ns / 1e3,
+                    "pid": pids[process],
+                    "tid": flow,
+                    "args": {"key": key},
+                }
+            )
+
+    for i, chain in enumerate(chains):
+        for (hop0, t0, p0), (hop1, t1, p1) in zip(chain.hops, chain.hops[1:]):
+            name = f"{chain.flow} {hop0}->{hop1}"
+            args = {"key": chain.key}
+            events.append(
+                {
+                    "name": name,
+                    "ph": "X",
+                    "ts": t0 / 1e3,
+                    "dur": (t1 - t0) / 1e3,
+                    "pid": pids[p1],
+                    "tid": 0,
+                    "args": args,
+                }
+            )
+        for j, (hop, t_ns, process) in enumerate(chain.hops):
+            phase = "s" if j == 0 else "f" if j == len(chain.hops) - 1 else "t"
+            flow_event = {"name": str(chain.flow), "cat": "flow", "ph": phase, "id": i, "ts": t_ns / 1e3}
+            events.append({**flow_event, "pid": pids[process], "tid": chain.flow.value, "bp": "e"})
+
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def report_traces(trace_dir: Path) -> None:
+    """記録した計測点から遅延の度数分布を表示し、Chromeのトレース形式で trace.json に書き出す"""
+    traces = load_traces(trace_dir)
+    chains = link_chains(traces)
+    for name, stamps in traces.items():
+        print(f"{name}: {len(stamps)} stamps")
+    for name, histogram in sorted(latency_histograms(chains).items()):
+        print(f"{name}: {histogram}")
+
+    path = trace_dir / "trace.json"
+    with path.open("w", encoding="utf-8") as f:
+        json.dump(chrome_trace(traces, chains), f)
+    print(f"chrome trace: {path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="iraira.tracing")
+    parser.add_argument("trace_dir", type=Path, help="--trace で記録したディレクトリ")
+    args = parser.parse_args()
+    report_traces(args.trace_dir)
@@ -1,5 +1,8 @@
 from __future__ import annotations
 
+import sys
+import time
+
 import numpy as np
 import numpy.typing as npt
 
@@ -24,6 +27,95 @@ def traction_wave(x: npt.NDArray[np.floating], count_anti_node: int = 4) -> npt.
     return multi_sin_abs
 
 
+def traction_wave_into(
+    x: npt.NDArray[np.floating],
+    count_anti_node: int,
+    out: npt.NDArray[np.float64],
+    scratch: npt.NDArray[np.float64],
+    gain: float = 1.0,
+) -> npt.NDArray[np.float64]:
+    """traction_wave(x, count_anti_node) * gain を一時配列を確保せずにoutへ書き込む
+
+    最後の腹の符号反転はマスク代入ではなく、周期内の位置 [0 1) と最後の腹の開始位置の比較結果 k (0 or 1) から
+    符号係数 (1 - 2k) * gain を作って掛けることで行う。低速な np.remainder も使わない。
+
+    :param x: 角度[rad]
+    :param count_anti_node: 1周期の腹の数, 3以上を指定する
+    :param out: 出力先, xと同じ長さ
+    :param scratch: 作業領域, xと同じ長さ
+    :param gain: 振幅
+    :return: out
+    """
+    if not count_anti_node >= 3:
+        raise ValueError("count_anti_node expected 3 or more")
+
+    # 符号係数: 周期内の位置 u - floor(u) が最後の腹にあれば -gain, それ以外は gain
+    np.multiply(x, 1 / (2 * np.pi), out=scratch)
+    np.floor(scratch, out=out)
+    np.subtract(scratch, out, out=scratch)
+    np.greater(scratch, (count_anti_node - 1) / count_anti_node, out=scratch)
+    np.multiply(scratch, -2 * gain, out=scratch)
+    np.add(scratch, gain, out=scratch)
+
+    np.multiply(x, count_anti_node / 2, out=out)
+    np.sin(out, out=out)
+    np.abs(out, out=out)
+    np.multiply(out, scratch, out=out)
+    return out
+
+
+def traction_wave_int16(
+    x: npt.NDArray[np.floating],
+    count_anti_node: int,
+    volume: float,
+    out: npt.NDArray[np.int16],
+    scratch: npt.NDArray[np.float64],
+) -> npt.NDArray[np.int16]:
+    """(traction_wave(x, count_anti_node) * 32767 * volume).astype(np.int16) と同じ値をoutへ書き込む
+
+    :param x: 角度[rad]
+    :param count_anti_node: 1周期の腹の数, 3以上を指定する
+    :param volume: 音量 0~1
+    :param out: 出力先, xと同じ長さ
+    :param scratch: 作業領域, 形状 (2, len(x))
+    :return: out
+    """
+    wave = traction_wave_into(x, count_anti_node, scratch[0], scratch[1], gain=32767)
+    np.multiply(wave, volume, out=wave)
+    np.copyto(out, wave, casting="unsafe")
+    return out
+
+
+def benchmark_traction_wave(duration_sec: float = 0.5) -> None:
+    """traction_wave と traction_wave_int16 の一致確認と生成速度の比較"""
+    rng = np.random.default_rng(0)
+    for count_anti_node in (3, 4, 7, 100, 1000):
+        x = rng.uniform(-100, 100, 10_000)
+        volume = rng.uniform()
+        expected = (traction_wave(x, count_anti_node) * 32767 * volume).astype(np.int16)
+        actual = traction_wave_int16(x, count_anti_node, volume, np.zeros_like(expected), np.zeros((2, len(x))))
+        np.testing.assert_array_equal(actual, expected)
+    print("traction_wave_int16 == traction_wave: OK")
+
+    for chunk in (64, 256, 1024, 4410, 44100):
+        x = 2 * np.pi * 63 * np.arange(chunk) / 44_100
+        out = np.zeros(chunk, dtype=np.int16)
+        scratch = np.zeros((2, chunk))
+
+        results = []
+        for label, render in (
+            ("traction_wave", lambda: (traction_wave(x, 4) * 32767 * 0.5).astype(np.int16)),
+            ("traction_wave_int16", lambda: traction_wave_int16(x, 4, 0.5, out, scratch)),
+        ):
+            samples = 0
+            start = time.perf_counter()
+            while time.perf_counter() - start < duration_sec:
+                render()
+                samples += chunk
+            results.append(f"{label} {samples / (time.perf_counter() - start):>13,.0f} samples/s")
+        print(f"chunk={chunk:>5}: {'  '.join(results)}")
+
+
 def show_traction_wave() -> None:
     """traction_wave の動作確認"""
     import matplotlib.pyplot as plt
@@ -47,4 +139,7 @@ def show_traction_wave() -> None:
 
 
 if __name__ == "__main__":
-    show_traction_wave()
+    if sys.argv[1:] == ["benchmark"]:
+        benchmark_traction_wave()
+    else:
+        show_traction_wave()
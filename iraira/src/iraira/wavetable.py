@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import os
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+import numpy.typing as npt
+
+from iraira.traction_wave import traction_wave
+from iraira.util import RepoPath
+
+_default_cache_dir = RepoPath().db_dir / "wavetable"
+
+
+class WavetableBank:
+    """腹の数ごとに1周期分の牽引力波形を保持するテーブル群
+
+    任意の周波数の信号を、1周期分のテーブルを線形補間で引くことで生成する。
+    テーブルは腹の数ごとに初回使用時に生成し、合計サイズが上限を超えると最も使われていないものから破棄する。
+    cache_dirを指定すると生成したテーブルを .npy として保存し、次回以降はメモリマップで読み込む。
+    """
+
+    def __init__(
+        self,
+        samples_per_anti_node: int = 256,
+        max_bytes: int = 32 * 1024 * 1024,
+        cache_dir: Path | None = _default_cache_dir,
+    ) -> None:
+        """
+        :param samples_per_anti_node: 腹1つあたりのテーブル長
+        :param max_bytes: メモリ上に保持するテーブルの合計サイズ上限[byte]
+        :param cache_dir: テーブルを保存するディレクトリ, Noneの場合は保存しない
+        """
+        self._samples_per_anti_node = samples_per_anti_node
+        self._max_bytes = max_bytes
+        self._cache_dir = cache_dir
+        self._tables: OrderedDict[int, npt.NDArray[np.float64]] = OrderedDict()
+        self._bytes = 0
+
+    @property
+    def nbytes(self) -> int:
+        """メモリ上に保持しているテーブルの合計サイズ[byte]"""
+        return self._bytes
+
+    def table(self, count_anti_node: int) -> npt.NDArray[np.float64]:
+        """1周期分の波形テーブルを取得する
+
+        1行目が角度 2π*i/resolution の波形値、2行目が次の値との差分であり、形状は (2, resolution) となる。
+        resolution は count_anti_node * samples_per_anti_node である。
+
+        :param count_anti_node: 1周期の腹の数, 3以上を指定する
+        """
+        t = self._tables.get(count_anti_node)
+        if t is not None:
+            self._tables.move_to_end(count_anti_node)
+            return t
+
+        t = self._load_or_build(count_anti_node)
+        self._tables[count_anti_node] = t
+        self._bytes += t.nbytes
+        while self._bytes > self._max_bytes and len(self._tables) > 1:
+            _, evicted = self._tables.popitem(last=False)
+            self._bytes -= evicted.nbytes
+        return t
+
+    def _build(self, count_anti_node: int) -> npt.NDArray[np.float64]:
+        resolution = count_anti_node * self._samples_per_anti_node
+        x = np.linspace(0, 2 * np.pi, resolution, endpoint=False)
+        wave = traction_wave(x, count_anti_node)
+        return np.stack([wave, np.roll(wave, -1) - wave])
+
+    def _load_or_build(self, count_anti_node: int) -> npt.NDArray[np.float64]:
+        if self._cache_dir is None:
+            return self._build(count_anti_node)
+
+        path = self._cache_dir / f"traction_{count_anti_node}_{self._samples_per_anti_node}.npy"
+        if not path.exists():
+            self._cache_dir.mkdir(parents=True, exist_ok=True)
+            # 書き込み途中のファイルを他プロセスが読まないよう一時ファイルから置き換える
+            tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+            with tmp_path.open("wb") as f:
+                np.save(f, self._build(count_anti_node))
+            os.replace(tmp_path, path)
+
+        return np.load(path, mmap_mode="r")
+
+    def lookup_into(
+        self,
+        x: npt.NDArray[np.float64],
+        count_anti_node: int,
+        out: npt.NDArray[np.float64],
+        scratch: npt.NDArray[np.float64],
+        index: npt.NDArray[np.intp],
+    ) -> None:
+        """テーブルを線形補間で引き、traction_wave(x, count_anti_node) に相当する値をoutに書き込む
+
+        :param x: 角度[rad]
+        :param count_anti_node: 1周期の腹の数, 3以上を指定する
+        :param out: 出力先, xと同じ長さ
+        :param scratch: 作業領域, xと同じ長さ
+        :param index: 作業領域, xと同じ長さ
+        """
+        wave, diff = self.table(count_anti_node)
+        resolution = len(wave)
+
+        # テーブル上の位置 [0 resolution) を整数部と補間係数に分ける
+        np.multiply(x, resolution / (2 * np.pi), out=scratch)
+        np.remainder(scratch, resolution, out=scratch)
+        np.floor(scratch, out=out)
+        np.copyto(index, out, casting="unsafe")
+        np.subtract(scratch, out, out=scratch)
+
+        # wave[i] + diff[i] * frac
+        np.take(diff, index, out=out)
+        np.multiply(out, scratch, out=out)
+        np.take(wave, index, out=scratch)
+        np.add(out, scratch, out=out)
+
+
+def benchmark_wavetable(duration_sec: float = 1.0, block: int = 4410) -> None:
+    """直接計算とテーブル参照の生成速度・誤差を比較する"""
+    bank = WavetableBank(cache_dir=None)
+    x = np.linspace(0, 2 * np.pi * 63 * block / 44_100, block)
+    out = np.zeros(block)
+    scratch = np.zeros(block)
+    index = np.zeros(block, dtype=np.intp)
+
+    for count_anti_node in (3, 4, 100, 1000):
+        start = time.perf_counter()
+        bank.table(count_anti_node)
+        build_ms = (time.perf_counter() - start) * 1000
+
+        bank.lookup_into(x, count_anti_node, out, scratch, index)
+        error = np.abs(out - traction_wave(x, count_anti_node)).max()
+
+        results = []
+        for label, render in (
+            ("traction_wave", lambda: traction_wave(x, count_anti_node)),
+            ("wavetable", lambda: bank.lookup_into(x, count_anti_node, out, scratch, index)),
+        ):
+            samples = 0
+            start = time.perf_counter()
+            while time.perf_counter() - start < duration_sec / 2:
+                render()
+                samples += block
+            results.append(f"{label} {samples / (time.perf_counter() - start):>13,.0f} samples/s")
+
+        print(
+            f"count_anti_node={count_anti_node:>4}: {'  '.join(results)}  "
+            f"build {build_ms:6.2f} ms  max error {error:.2e}"
+        )
+
+
+if __name__ == "__main__":
+    benchmark_wavetable()
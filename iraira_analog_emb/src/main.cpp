@@ -13,6 +13,16 @@ const int RESOLUTION = 5;
 
 BluetoothSerial SerialBT;
 
+// シリアル通信のフレーム形式 (iraira/src/iraira/serial_protocol.py と一致させること)
+// | SYNC (0xA5) | 種類 (1byte) | ペイロード長 (1byte) | ペイロード | CRC-8 (1byte) |
+const uint8_t FRAME_SYNC = 0xA5;
+const uint8_t FRAME_ANALOG = 0x01;  // payload: ADC値 uint16 little endian
+const uint8_t FRAME_BUTTON = 0x02;  // payload: ボタン操作 uint8
+const uint8_t BUTTON_PRESSED = 0;
+const uint8_t BUTTON_RELEASED = 1;
+const uint8_t BUTTON_LONG_PRESSED = 2;
+const uint8_t FRAME_MAX_PAYLOAD = 16;
+
 #define COLOR_BLACK { 0x00, 0x00, 0x00 }
 #define COLOR_WHITE { 0xFF, 0xFF, 0xFF }
 #define COLOR_RED { 0xFF, 0x00, 0x00 }
@@ -119,6 +129,39 @@ void displayAnalogValue(int analogValue){
   }
 }
 
+// CRC-8 多項式 0x07, 初期値 0
+uint8_t crc8(const uint8_t* data, size_t len){
+  uint8_t crc = 0;
+  for(size_t i=0;i<len;i++){
+    crc ^= data[i];
+    for(int b=0;b<8;b++){
+      crc = (crc & 0x80) ? (uint8_t)((crc << 1) ^ 0x07) : (uint8_t)(crc << 1);
+    }
+  }
+  return crc;
+}
+
+void sendFrame(uint8_t type, const uint8_t* payload, uint8_t len){
+  uint8_t frame[FRAME_MAX_PAYLOAD + 4];
+  frame[0] = FRAME_SYNC;
+  frame[1] = type;
+  frame[2] = len;
+  memcpy(&frame[3], payload, len);
+  frame[3 + len] = crc8(&frame[1], len + 2);
+
+  Serial.write(frame, len + 4);
+  SerialBT.write(frame, len + 4);
+}
+
+void sendAnalog(int analogValue){
+  const uint8_t payload[2] = { (uint8_t)(analogValue & 0xFF), (uint8_t)((analogValue >> 8) & 0xFF) };
+  sendFrame(FRAME_ANALOG, payload, sizeof(payload));
+}
+
+void sendButton(uint8_t event){
+  sendFrame(FRAME_BUTTON, &event, 1);
+}
+
 void setup() {
   M5.begin(true,true,true);//第三引数でdisplayのenable
   delay(50);
@@ -138,22 +181,18 @@ void loop() {
   int readAnalogValue=analogRead(analogIn);
   displayAnalogValue(readAnalogValue);
 
-  float analogValue=(float)(readAnalogValue)/(MAX-MIN);
-  Serial.printf("%.3f\n",analogValue);
-  SerialBT.printf("%.3f\n",analogValue);
+  sendAnalog(readAnalogValue);
 
   if(M5.Btn.wasPressed()){
     led_put_on(5);
     lastPressedTime = millis();
-    Serial.printf("p\n");
-    SerialBT.printf("p\n");
+    sendButton(BUTTON_PRESSED);
   }
 
   if(M5.Btn.wasReleased()){
     led_put_on(5);
     isLongPressed=false;
-    Serial.printf("r\n");
-    SerialBT.printf("r\n");
+    sendButton(BUTTON_RELEASED);
   }
 
   if(M5.Btn.isPressed()){
@@ -161,8 +200,7 @@ void loop() {
       isLongPressed=true;
 
       led_put_on(5);
-      Serial.printf("l\n");
-      SerialBT.printf("l\n");
+      sendButton(BUTTON_LONG_PRESSED);
     }
   }
 